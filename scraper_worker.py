@@ -1,19 +1,50 @@
 import os, sys
-import win32com.client as win32
+import asyncio
+import contextvars
 import gc
-from io import StringIO
+import hashlib
+import multiprocessing
+import pickle
 import pandas as pd
 import numpy as np
 import json
+import re
+import requests
+import shutil
+import sqlite3
+import tempfile
+import threading
 import time, calendar
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime
+from functools import partial
 from glob import glob
+from html.parser import HTMLParser
+from urllib.parse import urljoin
 from playwright.sync_api import sync_playwright, Page
-from pathlib import Path
-
-# Config and log paths passed as arguments
+from playwright.async_api import async_playwright
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.hyperlink import Hyperlink
+try:
+    import psutil
+except ImportError:  # RSS is read from /proc where there is one, else not reported
+    psutil = None
+try:
+    import xlsxwriter
+except ImportError:  # workbooks are streamed with openpyxl's write-only mode instead
+    xlsxwriter = None
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # the record sink falls back to one .xlsx file per EWB
+    pa = pq = None
+
+# Config and log paths passed as arguments (or: --bench-xls <corpus dir> [workers], --bench-stock [rows] [hsns])
 CONFIG_PATH = sys.argv[1]
-LOG_PATH = sys.argv[2]
+LOG_PATH = sys.argv[2] if not CONFIG_PATH.startswith("--bench-") else os.devnull
 # Mapping of month names to numbers
 month_name_to_number = {
     "January": 1, "February": 2, "March": 3,
@@ -21,13 +52,42 @@ month_name_to_number = {
     "July": 7, "August": 8, "September": 9,
     "October": 10, "November": 11, "December": 12
 }
-in_radio_button = 'input[id="ctl00_ContentPlaceHolder1_RBL_OutInward_1"]'
-out_radio_button = 'input[id="ctl00_ContentPlaceHolder1_RBL_OutInward_0"]'
+in_radio_button_id = "ctl00_ContentPlaceHolder1_RBL_OutInward_1"
+out_radio_button_id = "ctl00_ContentPlaceHolder1_RBL_OutInward_0"
+in_radio_button = f'input[id="{in_radio_button_id}"]'
+out_radio_button = f'input[id="{out_radio_button_id}"]'
 EWB_MIS_Report_Excel = 'EWB_MIS_Report_Excel'
 DEFAULT_TIMEOUT = 180000 # 180 sec or 3 mins
 _5_MIN_TIMEOUT = 300000 # 300 sec or 5 mins
+REPORT_POLL_MS = 50 # wait between the checks of the report tabs for their postbacks and downloads
 _IN_ = "In"
 _OUT_ = "Out"
+EWB_CACHE_PATH = "./output/ewb_cache.sqlite"
+RUN_MANIFEST_PATH = "./output/run_manifest.sqlite"
+SYNC_STATE_PATH = "./output/sync_state.sqlite"
+# Cookies of the last login, reused while the portal accepts them. Kept out of ./output (which is
+# shared with the reports) in the user's home, readable by the user only
+SESSION_STATE_PATH = os.path.join(os.path.expanduser("~"), ".eway_bill_processing", "session_state.json")
+# Where the portal sends a page once the login session is gone (lower case parts of the URL or title)
+SESSION_EXPIRED_MARKERS = ("gstsso.nic.in", "sessionexpired", "session expired")
+LOGIN_FORM_SELECTOR = "#txt_username" # user name box of the GST login form
+# Title of a page and whether it holds the login form, in one round trip. Only asked when a page
+# did not come back as expected, the URL alone is checked on the way
+JS_LOGIN_CHECK = "selector => [document.title, document.querySelector(selector) !== null]"
+MERGE_CHUNK_ROWS = 20000 # rows per chunk of the streaming merges, halved while over the memory ceiling
+MIN_MERGE_CHUNK_ROWS = 1000
+MIN_POOL_FILES = 4 # reports parsed in a process pool from this many files and ...
+MIN_POOL_MB = 10 # ... this many MB on, starting spawned workers costs more than smaller batches
+REPORT_SPILL_DIR = ".parsed" # parsed reports waiting for the merge, in the GSTIN's download directory
+MAX_SHEET_LINKS = 65530 # Excel's limit of hyperlinks per worksheet
+EWB_CACHE_MUTABLE_TTL = 12 * 3600 # 12 hours, reuse of cached pages of EWBs that may still change
+GSTIN_BASED_RPT_URL = "https://mis.ewaybillgst.gov.in/Verification/GSTINBasedRpt.aspx"
+gstin_textbox = 'input[name="ctl00$ContentPlaceHolder1$txt_gstin"]'
+state_dropdown = 'select[name="ctl00$ContentPlaceHolder1$ddl_gstinstcode"]'
+go_button_name = "ctl00$ContentPlaceHolder1$btnsbmt"
+go_button = f'input[name="{go_button_name}"][value="GO"]'
+export_excel_button_name = "ctl00$ContentPlaceHolder1$btn_export_excel"
+export_excel_button = "#ctl00_ContentPlaceHolder1_btn_export_excel"
 # Map of state option values to state group names
 state_options = {
     "0": "Select State",  # Skip this default option
@@ -41,13 +101,122 @@ state_options = {
     "8": "Andaman&Nicobar_ArunachalPradesh_Assam_Bihar_Chhattisgarh_Manipur_Meghalaya_Mizoram_Nagaland_Odisha_Sikkim_Tripura_WestBengal"
 }
 
+# (label, log file) of the browser context lane the current thread/task works for, see _work_lane
+_log_context = contextvars.ContextVar("log_context", default=None)
+
+
 def log(msg: str):
     timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+    lane = _log_context.get()
+    if lane is not None:
+        label, lane_log_path = lane
+        msg = f"[{label}] {msg}"
+        with open(lane_log_path, "a", encoding="utf-8") as f:
+            f.write(f"{timestamp} - {msg}\n")
     with open(LOG_PATH, "a", encoding="utf-8") as f:
         f.write(f"{timestamp} - {msg}\n")
     print(f"{timestamp} - {msg}")
 
 
+_step_latencies = {}  # step name -> list of seconds
+_step_latencies_lock = threading.Lock()
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 30, 60, 180)
+
+
+def _record_latency(step: str, seconds: float):
+    with _step_latencies_lock:
+        _step_latencies.setdefault(step, []).append(seconds)
+
+
+def _log_latency_histograms():
+    """Log count, percentiles and a bucket histogram per step, the data to tune the timeouts with."""
+    with _step_latencies_lock:
+        latencies = {step: sorted(values) for step, values in _step_latencies.items()}
+    for step, values in sorted(latencies.items()):
+        p50, p90, p99 = (values[min(int(len(values) * q), len(values) - 1)] for q in (0.5, 0.9, 0.99))
+        buckets, lower = [], 0
+        for upper in LATENCY_BUCKETS + (float("inf"),):
+            count = sum(1 for v in values if lower <= v < upper)
+            if count:
+                buckets.append(f"<{upper:g}s: {count}" if upper != float("inf") else f">={lower:g}s: {count}")
+            lower = upper
+        log(f"⏱ {step}: {len(values)} x, p50 {p50:.2f}s, p90 {p90:.2f}s, p99 {p99:.2f}s, max {values[-1]:.2f}s | {', '.join(buckets)}")
+
+
+_stage_peak_rss = {}  # stage name -> highest peak RSS in MB over all GSTINs
+
+
+def _current_rss_mb():
+    """Resident memory of this process in MB, None where it cannot be read."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / (1 << 20)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class _MemoryWatch:
+    """
+    Samples the RSS of the process on a thread while a stage runs and logs its peak on exit.
+    The streaming merges read chunk_rows rows at a time and call checkpoint() between chunks,
+    which halves chunk_rows while the process is above limit_mb (0 = no ceiling).
+    """
+
+    def __init__(self, stage: str, gstin: str = None, limit_mb: int = 0, chunk_rows: int = MERGE_CHUNK_ROWS):
+        self.stage = stage
+        self.gstin = gstin
+        self.limit_mb = limit_mb
+        self.chunk_rows = chunk_rows
+        self.peak_mb = None
+        self.stop = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self._sample()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+        self._sample()
+        if self.peak_mb is not None:
+            _stage_peak_rss[self.stage] = max(_stage_peak_rss.get(self.stage, 0), self.peak_mb)
+            over = f" ⚠️ above the {self.limit_mb} MB ceiling" if self.limit_mb and self.peak_mb > self.limit_mb else ""
+            log(f"📈 Peak RSS during {self.stage} for GSTIN: {self.gstin}: {self.peak_mb:.0f} MB{over}")
+        return False
+
+    def _run(self):
+        while not self.stop.wait(0.2):
+            self._sample()
+
+    def _sample(self):
+        rss = _current_rss_mb()
+        if rss is not None and (self.peak_mb is None or rss > self.peak_mb):
+            self.peak_mb = rss
+        return rss
+
+    def over_limit(self) -> bool:
+        rss = self._sample() if self.limit_mb else None
+        return rss is not None and rss > self.limit_mb
+
+    def checkpoint(self):
+        if not self.over_limit():
+            return
+        gc.collect()
+        if self.over_limit() and self.chunk_rows > MIN_MERGE_CHUNK_ROWS:
+            self.chunk_rows = max(self.chunk_rows // 2, MIN_MERGE_CHUNK_ROWS)
+            log(f"⚠️ Memory above the {self.limit_mb} MB ceiling during {self.stage}, continuing with chunks of {self.chunk_rows} rows")
+
+
+def _log_stage_memory():
+    for stage, peak_mb in _stage_peak_rss.items():
+        log(f"📈 {stage}: peak RSS {peak_mb:.0f} MB")
+
+
 def get_days_in_month(month_year: tuple):
     month_name, year = month_year
     month_num = month_name_to_number[month_name]
@@ -69,7 +238,7 @@ def login_and_open_ewb_mis(page: Page, context, username: str, password: str) ->
     log("Waiting for manual CAPTCHA + OTP entry...")
     page.wait_for_url("**/webfrmdd.aspx", timeout=_5_MIN_TIMEOUT)
     log("✅ Successfully logged in to GST portal.")
-    page.wait_for_load_state("networkidle", timeout=_5_MIN_TIMEOUT)
+    started = time.time()
     log("Clicking button to open EWB MIS portal...")
     # Wait for the btnewbmis button to be available
     button_selector = 'input[name="btnewbmis"]'
@@ -84,14 +253,14 @@ def login_and_open_ewb_mis(page: Page, context, username: str, password: str) ->
     # Get the new page (EWB MIS portal)
     ewb_mis_page = new_page_info.value
     
-    # Wait for the new page to fully load
-    ewb_mis_page.wait_for_load_state('networkidle', timeout=_5_MIN_TIMEOUT)
+    # Wait for the new page's document, its session cookies are set by then
+    ewb_mis_page.wait_for_load_state('domcontentloaded', timeout=_5_MIN_TIMEOUT)
     log(f"EWB MIS portal opened successfully: {ewb_mis_page.url}")
     
-    ewb_mis_page.goto("https://mis.ewaybillgst.gov.in/Verification/GSTINBasedRpt.aspx", timeout=_5_MIN_TIMEOUT)
-    # Optional: wait for DOM or network idle
-    # ewb_mis_page.wait_for_load_state("domcontentloaded", timeout=_5_MIN_TIMEOUT)
-    ewb_mis_page.wait_for_load_state("networkidle", timeout=_5_MIN_TIMEOUT)
+    ewb_mis_page.goto(GSTIN_BASED_RPT_URL, wait_until="domcontentloaded", timeout=_5_MIN_TIMEOUT)
+    # The report form is usable as soon as its GSTIN box is there
+    ewb_mis_page.wait_for_selector(gstin_textbox, timeout=_5_MIN_TIMEOUT)
+    _record_latency("open_ewb_mis", time.time() - started)
     log(f"✅ GSTINBasedRpt.aspx portal opened successfully: URL= {ewb_mis_page.url}")
     # Bring the new tab to front
     ewb_mis_page.bring_to_front()
@@ -99,6 +268,136 @@ def login_and_open_ewb_mis(page: Page, context, username: str, password: str) ->
     return ewb_mis_page
 
 
+def _new_request_filter(block_resource_types, block_url_patterns, allow_url_patterns) -> dict:
+    """
+    Allow/deny policy for the automation contexts plus the counters it reports. A request whose
+    URL matches an allow pattern always goes through, otherwise it is aborted when its resource
+    type is blocked or its URL matches a block pattern. Patterns are regular expressions, an
+    invalid one is logged and left out instead of stopping the run.
+    """
+    return {
+        "block_resource_types": set(block_resource_types),
+        "block_url_patterns": _compile_url_patterns(block_url_patterns, "blocked"),
+        "allow_url_patterns": _compile_url_patterns(allow_url_patterns, "allowed"),
+        "lock": threading.Lock(),
+        "allowed": {},  # resource type -> requests
+        "blocked": {},
+        "bytes": 0,
+    }
+
+
+def _compile_url_patterns(patterns, kind: str) -> list:
+    compiled = []
+    for pattern in patterns:
+        try:
+            compiled.append(re.compile(pattern))
+        except re.error as e:
+            log(f"❌ Ignoring invalid {kind} URL pattern {pattern!r}: {e}")
+    return compiled
+
+
+def _filters_requests(request_filter: dict) -> bool:
+    """False when nothing can be blocked, the requests are then only counted."""
+    return bool(request_filter["block_resource_types"] or request_filter["block_url_patterns"])
+
+
+def _request_allowed(request_filter: dict, resource_type: str, url: str) -> bool:
+    if any(pattern.search(url) for pattern in request_filter["allow_url_patterns"]):
+        return True
+    if resource_type in request_filter["block_resource_types"]:
+        return False
+    return not any(pattern.search(url) for pattern in request_filter["block_url_patterns"])
+
+
+def _count_request(request_filter: dict, resource_type: str, allowed: bool):
+    with request_filter["lock"]:
+        counts = request_filter["allowed" if allowed else "blocked"]
+        counts[resource_type] = counts.get(resource_type, 0) + 1
+
+
+def _announced_body_size(response):
+    """Body bytes announced by Content-Length, None when there is none (chunked, often compressed, responses)."""
+    size = response.headers.get("content-length", "")
+    return int(size) if size.isdigit() else None
+
+
+def _add_response_bytes(request_filter: dict, size):
+    if size:
+        with request_filter["lock"]:
+            request_filter["bytes"] += size
+
+
+def _count_response_bytes(request_filter: dict, response):
+    """
+    Body bytes received: the Content-Length when announced, else the size Playwright measured
+    once the body is in. That costs a round trip, so it is only asked for the responses without one.
+    """
+    size = _announced_body_size(response)
+    if size is None:
+        try:
+            size = response.request.sizes()["responseBodySize"]
+        except Exception:
+            return  # request failed or the page is gone
+    _add_response_bytes(request_filter, size)
+
+
+async def _count_response_bytes_async(request_filter: dict, response):
+    """Async counterpart of _count_response_bytes."""
+    size = _announced_body_size(response)
+    if size is None:
+        try:
+            size = (await response.request.sizes())["responseBodySize"]
+        except Exception:
+            return
+    _add_response_bytes(request_filter, size)
+
+
+def _install_request_filter(context, request_filter: dict):
+    """
+    Route every request of a sync BrowserContext through the allow/deny policy. Without any
+    block rule no route is installed (routing costs a round trip per request), the requests
+    are only counted from the context's request events.
+    """
+    def handle_route(route):
+        request = route.request
+        allowed = _request_allowed(request_filter, request.resource_type, request.url)
+        _count_request(request_filter, request.resource_type, allowed)
+        if allowed:
+            route.continue_()
+        else:
+            route.abort()
+    if _filters_requests(request_filter):
+        context.route("**/*", handle_route)
+    else:
+        context.on("request", lambda request: _count_request(request_filter, request.resource_type, True))
+    context.on("response", lambda response: _count_response_bytes(request_filter, response))
+
+
+async def _install_request_filter_async(context, request_filter: dict):
+    """Async counterpart of _install_request_filter for the EWB crawl browser."""
+    async def handle_route(route):
+        request = route.request
+        allowed = _request_allowed(request_filter, request.resource_type, request.url)
+        _count_request(request_filter, request.resource_type, allowed)
+        if allowed:
+            await route.continue_()
+        else:
+            await route.abort()
+    if _filters_requests(request_filter):
+        await context.route("**/*", handle_route)
+    else:
+        context.on("request", lambda request: _count_request(request_filter, request.resource_type, True))
+    context.on("response", partial(_count_response_bytes_async, request_filter))
+
+
+def _log_request_filter(request_filter: dict):
+    allowed = sum(request_filter["allowed"].values())
+    blocked = sum(request_filter["blocked"].values())
+    by_type = ", ".join(f"{resource_type}: {count}" for resource_type, count in sorted(request_filter["blocked"].items()))
+    log(f"Network: {allowed} request(s) allowed, {blocked} blocked ({by_type or 'none'}), "
+        f"{request_filter['bytes'] / (1 << 20):.1f} MB received by the browser.")
+
+
 def get_month_year_range(start_month: str, start_year, end_month: str, end_year):
     result = []
     try:
@@ -140,18 +439,36 @@ def _get_radio_button_selector(radio_type: str) -> str:
         raise ValueError(f"❌ Invalid radio button type: {radio_type}")
 
 
-def _set_date_fields_exact(page: Page, last_day: int, month_year: tuple):
+def _period_months(period) -> list:
+    """Months of a report period: a single (month, year) tuple or a window of consecutive ones."""
+    return list(period) if isinstance(period[0], tuple) else [period]
+
+
+def _period_dates(period) -> tuple:
+    """From/to dates (dd/mm/yyyy) of a report period, the last month ending today if it is the current one."""
+    months = _period_months(period)
+    (first_month, first_year), (last_month, last_year) = months[0], months[-1]
+    from_date = f"01/{_get_month_number(first_month):02d}/{first_year}"
+    to_date = f"{get_days_in_month(months[-1]):02d}/{_get_month_number(last_month):02d}/{last_year}"
+    return from_date, to_date
+
+
+def _period_label(period) -> str:
+    months = _period_months(period)
+    label = f"{months[0][0]}_{months[0][1]}"
+    return label if len(months) == 1 else f"{label} - {months[-1][0]}_{months[-1][1]}"
+
+
+def _set_date_fields_exact(page: Page, period, timeout: int = DEFAULT_TIMEOUT):
     """
     Set the date fields using exact field IDs with JavaScript.
     """
-    month, year = month_year
-    from_date = f"01/{_get_month_number(month):02d}/{year}"
-    to_date = f"{last_day:02d}/{_get_month_number(month):02d}/{year}"
+    from_date, to_date = _period_dates(period)
     
     # Use JavaScript to set readonly date fields
-    page.wait_for_selector('#ctl00_ContentPlaceHolder1_txtDateFrom', timeout= DEFAULT_TIMEOUT)
+    page.wait_for_selector('#ctl00_ContentPlaceHolder1_txtDateFrom', timeout=timeout)
     page.evaluate(f'document.getElementById("ctl00_ContentPlaceHolder1_txtDateFrom").value = "{from_date}"')
-    page.wait_for_selector('#ctl00_ContentPlaceHolder1_txtDateTo', timeout=DEFAULT_TIMEOUT)
+    page.wait_for_selector('#ctl00_ContentPlaceHolder1_txtDateTo', timeout=timeout)
     page.evaluate(f'document.getElementById("ctl00_ContentPlaceHolder1_txtDateTo").value = "{to_date}"')
     log(f"Set date range: {from_date} to {to_date}")
 
@@ -162,542 +479,2884 @@ def _check_for_export_to_excel(page):
     """
     try:
         # Method 1: Check for the Export to Excel button by ID. We don't need to give timeout here
-        # beacuse we have already waited for "networkidle" in previous method.
-        page.wait_for_selector("#ctl00_ContentPlaceHolder1_btn_export_excel", timeout=100)
+        # beacuse we have already waited for the GO postback to load in the previous step.
+        page.wait_for_selector(export_excel_button, timeout=100)
         return True
     except Exception as e:
         return False
-    
 
-def _click_go_and_download_excel(page: Page, gstin: str, state_name: str, month_year: tuple, downloads_dir: str, in_out_prefix):
+
+def _report_has_data(page, response) -> bool:
     """
-    Click GO button, check for data, and download Excel if available.
-    Returns:
-        bool: True if Excel was downloaded, False otherwise
+    Decide whether the GO postback found data: only a result page shows the Export to Excel
+    button. A response without the button at all is answered without asking the page, else
+    the button has to be visible (it can be in the markup but hidden).
     """
     try:
-        # Click GO button
-        go_button = 'input[name="ctl00$ContentPlaceHolder1$btnsbmt"][value="GO"]'
-        page.wait_for_selector(go_button, timeout=_5_MIN_TIMEOUT)
-        page.click(go_button)
-        # Wait for results to load (lighter wait)
-        page.wait_for_load_state("networkidle", timeout= DEFAULT_TIMEOUT)
-        # Check if any data is available before setting up 
-        file_name = f"{in_out_prefix}_{gstin}_{month_year[1]}_{month_year[0]}_{state_name}"
-        if not _check_for_export_to_excel(page):
-            log(f"Excel sheet not found for: {file_name}...")
+        if export_excel_button_name not in response.text():
+            return False
+    except Exception:
+        return _check_for_export_to_excel(page)
+    return page.is_visible(export_excel_button)
+
+
+def _arm_event(page, event: str, accept=None) -> dict:
+    """
+    Record the next event of a tab (accepted by `accept`, when given) without waiting for it:
+    its value under 'value' and the time it fired under 'at'. The sync API dispatches the events
+    of every tab while any one of them waits, so several tabs can have a postback or a download
+    in flight and each one is collected as soon as its own event is in. 'disarm' drops the
+    listener of an event that never came.
+    """
+    fired = {}
+
+    def handler(value):
+        if "at" in fired or (accept is not None and not accept(value)):
             return
-        else:
-            log(f"✅ Excel sheet found for: {file_name}, attempting Excel download")
+        fired["value"], fired["at"] = value, time.time()
+        page.remove_listener(event, handler)
 
-        # Only now expect a download
-        with page.expect_download(timeout=DEFAULT_TIMEOUT) as download_info:
-            page.click("#ctl00_ContentPlaceHolder1_btn_export_excel")
-        # Save downloaded file
-        download = download_info.value
-        file_path = f"{downloads_dir}/{file_name}.xls"
-        download.save_as(file_path)
-        log(f"✅ Successfully downloaded data for {file_name}")
-        # time.sleep(10)
-    except Exception as e:
-        log(f"❌ Exception in downloading Excel for {file_name}: {e}")
+    def disarm():
+        if "at" not in fired:
+            page.remove_listener(event, handler)
+
+    page.on(event, handler)
+    fired["disarm"] = disarm
+    return fired
+
+
+def _is_document_response(page, response) -> bool:
+    """The response of a tab's own page load (a postback), not one of its resources or frames."""
+    return response.frame == page.main_frame and response.request.is_navigation_request()
+
+
+class _SessionExpired(Exception):
+    """A portal page came back as the login page: the session is gone, waiting for the page is pointless."""
+
+
+def _is_login_page(url: str, title: str = "", has_login_form: bool = False) -> bool:
+    text = f"{url or ''} {title or ''}".lower()
+    return has_login_form or any(marker in text for marker in SESSION_EXPIRED_MARKERS)
+
+
+def _on_login_page(page: Page) -> bool:
+    """True when a page ended up on the GST login (URL, title or login form), False while it is a portal page."""
+    try:
+        title, has_login_form = page.evaluate(JS_LOGIN_CHECK, LOGIN_FORM_SELECTOR)
+    except Exception:
+        title, has_login_form = "", False  # page in the middle of a navigation, the URL still tells
+    return _is_login_page(page.url, title, has_login_form)
+
+
+def _raise_if_login_page(page: Page):
+    """Called when a portal page did not come back as expected: raise _SessionExpired when it is the login page."""
+    if _on_login_page(page):
+        raise _SessionExpired(f"redirected to {page.url}")
+
+
+async def _check_session_async(page):
+    """Async _raise_if_login_page, for the crawl pages that did not come back as expected."""
+    try:
+        title, has_login_form = await page.evaluate(JS_LOGIN_CHECK, LOGIN_FORM_SELECTOR)
+    except Exception:
+        title, has_login_form = "", False
+    if _is_login_page(page.url, title, has_login_form):
+        raise _SessionExpired(f"redirected to {page.url}")
 
 
-def download_EWB_for_gstin(page: Page, gstin: str, in_out_prefix: str, downloads_dir: str, month_year_tuple_list):
+def _open_report_page(context) -> Page:
+    """Open one more GSTINBasedRpt.aspx tab inside the already logged-in browser context."""
+    started = time.time()
+    report_page = context.new_page()
+    report_page.goto(GSTIN_BASED_RPT_URL, wait_until="domcontentloaded", timeout=_5_MIN_TIMEOUT)
+    if _on_login_page(report_page):
+        report_page.close()
+        raise _SessionExpired(f"redirected to {report_page.url}")
+    report_page.wait_for_selector(gstin_textbox, timeout=_5_MIN_TIMEOUT)
+    _record_latency("open_report_tab", time.time() - started)
+    return report_page
+
+
+def _new_report_slot(tab_id: int, page: Page) -> dict:
+    """A report tab together with the form values it currently holds and the work item it has in flight."""
+    return {"id": tab_id, "page": page, "in_out_prefix": None, "gstin": None, "month_year": None, "job": None}
+
+
+def _reset_report_slot(slot: dict):
+    """Forget the form state of a tab after an error so every field is set again next time."""
+    slot["in_out_prefix"] = slot["gstin"] = slot["month_year"] = None
+
+
+def _apply_report_form(slot: dict, gstin: str, in_out_prefix: str, month_year: tuple, state_value: str, timeout: int = DEFAULT_TIMEOUT):
     """
-    Download Excel reports for a specific GSTIN by iterating through all buyer states.
-    Args:
-        page: Playwright page object (EWB MIS page)
-        gstin: GSTIN number to search for
-        in_out_prefix: 'Out' or 'In' selection
-        downloads_dir: Directory to save downloaded files
+    Fill the report form of one tab for a work item. Radio, GSTIN and dates are only
+    touched when they differ from what this tab's form already holds.
     """
-    try:
-        # Step 1: Select radio button (Outward/Inward) - do this once
+    page = slot["page"]
+    if slot["in_out_prefix"] != in_out_prefix:
         radio_selector = _get_radio_button_selector(in_out_prefix)
-        page.wait_for_selector(radio_selector, timeout=DEFAULT_TIMEOUT)
+        page.wait_for_selector(radio_selector, timeout=timeout)
         page.click(radio_selector)
-        # page.wait_for_timeout(2000)
-        log(f"Selected {in_out_prefix} radio button")
-
-        # Step 3: Enter GSTIN - do this once
-        gstin_selector = 'input[name="ctl00$ContentPlaceHolder1$txt_gstin"]'
-        page.wait_for_selector(gstin_selector, timeout=DEFAULT_TIMEOUT)
-        page.type(gstin_selector, gstin)
-        # Small delay to ensure selection is registered
-        # page.wait_for_timeout(2000)
-
-        for month_year in month_year_tuple_list:
-            last_day = get_days_in_month(month_year)
-            # Step 2: Set Date From and To - do this once
-            _set_date_fields_exact(page, last_day, month_year)
-            # page.wait_for_timeout(2000)
-            
-            # Step 4: Iterate through each state option
-            for state_value, state_name in state_options.items():
-                if state_value == "0":  # Skip default "Select State" option
-                    continue
-                log(f"Checking state group: {state_value} : ({state_name})")
-                try:
-                    # Select the state
-                    state_dropdown = 'select[name="ctl00$ContentPlaceHolder1$ddl_gstinstcode"]'
-                    page.wait_for_selector(state_dropdown, timeout=DEFAULT_TIMEOUT)
-                    page.select_option(state_dropdown, value=state_value)
-                    # Small delay to ensure selection is registered
-                    # page.wait_for_timeout(1000)
-                    #TODO TIMEOUT
-                    # Click GO button and check for data
-                    _click_go_and_download_excel(page, gstin, state_name, month_year, downloads_dir, in_out_prefix)
-                    # Small delay between states
-                    # page.wait_for_timeout(2000)
-                except Exception as state_error:
-                    log(f"❌ Error processing state: {state_name}. :: {str(state_error)}")
-                    continue
-            log(f"Completed processing all states for GSTIN: {gstin} for {month_year[0]}_{month_year[1]}")
-    except Exception as e:
-        log(f"❌ Error processing GSTIN: {gstin} for {month_year[0]}_{month_year[1]}: {str(e)}")
+        slot["in_out_prefix"] = in_out_prefix
+        log(f"[Tab {slot['id']}] Selected {in_out_prefix} radio button")
+    if slot["gstin"] != gstin:
+        page.wait_for_selector(gstin_textbox, timeout=timeout)
+        page.fill(gstin_textbox, gstin)
+        slot["gstin"] = gstin
+    if slot["month_year"] != month_year:
+        _set_date_fields_exact(page, month_year, timeout)
+        slot["month_year"] = month_year
+    page.wait_for_selector(state_dropdown, timeout=timeout)
+    page.select_option(state_dropdown, value=state_value)
 
 
-def xls_to_xlsx(path, gst_id):
-    """Converts .xls files to .xlsx in the specified path for a given GSTIN."""
-    log("***Starting .xls to .xlsx conversion***")
-    file_list1 = glob(os.path.join(path, f"In_{gst_id}*.xls"))
-    file_list2 = glob(os.path.join(path, f"Out_{gst_id}*.xls"))
-    file_list = file_list1 + file_list2
+def _report_work_items(in_out_prefixes: list, month_year_tuple_list) -> list:
+    """All (In/Out, month, state value, state group) combinations that make up a GSTIN download."""
+    return [
+        (in_out_prefix, month_year, state_value, state_name)
+        for in_out_prefix in in_out_prefixes
+        for month_year in month_year_tuple_list
+        for state_value, state_name in state_options.items()
+        if state_value != "0"  # Skip default "Select State" option
+    ]
 
-    if not file_list:
-        log(f"No .xls files found for conversion in {path}.")
-        return
 
-    try:
-        excel = win32.gencache.EnsureDispatch('Excel.Application')
-        excel.Visible = False # Run Excel in background
-
-        for file in file_list:
-            log(f"Converting file:{os.path.basename(file)}")
-            wb = excel.Workbooks.Open(file)
-            wb.SaveAs(file + "x", FileFormat=51) # FileFormat 51 is for .xlsx
-            wb.Close()
-        log("*** ✅ .xls to .xlsx Conversion was successful***")
-    except Exception as e:
-        log(f"❌ Error during .xls to .xlsx conversion: {e}")
-    finally:
-        if 'excel' in locals() and excel:
-            excel.Quit() # Use .quit() to properly close Excel
+def _report_file_name(gstin: str, work_item: tuple) -> str:
+    """In_GSTIN_2024_January_<group>, or In_GSTIN_2024_January-2024_June_<group> for a window."""
+    in_out_prefix, period, state_value, state_name = work_item
+    months = _period_months(period)
+    span = f"{months[0][1]}_{months[0][0]}"
+    if len(months) > 1:
+        span += f"-{months[-1][1]}_{months[-1][0]}"
+    return f"{in_out_prefix}_{gstin}_{span}_{state_name}"
 
 
-def xlsx_merge(path, gst_id):
-    """Merges all In_GSTIN_*.xlsx and Out_GSTIN_*.xlsx files into a single Merged_GSTIN.xlsx."""
-    file_list1 = glob(os.path.join(path, f"In_{gst_id}*.xlsx"))
-    file_list2 = glob(os.path.join(path, f"Out_{gst_id}*.xlsx"))
-    file_list = file_list1 + file_list2
+def _month_index(month_year: tuple) -> int:
+    return month_year[1] * 12 + _get_month_number(month_year[0]) - 1
 
-    if not file_list:
-        log(f"No .xlsx files found for merging in {path} for GSTIN: {gst_id}.")
-        return
 
-    excl_list = []
-    for file in file_list:
-        log(f"Merging file: {os.path.basename(file)}")
-        try:
-            df = pd.read_excel(file)
-            if not df.empty:
-                excl_list.append(df)
-        except Exception as e:
-            log(f"❌ Error reading {os.path.basename(file)}: {e}")
-            continue
+def _window_item(in_out_prefix: str, months: list, state_value: str, state_name: str) -> tuple:
+    return (in_out_prefix, months[0] if len(months) == 1 else tuple(months), state_value, state_name)
 
-    if not excl_list:
-        log("No valid Excel files to merge.")
-        return
 
-    excl_merged = pd.concat(excl_list, ignore_index=True, sort=False)
-    # excl_merged.drop_duplicates(inplace=True)
-    l = len(excl_merged.axes[0])
+def _plan_report_windows(work_items: list, window_months: int) -> list:
+    """
+    Merge the consecutive months of each (In/Out, state group) into date windows of up to
+    window_months months, so a sparse GSTIN needs one GO postback per window instead of per month.
+    Windows that hit the report row limit or fail are bisected again by the download engines,
+    down to single months. A month that still hits the limit is recorded failed (see _settle_over_limit).
+    """
+    if window_months <= 1:
+        return list(work_items)
+    groups = {}  # keeps the scheduling order of the state groups
+    for in_out_prefix, month_year, state_value, state_name in work_items:
+        groups.setdefault((in_out_prefix, state_value, state_name), []).append(month_year)
+    windows = []
+    for (in_out_prefix, state_value, state_name), months in groups.items():
+        run = []
+        for month_year in sorted(months, key=_month_index):
+            if run and (len(run) == window_months or _month_index(month_year) != _month_index(run[-1]) + 1):
+                windows.append(_window_item(in_out_prefix, run, state_value, state_name))
+                run = []
+            run.append(month_year)
+        windows.append(_window_item(in_out_prefix, run, state_value, state_name))
+    return windows
+
+
+def _split_report_window(work_queue: deque, work_item: tuple, reason: str) -> bool:
+    """Put the two halves of a multi-month window at the front of the queue, False for a single month."""
+    in_out_prefix, period, state_value, state_name = work_item
+    months = _period_months(period)
+    if len(months) < 2:
+        return False
+    half = len(months) // 2
+    log(f"Splitting {in_out_prefix} {_period_label(period)} ({state_name}) into two windows: {reason}")
+    work_queue.appendleft(_window_item(in_out_prefix, months[half:], state_value, state_name))
+    work_queue.appendleft(_window_item(in_out_prefix, months[:half], state_value, state_name))
+    return True
+
+
+def _read_report(file_path: str) -> pd.DataFrame:
+    """Parse a downloaded .xls report with pandas: a BIFF workbook, or the HTML table the portal exports."""
+    with open(file_path, "rb") as f:
+        is_biff = f.read(4) == b"\xd0\xcf\x11\xe0"
+    if is_biff:
+        return pd.read_excel(file_path)
+    return pd.read_html(file_path, header=0)[0]
+
+
+def _spill_report(file_path: str, df: pd.DataFrame) -> str:
+    """Write a parsed report to the spill directory beside it, returns the path of the spilled frame."""
+    spill_dir = os.path.join(os.path.dirname(file_path), REPORT_SPILL_DIR)
+    os.makedirs(spill_dir, exist_ok=True)
+    spill_path = os.path.join(spill_dir, os.path.splitext(os.path.basename(file_path))[0] + ".pkl")
+    df.to_pickle(spill_path)
+    return spill_path
 
-    output_file = os.path.join(path, f'Merged_{gst_id}.xlsx')
-    excl_merged.to_excel(output_file, index=False)
-    log(f"✅ EWB In & Out files merge was successful and total number of rows are {l} for GSTIN: {gst_id}.")
-    del excl_merged
-    del excl_list
-    del df
-    gc.collect()
 
+def _buffer_report(frames: dict, file_name: str, file_path: str):
+    """Parse a fresh download into the merge buffer, a report that cannot be parsed is left to the merge."""
+    try:
+        frames[file_name] = _spill_report(file_path, _read_report(file_path))
+    except Exception as e:
+        log(f"❌ Could not parse {file_name} into the merge buffer: {e}")
+
+
+def _remove_partial(partial_path: str):
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
 
-def ewbextract_stock_stmt(page, ewbs, dpath):
+
+def _save_download(download, file_path: str):
     """
-    Alternative version with more reliable dialog handling.
+    Move Playwright's finished temp file into place with a rename instead of copying it,
+    save_as (a copy) is only used when the temp dir is on another filesystem. The copy goes to
+    a .partial file renamed into place once complete, a failed copy is removed, so no
+    truncated report is left under the report's name.
     """
-    total = len(ewbs)
-    log(f"Starting EWB details extraction for {total} EWBs...")
+    try:
+        os.replace(download.path(), file_path)
+        return
+    except OSError:
+        pass
+    partial_path = file_path + ".partial"
+    try:
+        download.save_as(partial_path)
+        os.replace(partial_path, file_path)
+    except BaseException:
+        _remove_partial(partial_path)
+        raise
 
-    for idx, ewb_no in enumerate(ewbs, start=1):
-        try:
-            log(f"Starting EWB details extraction for EWB: {ewb_no}")
-            url = f"https://mis.ewaybillgst.gov.in/Verify/EwayBillPrint.aspx?ewb_no={ewb_no}&cal=1"
-            page.goto(url, wait_until="domcontentloaded", timeout=DEFAULT_TIMEOUT)
-
-            # Wait for all required elements and extract text
-            page.locator('#ctl00_ContentPlaceHolder1_lblApxDistDetails').wait_for(timeout=DEFAULT_TIMEOUT)
-            dist = page.locator('#ctl00_ContentPlaceHolder1_lblApxDistDetails').text_content()
-            
-            page.locator('#ctl00_ContentPlaceHolder1_lblTransType').wait_for(timeout=DEFAULT_TIMEOUT)
-            trans = page.locator('#ctl00_ContentPlaceHolder1_lblTransType').text_content()
-            
-            page.locator('#ctl00_ContentPlaceHolder1_txtGenBy').wait_for(timeout=DEFAULT_TIMEOUT)
-            frm_addr = page.locator('#ctl00_ContentPlaceHolder1_txtGenBy').text_content()
-            
-            page.locator('#ctl00_ContentPlaceHolder1_txtSypplyTo').wait_for(timeout=DEFAULT_TIMEOUT)
-            to_addr = page.locator('#ctl00_ContentPlaceHolder1_txtSypplyTo').text_content()
-            # Check for main item list
-            if page.is_visible('#ctl00_ContentPlaceHolder1_GVItemList', timeout=DEFAULT_TIMEOUT):
-                html = page.locator('#ctl00_ContentPlaceHolder1_GVItemList').evaluate("el => el.outerHTML")
-                df = pd.read_html(StringIO(html))[0]
-                df = df.assign(ewb=ewb_no, Dist=dist, Trans=trans, From=frm_addr, To=to_addr)
-                df.to_excel(os.path.join(dpath, f"{ewb_no}.xlsx"), index=False)
-                log(f"[{idx}/{total}]✅ Downloaded item list for EWB: {ewb_no}")
-            else:
-                log(f"[{idx}/{total}] Main table not found for EWB: {ewb_no}, checking IRN fallback...")
-                if page.is_visible('#ctl00_ContentPlaceHolder1_btn_irn', timeout=DEFAULT_TIMEOUT):
-                    try:
-                        # Use expect_event to handle dialog
-                        with page.expect_event('dialog', timeout=DEFAULT_TIMEOUT) as dialog_info:
-                            page.locator('#ctl00_ContentPlaceHolder1_btn_irn').click()
-                        
-                        # Dialog appeared
-                        dialog = dialog_info.value
-                        dialog.accept()
-                        log(f"[{idx}/{total}] IRN dialog handled for EWB: {ewb_no}")
-                        
-                        # Create dummy data
-                        df = pd.DataFrame([{
-                            'ewb': ewb_no, 'Dist': dist, 'Trans': trans,
-                            'From': frm_addr, 'To': to_addr,
-                            'HSN Code': '', 'Quantity': ''
-                        }])
-                        df.to_excel(os.path.join(dpath, f"{ewb_no}_dist.xlsx"), index=False)
-                        log(f"[{idx}/{total}] Created dummy data for EWB: {ewb_no}")
-                        
-                    except Exception:
-                        # No dialog appeared, check for IRN table
-                        if page.is_visible('#ctl00_ContentPlaceHolder1_grd_items', timeout=DEFAULT_TIMEOUT):
-                            html = page.locator('#ctl00_ContentPlaceHolder1_grd_items').evaluate("el => el.outerHTML")
-                            df = pd.read_html(StringIO(html))[0]
-                            df = df.assign(ewb=ewb_no, Dist=dist, Trans=trans, From=frm_addr, To=to_addr)
-                            df.to_excel(os.path.join(dpath, f"{ewb_no}_irn.xlsx"), index=False)
-                            log(f"[{idx}/{total}]✅ Downloaded IRN item list for EWB: {ewb_no}")
-                        else:
-                            log(f"[{idx}/{total}] No item list found after IRN click for EWB: {ewb_no}")
-                else:
-                    log(f"[{idx}/{total}] No IRN button found for EWB: {ewb_no}")
 
-        except Exception as e:
-            log(f"[{idx}/{total}] ❌ Error processing EWB: {ewb_no}: {e}")
+def _report_row_count(file_path: str):
+    """Data rows of a downloaded report (HTML table or BIFF .xls), None when it cannot be read."""
+    try:
+        with open(file_path, "rb") as f:
+            content = f.read()
+        if content.startswith(b"\xd0\xcf\x11\xe0"):  # BIFF workbook in an OLE container
+            return len(pd.read_excel(file_path))
+        return max(content.lower().count(b"<tr") - 1, 0)
+    except Exception:
+        return None
+
+
+def _report_over_limit(file_path: str, row_limit) -> bool:
+    """True when a downloaded report reached the row limit, the portal cut it off there."""
+    if not row_limit:
+        return False
+    rows = _report_row_count(file_path)
+    return rows is not None and rows >= row_limit
 
 
-def xlsx_mergejoinsort_stock_stmt(dpath, mfile, edfm_main):
+def _settle_over_limit(work_queue: deque, gstin: str, work_item: tuple, file_path: str, row_limit):
     """
-    Merges, joins, sorts EWB data and prepares the stock statement.
-    Args:
-        dpath (str): The GSTIN-specific download directory.
-        mfile (str): Merged file prefix (e.g., 'Merged_GSTIN').
-        edfm_main (pd.DataFrame): The main merged EWB DataFrame (from Merged_GSTIN.xlsx).
+    Handle a report that reached the row limit. A window is bisected and queried again, its file
+    removed ('split'). A single month cannot be queried in smaller parts: its rows are kept, but
+    the unit is recorded failed instead of done, with this error (returned), so it is not taken
+    as complete. None when the report is under the limit.
     """
-    try:
-        file_list = glob(os.path.join(dpath, "[0-9]"*12 + ".xlsx")) # EWB files
-        file_list2 = glob(os.path.join(dpath, "[0-9]"*12 + "_irn.xlsx")) # IRN files
-        file_list3 = glob(os.path.join(dpath, "[0-9]"*12 + "_dist.xlsx")) # Dist files (dummy for IRN alerts)
-        
-        excl_list = []
-        excl_list2 = []
-        excl_list3 = []
-
-        # Process EWB files
-        if len(file_list) > 0:
-            for file in file_list:
-                log(f"Merging EWB file: {os.path.basename(file)}")
-                try:
-                    excl_list.append(pd.read_excel(file))
-                    os.remove(file) # Clean up
-                except Exception as e:
-                    log(f"❌ Error reading/removing EWB file {os.path.basename(file)}: {e}")
-            excl_merged = pd.concat(excl_list, ignore_index=True) if excl_list else pd.DataFrame()
-            excl_merged = excl_merged[['HSN Code', 'Quantity', 'Taxable Amount Rs.', 'Dist', 'Trans', 'From', 'To', 'ewb']]
-            excl_merged = excl_merged.rename(columns={'Taxable Amount Rs.': 'Taxable_Amt'})
-            log(f"EWB Merge successful. Rows: {len(excl_merged)}")
-            excl_list.clear()
-            del excl_list
-        else:
-            excl_merged = pd.DataFrame()
+    if not _report_over_limit(file_path, row_limit):
+        return None
+    if _split_report_window(work_queue, work_item, f"reached the {row_limit} row limit"):
+        os.remove(file_path)
+        return "split"
+    error = f"reached the {row_limit} row limit of the portal, the report is incomplete"
+    log(f"❌ {_report_file_name(gstin, work_item)} {error}, recording it as failed.")
+    return error
+
+
+def _report_spans(downloads_dir: str, gstin: str, in_out_prefix: str, state_name: str) -> dict:
+    """Downloaded reports of one direction and state group: name -> (first, last) month index."""
+    prefix, suffix = f"{in_out_prefix}_{gstin}_", f"_{state_name}.xls"
+    spans = {}
+    for path in glob(os.path.join(downloads_dir, f"{prefix}*{suffix}")):
+        name = os.path.basename(path)
+        try:
+            months = [_month_index((month, int(year))) for year, month in
+                      (span.split("_", 1) for span in name[len(prefix):-len(suffix)].split("-"))]
+        except ValueError:
+            continue
+        spans[name[:-len(".xls")]] = (months[0], months[-1])
+    return spans
 
-        # Process IRN files
-        if len(file_list2) > 0:
-            for file in file_list2:
-                log(f"Merging IRN file: {os.path.basename(file)}")
-                try:
-                    excl_list2.append(pd.read_excel(file))
-                    os.remove(file) # Clean up
-                except Exception as e:
-                    log(f"❌ Error reading/removing IRN file {os.path.basename(file)}: {e}")
-            excl_merged2 = pd.concat(excl_list2, ignore_index=True) if excl_list2 else pd.DataFrame()
-            excl_merged2['Quantity'] = excl_merged2['Quantity'].astype(str) + ' ' + excl_merged2['Unit']
-            excl_merged2 = excl_merged2[['HSN Code', 'Quantity', 'Taxable Amount(Rs)', 'Dist', 'Trans', 'ewb']]
-            excl_merged2 = excl_merged2.rename(columns={'Taxable Amount(Rs)': 'Taxable_Amt'})
-            log(f"EWB IRN Merge successful. Rows: {len(excl_merged2)}")
-            excl_list2.clear()
-            del excl_list2
-        else:
-            excl_merged2 = pd.DataFrame()
-            
-        # Process Dist files
-        if len(file_list3) > 0:
-            for file in file_list3:
-                log(f"Merging Dist file: {os.path.basename(file)}")
-                try:
-                    excl_list3.append(pd.read_excel(file))
-                    os.remove(file) # Clean up
-                except Exception as e:
-                    log(f"❌ Error reading/removing Dist file {os.path.basename(file)}: {e}")
-            excl_merged3 = pd.concat(excl_list3, ignore_index=True) if excl_list3 else pd.DataFrame()
-            excl_merged3['Quantity'] = excl_merged3['Quantity'].astype(str)
-            excl_merged3 = excl_merged3[['HSN Code', 'Quantity', 'Dist', 'Trans', 'From', 'To', 'ewb']]
-            log(f"✅ EWB IRN Dist Merge successful. Rows: {len(excl_merged3)}")
-            excl_list3.clear()
-            del excl_list3
-        else:
-            excl_merged3 = pd.DataFrame()
 
-        excl_ewbs = pd.concat([excl_merged, excl_merged2, excl_merged3], ignore_index=True)
-        del excl_merged, excl_merged2, excl_merged3
-        gc.collect()
-        log(f"All EWB HSN combinations: {len(excl_ewbs)}")
-
-        edf = excl_ewbs.copy()
-        edf['Quantity'] = edf['Quantity'].astype(str)
-        edf['Quantity'] = edf['Quantity'].str.upper() + ' '
-        edf['Qty'] = edf['Quantity'].str.split(' ', expand=True)[0]
-        edf['Qty'] = edf['Qty'].astype(float)
-        edf['Unit'] = edf['Quantity'].str.split(' ', expand=True)[1]
-        edf['Unit'] = edf['Unit'].str.upper()
-        edf['HSNCode'] = edf['HSN Code'].astype(str)
-        edf = edf.drop(['Quantity', 'HSN Code'], axis=1)
-        edf = edf.sort_values(by=['ewb', 'HSNCode']).reset_index()
-        final = pd.merge(edfm_main, edf, on='ewb', how='inner')
-        final['HSN4'] = final['HSN Code'].astype(str).str[:4]
-        final['HSNCode'] = pd.to_numeric(final['HSN Code'], errors='coerce').fillna(0).astype(int)
-        final = final.drop(['index'], axis=1)
-        final[['EWB No. & Dt.','DateTime']] = final['EWB No. & Dt.'].str.split('-',expand=True)
-        final.drop(['EWB No. & Dt.'], axis=1)
-        final['DateTime'] = final['DateTime'].str.strip()
-        final['DateTime']= pd.to_datetime(final['DateTime'], format='%d/%m/%Y %H:%M:%S')
-        final.sort_values(by='DateTime', inplace=True)
-        final.loc[final['Qty'] > 100, 'Qty'] = final['Qty']/1000
-
-
-        # Apply quantity correction (if Qty > 100, divide by 1000)
-        final.loc[final['Qty'] > 100, 'Qty'] = final['Qty']/1000
-
-        # Define Purchase/Sale columns based on GSTIN
-        final['Purchase from'] = final['From GSTIN & Name']
-        final['Sale To'] = final['To GSTIN & Name']
-        final['Pur_Value'] = final['Sale_Value'] = final['Assess Val.']
-        final['Pur_TaxVal'] = final['Sale_TaxVal'] = final['Tax Val.']
-        final['Pur_Vehicle'] = final['Sale_Vehicle'] = final['Latest Vehicle No.']
-        final['Pur_Qty'] = final['Sale_Qty'] = final['Qty']
+def _downloaded_reports(downloads_dir: str, gstin: str, work_item: tuple) -> list:
+    """Names of the downloaded reports holding a month work item: its own file or a window covering it."""
+    in_out_prefix, month_year, state_value, state_name = work_item
+    month = _month_index(month_year)
+    return [name for name, (first, last) in _report_spans(downloads_dir, gstin, in_out_prefix, state_name).items()
+            if first <= month <= last]
 
-        
-        # Adjust values based on whether it's a purchase or sale for the current GSTIN
-        final.loc[final['Purchase from'].astype(str).str.contains(mfile.replace('Merged_','')), ['Pur_Value', 'Pur_TaxVal', 'Pur_Vehicle', 'Pur_Qty']] = [0, 0, '', 0]
-        final.loc[final['Sale To'].astype(str).str.contains(mfile.replace('Merged_','')), ['Sale_Value', 'Sale_TaxVal', 'Sale_Vehicle', 'Sale_Qty']] = [0, 0, '', 0]
 
-        final['Pur_Qty'] = final['Pur_Qty'].fillna(0)
-        final['Sale_Qty'] = final['Sale_Qty'].fillna(0)
+def _remove_superseded_reports(downloads_dir: str, gstin: str, work_item: tuple):
+    """Delete older month/window reports inside the period of a fresh download, so no EWB is merged twice."""
+    in_out_prefix, period, state_value, state_name = work_item
+    own_name = _report_file_name(gstin, work_item)
+    months = [_month_index(month_year) for month_year in _period_months(period)]
+    for name, (first, last) in _report_spans(downloads_dir, gstin, in_out_prefix, state_name).items():
+        if name != own_name and months[0] <= first and last <= months[-1]:
+            for extension in (".xls", ".xlsx"):
+                if os.path.exists(os.path.join(downloads_dir, name + extension)):
+                    os.remove(os.path.join(downloads_dir, name + extension))
 
-        final['0B'] = 0
-        final['Total Stock'] = 0
-        final['CB'] = 0
-        final[' '] = ''
 
-        final = final.drop(['From GSTIN & Name','To GSTIN & Name','EWB No. & Dt.','Doc No. & Dt.','Assess Val.','Tax Val.','HSNCode','HSN Desc.','Latest Vehicle No.','Qty','From Place & Pin','To Place & Pin'], axis=1)
+def _download_unit_key(work_item: tuple) -> str:
+    """Run manifest key of a report download: direction|yyyy-mm|state group."""
+    in_out_prefix, month_year, state_value, state_name = work_item
+    return f"{in_out_prefix}|{month_year[1]}-{_get_month_number(month_year[0]):02d}|{state_value}"
 
-        distinct_hsns = final['HSN4'].unique()
 
-        excel_file_path = dpath + '/' + mfile + '_stockstmnt.xlsx'
-        with pd.ExcelWriter(excel_file_path) as writer:
-            for value in distinct_hsns:
-                try:
-                    final_hsn = final[final['HSN4'] == value].copy()
-                    final_hsn.loc[:, 'S.No'] = np.arange(1, len(final_hsn) + 1)
-                    final_hsn['CB'] = (final_hsn['Pur_Qty'] - final_hsn['Sale_Qty']).cumsum()
-                    final_hsn['0B'] = final_hsn['CB'].shift(fill_value=0)
-                    final_hsn['Total Stock'] = final_hsn['0B'] + final_hsn['Pur_Qty']
-                    final_hsn['0B'] = final_hsn['0B'].round(2)
-                    final_hsn['CB'] = final_hsn['CB'].round(2)
-                    final_hsn['Total Stock'] = final_hsn['Total Stock'].round(2)
-                    start_excel_row = 2
-                    final_hsn['EWB Toll'] = [f'=HYPERLINK("#"&CELL("address",INDEX(TollData!A:A,MATCH(D{excel_row},TollData!A:A,0))),D{excel_row})' for excel_row in range(start_excel_row, start_excel_row + len(final_hsn))]
-                    final_hsn['States in which vehicle movement exists'] = [f'=VLOOKUP(D{excel_row},TollUniq!A:B,{excel_row},FALSE)' for excel_row in range(start_excel_row, start_excel_row + len(final_hsn))]
-                    final_hsn = final_hsn[['S.No','DateTime','0B','EWB No.','EWB Toll','HSN Code','Trans', 'Purchase from', 'From', 'Pur_Qty','Pur_Value','Pur_TaxVal','Pur_Vehicle','Total Stock',' ','Sale To', 'To', 'Sale_Qty','Sale_Value','Sale_TaxVal','Sale_Vehicle','CB','Dist','States in which vehicle movement exists']]
-                    #final_hsn = final_hsn[['S.No','DateTime','0B','EWB No.','HSN Code', 'Purchase from', 'Pur_Qty','Pur_Value','Pur_TaxVal','Pur_Vehicle','Total Stock',' ','Sale To', 'Sale_Qty','Sale_Value','Sale_TaxVal','Sale_Vehicle','CB','Dist']]
-                    final_hsn.to_excel(writer, sheet_name=value, index=False)
-                    print(f"*** Stock statement creation for HSN: {value} is complete ***")
-                except Exception as e:
-                    log(f"❌ Error creating stock statement for for HSN: {value} : {e}")
-            del final, final_hsn, edf
-            gc.collect()
-            log(f"*** ✅ Stock statement creation for {mfile.replace('Merged_','')} is complete ***")
-    except Exception as e:
-        log(f"❌ Error creating stock statement Excel file for {mfile}: {e}")
+_manifest_lock = threading.Lock()
 
 
-def xlsxsheetmerge(mgstin, dpath):
+def _open_run_manifest(manifest_path: str) -> sqlite3.Connection:
     """
-    Merges all sheets from the stock statement file for the given GSTIN.
-    Args:
-        mgstin (str): GSTIN ID.
-        dpath (str): The GSTIN-specific download directory.
+    Open the run manifest: every unit of work of the current run with its status
+    ('pending', 'done', 'empty', 'skipped', 'consumed' or 'failed'), so an interrupted run resumes where it stopped.
+    Units are keyed by (gstin, kind, unit): kind 'download' (direction|month|state group),
+    'details'/'toll' (EWB number) and 'stage' (merge, stock_statement, toll_sheets per month range).
     """
-    try:
-        path_obj = Path(dpath)
-        file_list = list(path_obj.glob(f"Merged_{mgstin}_stockstmnt.xlsx"))
-        log(f"Files found for sheet merge: {file_list}")
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    conn = sqlite3.connect(manifest_path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS units (
+            gstin TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            unit TEXT NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (gstin, kind, unit)
+        )""")
+    conn.commit()
+    return conn
+
+
+def _manifest_plan(manifest, gstin: str, kind: str, units: list):
+    """Record units of work as pending, keeping the status of the ones already known (but marking them as planned now)."""
+    if manifest is None:
+        return
+    with _manifest_lock:
+        manifest.executemany("INSERT INTO units (gstin, kind, unit, status, updated_at) VALUES (?, ?, ?, 'pending', ?) "
+                             "ON CONFLICT (gstin, kind, unit) DO UPDATE SET updated_at = excluded.updated_at",
+                             [(gstin, kind, str(unit), time.time()) for unit in units])
+        manifest.commit()
 
-        excl_list = []
 
-        for file in file_list:
-            log(f"Processing sheets from {file.name}")
-            try:
-                df_dict = pd.read_excel(file, sheet_name=None)
-                for sheet, sheet_df in df_dict.items():
-                    sheet_df['SheetName'] = sheet  # Add sheet name column
-                    excl_list.append(sheet_df)
-                del df_dict
-                gc.collect()
-            except Exception as e:
-                log(f"❌ Error processing {file.name}: {e}")
+def _manifest_set(manifest, gstin: str, kind: str, unit, status: str, error: str = None):
+    if manifest is None:
+        return
+    with _manifest_lock:
+        manifest.execute("INSERT OR REPLACE INTO units (gstin, kind, unit, status, error, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                         (gstin, kind, str(unit), status, error, time.time()))
+        manifest.commit()
 
-        if not excl_list:
-            log("No sheets processed for merging.")
-            return
 
-        excl_merged = pd.concat(excl_list, ignore_index=True)
-        total_rows = len(excl_merged)
+def _manifest_consume(manifest, gstin: str, kind: str):
+    """
+    Mark the done units of a kind as consumed once a stage takes over the files they produced.
+    Consumed units are finished for the run. Their files stay until the stage saved its output,
+    so a crawl before the stage is done does not fetch them again.
+    """
+    if manifest is None:
+        return
+    with _manifest_lock:
+        manifest.execute("UPDATE units SET status = 'consumed', updated_at = ? WHERE gstin = ? AND kind = ? AND status = 'done'",
+                         (time.time(), gstin, kind))
+        manifest.commit()
 
-        new_excl_merged = excl_merged.drop_duplicates()
-        deduped_rows = len(new_excl_merged)
 
-        output_file = path_obj / f'Merged_{mgstin}_stockstmntall.xlsx'
-        new_excl_merged.to_excel(output_file, index=False)
+def _manifest_statuses(manifest, gstin: str, kind: str) -> dict:
+    if manifest is None:
+        return {}
+    with _manifest_lock:
+        return dict(manifest.execute("SELECT unit, status FROM units WHERE gstin = ? AND kind = ?", (gstin, kind)).fetchall())
 
-        log(f"✅ Sheet merge successful. Rows before/after duplicates: {total_rows} and {deduped_rows}")
 
-        # Final cleanup
-        del excl_list, excl_merged, new_excl_merged
-        gc.collect()
-    except Exception as e:
-        log(f"❌ Error while function call xlsxsheetmerge() for GSTIN: {mgstin}")
+def _manifest_done(manifest, gstin: str, kind: str, unit) -> bool:
+    return _manifest_statuses(manifest, gstin, kind).get(str(unit)) == "done"
 
 
-def xlsx_mergejoinsort_toll_details(dpath, mfile):
+def _manifest_set_download(manifest, gstin: str, work_item: tuple, status: str, error: str = None):
+    """Record the outcome of a report query for every month of its period."""
+    in_out_prefix, period, state_value, state_name = work_item
+    for month_year in _period_months(period):
+        _manifest_set(manifest, gstin, "download", _download_unit_key((in_out_prefix, month_year, state_value, state_name)), status, error)
+
+
+def _manifest_pending_downloads(manifest, gstin: str, work_items: list, downloads_dir: str, grace_days: int = None) -> list:
     """
-    Merges, sorts toll data and appends to the stock statement file.
-    Args:
-        dpath (str): The GSTIN-specific download directory.
-        mfile (str): Merged file prefix (e.g., 'Merged_GSTIN').
+    Work items still to download: not yet done, failed, or done but the .xls is gone.
+    With grace_days (incremental sync) months that are not closed yet are always queried again,
+    a resumed run must not keep the reports it fetched while late EWBs could still come in.
     """
-    try:
-        file_list = glob(os.path.join(dpath, "[0-9]"*12 + "_toll.xlsx"))
-        
-        excl_list = []
-        if len(file_list) > 0:
-            for file in file_list:
-                log(f"Merging toll file: {os.path.basename(file)}")
-                try:
-                    excl_list.append(pd.read_excel(file))
-                    os.remove(file) # Clean up
-                except Exception as e:
-                    log(f"❌ Error reading/removing toll file: {os.path.basename(file)}: {e}")
-            excl_merged = pd.concat(excl_list, ignore_index=True) if excl_list else pd.DataFrame()
-            log(f"✅ EWB toll merge successful. Rows: {len(excl_merged)}")
-        else:
-            excl_merged = pd.DataFrame()
-            log("No toll files found to merge.")
-            return # Exit if no toll data was found
-
-        # Reorder columns to have 'ewb' first
-        if 'ewb' in excl_merged.columns:
-            cols = excl_merged.columns.tolist()
-            cols.insert(0, cols.pop(cols.index('ewb'))) # Move 'ewb' to front
-            excl_ewbs = excl_merged[cols]
-        else:
-            excl_ewbs = excl_merged # No 'ewb' column, proceed as is
-        log(f"Length of All EWB toll combinations: {len(excl_ewbs)}")
+    statuses = _manifest_statuses(manifest, gstin, "download")
+    pending = []
+    for work_item in work_items:
+        if grace_days is not None and not _month_is_closed(work_item[1], grace_days):
+            pending.append(work_item)
+            continue
+        status = statuses.get(_download_unit_key(work_item))
+        if status == "empty":
+            continue
+        if status == "done" and _downloaded_reports(downloads_dir, gstin, work_item):
+            continue
+        pending.append(work_item)
+    return pending
 
-        existing_excel_path = os.path.join(dpath, f'{mfile}_stockstmnt.xlsx')
-        
-        if not os.path.exists(existing_excel_path):
-            log(f"❌ Error: Stock statement file not found at {existing_excel_path}. Cannot append Toll Data.")
+
+def _manifest_clear(manifest):
+    """Forget every unit, so a run that does not resume still records its own outcomes."""
+    if manifest is None:
+        return
+    with _manifest_lock:
+        manifest.execute("DELETE FROM units")
+        manifest.commit()
+
+
+def _manifest_finish_run(manifest, gstins: list, run_started: float = 0):
+    """
+    Clear the manifest once every unit of the run is finished, so the next run starts fresh.
+    Units left over from an earlier run that this run did not plan (e.g. other months) do not count.
+    """
+    if manifest is None:
+        return
+    with _manifest_lock:
+        placeholders = ",".join("?" * len(gstins))
+        left = manifest.execute(f"SELECT COUNT(*) FROM units WHERE gstin IN ({placeholders}) AND status IN ('pending', 'failed') "
+                                "AND updated_at >= ?", list(gstins) + [run_started]).fetchone()[0]
+        if left:
+            log(f"Run manifest: {left} unit(s) pending or failed, they will be resumed on the next run.")
             return
+        manifest.execute("DELETE FROM units")
+        manifest.commit()
+    log("Run manifest: all units complete, manifest cleared.")
 
-        try:
-            with pd.ExcelWriter(existing_excel_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-                excl_ewbs.to_excel(writer, index=False, sheet_name='TollData')
 
-                # Prepare TollUniq sheet
-                if 'State' in excl_merged.columns and 'ewb' in excl_merged.columns:
-                    excl_merged_unique_states = excl_merged[['ewb', 'State']].drop_duplicates()
-                    excl_merged_unique_states = excl_merged_unique_states[excl_merged_unique_states['State'].notna() & (excl_merged_unique_states['State'] != '')]
-                    result_unique_states = excl_merged_unique_states.groupby('ewb')['State'].agg(','.join).reset_index()
-                    result_unique_states.to_excel(writer, index=False, sheet_name='TollUniq')
-                    log("TollData and TollUniq sheets appended to existing Excel file.")
-                else:
-                    log("Skipping TollUniq sheet creation: 'State' or 'ewb' column missing in toll data.")
-        except Exception as e:
-            log(f"❌ Error appending toll sheets to Excel file for file: {mfile}: {e}")
-    except Exception as e:
-        log(f"❌ Error whiile function call xlsx_mergejoinsort_toll_details() for file: {mfile}: {e}")
+_sync_state_lock = threading.Lock()
+
+
+def _open_sync_state(sync_state_path: str) -> sqlite3.Connection:
+    """
+    Open the sync state kept across runs: the months of a GSTIN (per direction) whose reports
+    were all downloaded after the month was over, so incremental runs do not query them again,
+    and the hit history of every state group, so groups that are always empty can be skipped.
+    """
+    os.makedirs(os.path.dirname(sync_state_path), exist_ok=True)
+    conn = sqlite3.connect(sync_state_path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS month_sync (
+            gstin TEXT NOT NULL,
+            direction TEXT NOT NULL,
+            month TEXT NOT NULL,
+            synced_at REAL NOT NULL,
+            PRIMARY KEY (gstin, direction, month)
+        )""")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS group_history (
+            gstin TEXT NOT NULL,
+            direction TEXT NOT NULL,
+            state_value TEXT NOT NULL,
+            month TEXT NOT NULL,
+            hit INTEGER NOT NULL,
+            checked_at REAL NOT NULL,
+            PRIMARY KEY (gstin, direction, state_value, month)
+        )""")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS full_sweeps (
+            gstin TEXT PRIMARY KEY,
+            swept_at REAL NOT NULL
+        )""")
+    conn.commit()
+    return conn
+
+
+def _month_key(month_year: tuple) -> str:
+    return f"{month_year[1]}-{_get_month_number(month_year[0]):02d}"
+
+
+def _month_is_closed(month_year: tuple, grace_days: int) -> bool:
+    """A month is closed once grace_days have passed after its last day (late EWBs, cancellations)."""
+    month_num = _get_month_number(month_year[0])
+    month_end = datetime(month_year[1], month_num, calendar.monthrange(month_year[1], month_num)[1])
+    return (datetime.today() - month_end).days > grace_days
+
+
+def _synced_months(sync_state, gstin: str) -> set:
+    """(direction, yyyy-mm) pairs of a GSTIN that are closed and fully downloaded."""
+    if sync_state is None:
+        return set()
+    with _sync_state_lock:
+        return set(sync_state.execute("SELECT direction, month FROM month_sync WHERE gstin = ?", (gstin,)).fetchall())
+
+
+def _record_synced_months(sync_state, manifest, gstin: str, work_items: list, grace_days: int) -> int:
+    """Mark the closed months whose state group reports all came back done or empty in this run."""
+    if sync_state is None or manifest is None:
+        return 0
+    statuses = _manifest_statuses(manifest, gstin, "download")
+    months = {}
+    for work_item in work_items:
+        key = (work_item[0], _month_key(work_item[1]))
+        complete = statuses.get(_download_unit_key(work_item)) in ("done", "empty")
+        months[key] = months.get(key, _month_is_closed(work_item[1], grace_days)) and complete
+    synced = [(gstin, direction, month, time.time()) for (direction, month), complete in months.items() if complete]
+    with _sync_state_lock:
+        sync_state.executemany("INSERT OR REPLACE INTO month_sync (gstin, direction, month, synced_at) VALUES (?, ?, ?, ?)", synced)
+        sync_state.commit()
+    return len(synced)
+
+
+def _record_group_hits(sync_state, manifest, gstin: str, work_items: list):
+    """Record per month whether each queried state group had EWBs ('done') or not ('empty')."""
+    if sync_state is None or manifest is None:
+        return
+    statuses = _manifest_statuses(manifest, gstin, "download")
+    history = []
+    for work_item in work_items:
+        status = statuses.get(_download_unit_key(work_item))
+        if status in ("done", "empty"):
+            history.append((gstin, work_item[0], work_item[2], _month_key(work_item[1]), int(status == "done"), time.time()))
+    with _sync_state_lock:
+        sync_state.executemany("INSERT OR REPLACE INTO group_history (gstin, direction, state_value, month, hit, checked_at) VALUES (?, ?, ?, ?, ?, ?)", history)
+        sync_state.commit()
+
+
+def _record_full_sweep(sync_state, gstin: str):
+    with _sync_state_lock:
+        sync_state.execute("INSERT OR REPLACE INTO full_sweeps (gstin, swept_at) VALUES (?, ?)", (gstin, time.time()))
+        sync_state.commit()
 
 
-def ewb_extract_toll_details(page, ewbs: list, dpath: str):
+def _full_sweep_due(sync_state, gstin: str, full_sweep_days: int) -> bool:
+    with _sync_state_lock:
+        row = sync_state.execute("SELECT swept_at FROM full_sweeps WHERE gstin = ?", (gstin,)).fetchone()
+    return row is None or time.time() - row[0] > full_sweep_days * 86400
+
+
+def _schedule_state_groups(sync_state, gstin: str, work_items: list, skip_after: int, probe_days: int):
+    """
+    Order work items so state groups with the most EWBs so far come first, and leave out the
+    cold groups: empty in each of their last skip_after checked months and probed less than
+    probe_days ago. Returns (scheduled work items, skipped work items).
+    """
+    groups = {}
+    with _sync_state_lock:
+        rows = sync_state.execute("SELECT direction, state_value, hit, checked_at FROM group_history WHERE gstin = ? ORDER BY month DESC",
+                                  (gstin,)).fetchall()
+    for direction, state_value, hit, checked_at in rows:
+        groups.setdefault((direction, state_value), []).append((hit, checked_at))
+    hits = {group: sum(hit for hit, _ in history) for group, history in groups.items()}
+    cold = {
+        group for group, history in groups.items()
+        if len(history) >= skip_after and not any(hit for hit, _ in history[:skip_after])
+        and time.time() - max(checked_at for _, checked_at in history) < probe_days * 86400
+    }
+    scheduled = [item for item in work_items if (item[0], item[2]) not in cold]
+    skipped = [item for item in work_items if (item[0], item[2]) in cold]
+    scheduled.sort(key=lambda item: -hits.get((item[0], item[2]), 0))
+    return scheduled, skipped
+
+
+def download_EWB_for_gstin(page: Page, gstin: str, in_out_prefixes: list, downloads_dir: str, month_year_tuple_list, concurrency: int = 1, work_items=None, manifest=None, row_limit=None,
+                           frames: dict = None, timeout: int = DEFAULT_TIMEOUT):
     """
+    Download Excel reports for a specific GSTIN by iterating through all buyer states.
+    Every (In/Out, month or window of months, state group) combination is a work item in one
+    shared queue. The queue is handed out to `concurrency` tabs of the same logged-in context:
+    each tab submits the GO postback of its next item, starts the download when data was found
+    and takes the next item as soon as its own item is settled, without waiting for the other
+    tabs. With one tab this is the plain serial walk. A window that fails or reaches row_limit
+    rows is split in two and requeued.
     Args:
-        page: The Playwright sync Page instance.
-        ewbs (list): List of EWB numbers to extract toll data for.
-        dpath (str): The GSTIN-specific download directory.
-        timeout (int): Timeout in milliseconds (default: 30000ms = 30s).
+        page: Playwright page object (EWB MIS page), used as the first tab
+        gstin: GSTIN number to search for
+        in_out_prefixes: 'Out' and/or 'In' selections
+        downloads_dir: Directory to save downloaded files
+        month_year_tuple_list: List of (month name, year) tuples to download
+        concurrency: Number of tabs working through the queue at the same time
+        work_items: Optional explicit list of work items (e.g. the leftovers of the HTTP engine)
+        manifest: Run manifest the outcome of every work item is recorded in (optional)
+        row_limit: Row count at which the portal truncates a report (optional)
+        frames: Merge buffer, report name -> the report parsed right after the download and spilled to disk (optional)
+        timeout: Milliseconds a postback or download may take
     """
-    lewb = len(ewbs)
-    log(f"Starting EWB toll extraction for {lewb} EWBs...")
-    
-    for i, ewb in enumerate(ewbs):
+    work_queue = deque(work_items if work_items is not None else _report_work_items(in_out_prefixes, month_year_tuple_list))
+    total = len(work_queue)
+    slots = [_new_report_slot(1, page)]
+    start_time = time.time()
+
+    def fail(slot, work_item, file_name, error):
+        # Settle a work item that went wrong on a tab: split a window, else record the failure
+        nonlocal total
+        _raise_if_login_page(slot["page"])
+        log(f"❌ Exception in downloading Excel for {file_name}: {error}")
+        if _split_report_window(work_queue, work_item, str(error)):
+            total += 1
+        else:
+            _manifest_set_download(manifest, gstin, work_item, "failed", str(error))
+        _reset_report_slot(slot)
+
+    def submit(slot):
+        # Fill the form of the tab's next work item and click GO without waiting for the postback
+        in_out_prefix, month_year, state_value, state_name = work_item = work_queue.popleft()
+        file_name = _report_file_name(gstin, work_item)
+        log(f"[Tab {slot['id']}] Checking state group: {state_value} : ({state_name}) for {in_out_prefix} {_period_label(month_year)}")
         try:
-            toll_url = f"https://mis.ewaybillgst.gov.in/RFID_Reports/Ewb_rpt.aspx?id=1&ewayno={ewb}"
-            page.goto(toll_url, wait_until='domcontentloaded', timeout=_5_MIN_TIMEOUT)
-            table_selector = "#ctl00_ContentPlaceHolder1_grd_tolldtls"
+            _apply_report_form(slot, gstin, in_out_prefix, month_year, state_value, timeout)
+            slot["page"].wait_for_selector(go_button, timeout=_5_MIN_TIMEOUT)
+            response = _arm_event(slot["page"], "response", partial(_is_document_response, slot["page"]))
+            loaded = _arm_event(slot["page"], "domcontentloaded")
+            slot["page"].click(go_button, no_wait_after=True)
+            slot["job"] = {"step": "postback", "work_item": work_item, "file_name": file_name, "events": (response, loaded),
+                           "clicked_at": time.time()}
+        except Exception as state_error:
+            _raise_if_login_page(slot["page"])
+            log(f"❌ Error processing state: {state_name}. :: {str(state_error)}")
+            _manifest_set_download(manifest, gstin, work_item, "failed", str(state_error))
+            _reset_report_slot(slot)
+
+    def collect_postback(slot, job):
+        # The GO postback of a tab is back: start its download or record the item as empty
+        response, loaded = job["events"]
+        _record_latency("report_go", loaded["at"] - job["clicked_at"])
+        if not _report_has_data(slot["page"], response.get("value")):
+            if _is_login_page(slot["page"].url):
+                raise _SessionExpired(f"report tab redirected to the login page for GSTIN: {gstin}")
+            log(f"Excel sheet not found for: {job['file_name']}...")
+            _manifest_set_download(manifest, gstin, job["work_item"], "empty")
+            slot["job"] = None
+            return
+        log(f"✅ Excel sheet found for: {job['file_name']}, attempting Excel download")
+        download = _arm_event(slot["page"], "download")
+        slot["page"].click(export_excel_button, no_wait_after=True)
+        slot["job"] = {**job, "step": "download", "events": (download,), "clicked_at": time.time()}
+
+    def collect_download(slot, job):
+        # The download of a tab has started: save the file and book the item
+        nonlocal total
+        download, = job["events"]
+        work_item, file_name = job["work_item"], job["file_name"]
+        slot["job"] = None
+        # Until the portal starts sending the file, the part the step timeout guards
+        _record_latency("report_export", download["at"] - job["clicked_at"])
+        file_path = f"{downloads_dir}/{file_name}.xls"
+        _save_download(download["value"], file_path)
+        over_limit = _settle_over_limit(work_queue, gstin, work_item, file_path, row_limit)
+        if over_limit == "split":
+            total += 1
+            return
+        if over_limit is None:
+            log(f"✅ Successfully downloaded data for {file_name}")
+        _remove_superseded_reports(downloads_dir, gstin, work_item)
+        if frames is not None:
+            _buffer_report(frames, file_name, file_path)
+        _manifest_set_download(manifest, gstin, work_item, "failed" if over_limit else "done", over_limit)
+
+    try:
+        # Open the extra tabs, each one keeps its own radio/GSTIN/date form state
+        for tab_id in range(2, min(max(concurrency, 1), total) + 1):
             try:
-                page.wait_for_selector(table_selector, timeout=DEFAULT_TIMEOUT)
-                html = page.locator(table_selector).evaluate("el => el.outerHTML")
-                if html:
-                    # Parse HTML table into DataFrame
-                    df = pd.read_html(StringIO(html))[0]
-                    df['ewb'] = ewb
-                    cols = df.shape[1]
-                    
-                    if cols <= 2:  # Typically means no detailed toll details
-                        log(f"[{i+1}/{lewb}] Toll details not found (or incomplete) for ewb {ewb}")
+                slots.append(_new_report_slot(tab_id, _open_report_page(page.context)))
+            except Exception as e:
+                log(f"❌ Could not open report tab {tab_id}, continuing with {len(slots)} tab(s): {e}")
+                break
+        log(f"Downloading {total} report combinations for GSTIN: {gstin} using {len(slots)} tab(s)")
+
+        processed = 0
+        while work_queue or any(slot["job"] for slot in slots):
+            # The URL needs no round trip, the page itself is only asked when an item fails
+            if any(_is_login_page(slot["page"].url) for slot in slots):
+                # The rest stays pending in the manifest, the lane logs in again and resumes
+                log(f"⚠️ Portal session expired while downloading for GSTIN: {gstin}, {len(work_queue)} report combination(s) left pending.")
+                raise _SessionExpired(f"report tab redirected to the login page for GSTIN: {gstin}")
+            for slot in slots:
+                if slot["job"] is None and work_queue:
+                    submit(slot)
+                    if slot["job"] is not None:
+                        processed += 1
+                        log(f"[{processed}/{total}] report combinations submitted for GSTIN: {gstin}")
+
+            # Settle every tab whose postback or download is back, the others keep theirs in flight
+            settled = False
+            for slot in slots:
+                job = slot["job"]
+                if job is None:
+                    continue
+                if "at" not in job["events"][-1]:
+                    if time.time() - job["clicked_at"] < timeout / 1000:
+                        continue
+                    for event in job["events"]:
+                        event["disarm"]()
+                    slot["job"] = None
+                    settled = True
+                    fail(slot, job["work_item"], job["file_name"], f"Timeout {timeout}ms exceeded waiting for the {job['step']}")
+                    continue
+                settled = True
+                try:
+                    if job["step"] == "postback":
+                        collect_postback(slot, job)
                     else:
-                        dfile = os.path.join(dpath, f"{ewb}_toll.xlsx")
-                        df.to_excel(dfile, index=False)
-                        log(f"[{i+1}/{lewb}]✅ Downloaded ewb toll details for ewb {ewb} ")
-                else:
-                    log(f"[{i+1}/{lewb}] Could not extract HTML toll details for ewb {ewb}")
-            except TimeoutError:
-                log(f"[{i+1}/{lewb}] Toll data details not found for ewb {ewb} (timeout)")
-            
-        except TimeoutError as e:
-            log(f"❌ Timeout error for EWB {ewb}: {e}")
+                        collect_download(slot, job)
+                except _SessionExpired:
+                    raise
+                except Exception as e:
+                    slot["job"] = None
+                    fail(slot, job["work_item"], job["file_name"], e)
+            if not settled and any(slot["job"] for slot in slots):
+                # Lets Playwright dispatch the events of every tab
+                page.wait_for_timeout(REPORT_POLL_MS)
+
+        log(f"Completed processing all states for GSTIN: {gstin} in {time.time() - start_time:.1f} sec using {len(slots)} tab(s)")
+    except _SessionExpired:
+        raise
+    except Exception as e:
+        log(f"❌ Error processing GSTIN: {gstin}: {str(e)}")
+    finally:
+        for slot in slots:
+            if slot["job"] is not None:
+                for event in slot["job"]["events"]:
+                    event["disarm"]()
+                slot["job"] = None
+        for slot in slots[1:]:
+            try:
+                slot["page"].close()
+            except Exception:
+                pass
+
+
+class _AspNetFormParser(HTMLParser):
+    """Collects the <input>/<select> fields of an ASP.NET WebForms page."""
+
+    def __init__(self):
+        super().__init__()
+        self.action = None
+        self.inputs = []  # attribute dicts of every <input>
+        self.selects = {}  # select name -> selected option value
+        self._select_name = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {k: (v if v is not None else "") for k, v in attrs}
+        if tag == "form" and self.action is None:
+            self.action = attrs.get("action")
+        elif tag == "input":
+            self.inputs.append(attrs)
+        elif tag == "select":
+            self._select_name = attrs.get("name")
+            if self._select_name:
+                self.selects.setdefault(self._select_name, None)
+        elif tag == "option" and self._select_name:
+            if self.selects[self._select_name] is None or "selected" in attrs:
+                self.selects[self._select_name] = attrs.get("value", "")
+
+    def handle_endtag(self, tag):
+        if tag == "select":
+            self._select_name = None
+
+
+def _parse_report_form(html: str, page_url: str) -> dict:
+    """
+    Parse GSTINBasedRpt.aspx into the state needed for the next postback: the post URL,
+    the successful form fields (hidden __VIEWSTATE/__EVENTVALIDATION, text boxes, checked
+    radios, selects), the In/Out radio inputs and the submit buttons present on the page.
+    """
+    parser = _AspNetFormParser()
+    parser.feed(html)
+    fields = {}
+    radios = {}
+    buttons = {}
+    for attrs in parser.inputs:
+        name = attrs.get("name")
+        input_type = attrs.get("type", "text").lower()
+        if not name:
+            continue
+        if input_type in ("submit", "button", "image"):
+            buttons[name] = attrs.get("value", "")
+        elif input_type in ("radio", "checkbox"):
+            if attrs.get("id"):
+                radios[attrs["id"]] = (name, attrs.get("value", "on"))
+            if "checked" in attrs:
+                fields[name] = attrs.get("value", "on")
+        elif "disabled" not in attrs:
+            fields[name] = attrs.get("value", "")
+    fields.update({name: value for name, value in parser.selects.items() if value is not None})
+    if "__VIEWSTATE" not in fields:
+        raise ValueError(f"❌ Not a report form (session expired?): {page_url}")
+    return {
+        "url": urljoin(page_url, parser.action or page_url),
+        "fields": fields,
+        "radios": radios,
+        "buttons": buttons,
+    }
+
+
+def _new_http_session(context, page: Page, pool_size: int = 4) -> requests.Session:
+    """
+    Build a pooled HTTP client that carries the cookies (and User-Agent) of the logged-in
+    Playwright context, so report postbacks can be replayed without rendering the page.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["User-Agent"] = page.evaluate("() => navigator.userAgent")
+    _set_http_cookies(session, context.cookies())
+    return session
+
+
+def _fork_http_session(session: requests.Session) -> requests.Session:
+    """A session of its own for one HTTP worker thread, with the cookies and headers of the lane's session."""
+    fork = requests.Session()
+    fork.headers.update(session.headers)
+    fork.cookies.update(session.cookies)
+    return fork
+
+
+def _http_check_session(response, read_body: bool = True):
+    """Raise _SessionExpired when a request of the HTTP engine landed on the login page (URL, or the login form in the page)."""
+    if _is_login_page(response.url) or (read_body and LOGIN_FORM_SELECTOR.lstrip("#") in response.text):
+        raise _SessionExpired(f"redirected to {response.url}")
+
+
+def _set_http_cookies(session: requests.Session, cookies: list):
+    session.cookies.clear()
+    for cookie in cookies:
+        session.cookies.set(cookie["name"], cookie["value"], domain=cookie["domain"], path=cookie["path"])
+
+
+def _http_get_report_form(session: requests.Session, timeout: int = DEFAULT_TIMEOUT) -> dict:
+    response = session.get(GSTIN_BASED_RPT_URL, timeout=timeout / 1000)
+    response.raise_for_status()
+    _http_check_session(response)
+    return _parse_report_form(response.text, response.url)
+
+
+def _http_report_postback(session: requests.Session, form: dict, gstin: str, in_out_prefix: str, month_year: tuple, state_value: str, button_name: str, stream: bool = False,
+                          timeout: int = DEFAULT_TIMEOUT):
+    """Replay a GO/Export postback of the report form with the given work item."""
+    from_date, to_date = _period_dates(month_year)
+    radio_id = out_radio_button_id if in_out_prefix == _OUT_ else in_radio_button_id
+    radio_name, radio_value = form["radios"][radio_id]
+    payload = dict(form["fields"])
+    payload.update({
+        "__EVENTTARGET": "",
+        "__EVENTARGUMENT": "",
+        radio_name: radio_value,
+        "ctl00$ContentPlaceHolder1$txt_gstin": gstin,
+        "ctl00$ContentPlaceHolder1$txtDateFrom": from_date,
+        "ctl00$ContentPlaceHolder1$txtDateTo": to_date,
+        "ctl00$ContentPlaceHolder1$ddl_gstinstcode": state_value,
+        button_name: form["buttons"][button_name],
+    })
+    response = session.post(form["url"], data=payload, headers={"Referer": GSTIN_BASED_RPT_URL},
+                            timeout=timeout / 1000, stream=stream)
+    response.raise_for_status()
+    _http_check_session(response, read_body=not stream)
+    return response
+
+
+def _http_download_worker(session: requests.Session, gstin: str, downloads_dir: str, work_queue: deque, failed: list, total: int, manifest, row_limit=None, frames: dict = None,
+                          timeout: int = DEFAULT_TIMEOUT, stop: threading.Event = None):
+    """
+    Works through the shared queue with its own session and copy of the report form state.
+    The first request that lands on the login page sets stop for all workers: every other
+    request would fail the same way.
+    """
+    stop = threading.Event() if stop is None else stop
+    form = None
+    while not stop.is_set():
+        try:
+            in_out_prefix, month_year, state_value, state_name = item = work_queue.popleft()
+        except IndexError:
+            return
+        file_name = _report_file_name(gstin, item)
+        try:
+            if form is None:
+                form = _http_get_report_form(session, timeout)
+            # GO postback, __VIEWSTATE/__EVENTVALIDATION of the result page are carried forward
+            started = time.time()
+            response = _http_report_postback(session, form, gstin, in_out_prefix, month_year, state_value, go_button_name, timeout=timeout)
+            _record_latency("http_go", time.time() - started)
+            form = _parse_report_form(response.text, response.url)
+            if export_excel_button_name not in form["buttons"]:
+                log(f"[HTTP {total - len(work_queue)}/{total}] Excel sheet not found for: {file_name}...")
+                _manifest_set_download(manifest, gstin, item, "empty")
+                continue
+            started = time.time()
+            with _http_report_postback(session, form, gstin, in_out_prefix, month_year, state_value, export_excel_button_name, stream=True, timeout=timeout) as export:
+                if "text/html" in export.headers.get("Content-Type", "") and "attachment" not in export.headers.get("Content-Disposition", ""):
+                    raise ValueError("export postback returned a page instead of a file")
+                file_path = os.path.join(downloads_dir, f"{file_name}.xls")
+                # Streamed to a .partial file, renamed into place once complete (see _save_download)
+                try:
+                    with open(file_path + ".partial", "wb") as f:
+                        for chunk in export.iter_content(chunk_size=1 << 16):
+                            f.write(chunk)
+                    os.replace(file_path + ".partial", file_path)
+                except BaseException:
+                    _remove_partial(file_path + ".partial")
+                    raise
+            _record_latency("http_export", time.time() - started)
+            over_limit = _settle_over_limit(work_queue, gstin, item, file_path, row_limit)
+            if over_limit == "split":
+                continue
+            if over_limit is None:
+                log(f"[HTTP {total - len(work_queue)}/{total}] ✅ Successfully downloaded data for {file_name}")
+            _remove_superseded_reports(downloads_dir, gstin, item)
+            if frames is not None:
+                _buffer_report(frames, file_name, file_path)
+            _manifest_set_download(manifest, gstin, item, "failed" if over_limit else "done", over_limit)
+        except _SessionExpired as e:
+            log(f"⚠️ Portal session expired in the HTTP engine at {file_name}, stopping it: {e}")
+            failed.append(item)
+            stop.set()
+            return
+        except Exception as e:
+            log(f"❌ HTTP engine failed for {file_name}, leaving it to the browser: {e}")
+            failed.append(item)
+            form = None
+
+
+def download_EWB_for_gstin_http(session: requests.Session, gstin: str, in_out_prefixes: list, downloads_dir: str, month_year_tuple_list, concurrency: int = 1, work_items=None, manifest=None, row_limit=None,
+                                frames: dict = None, timeout: int = DEFAULT_TIMEOUT) -> list:
+    """
+    Browserless variant of download_EWB_for_gstin: replays the GSTINBasedRpt.aspx WebForms
+    postbacks (GO, then Export to Excel) over HTTP and streams the report straight to disk.
+    Returns:
+        list: Work items that could not be done over HTTP, to be retried with the browser
+    """
+    work_queue = deque(work_items if work_items is not None else _report_work_items(in_out_prefixes, month_year_tuple_list))
+    total = len(work_queue)
+    failed = []
+    start_time = time.time()
+    workers = min(max(concurrency, 1), total) if total else 0
+    log(f"Downloading {total} report combinations for GSTIN: {gstin} over HTTP using {workers} worker(s)")
+    stop = threading.Event()
+    # requests.Session is not thread-safe, every worker gets its own with the lane's cookies
+    sessions = [_fork_http_session(session) for _ in range(workers)]
+    try:
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, _http_download_worker, worker_session, gstin, downloads_dir, work_queue, failed, total, manifest,
+                                       row_limit, frames, timeout, stop)
+                       for worker_session in sessions]
+            for future in futures:
+                future.result()
+    finally:
+        for worker_session in sessions:
+            worker_session.close()
+    if stop.is_set():
+        # The browser finds the login page too and the lane logs in again
+        failed.extend(work_queue)
+        work_queue.clear()
+    log(f"Completed HTTP download for GSTIN: {gstin} in {time.time() - start_time:.1f} sec, {len(failed)} combination(s) left for the browser")
+    return failed
+
+
+def _xls_report_job(file_path: str, write_xlsx: bool, spill: bool = False):
+    """
+    Process pool job: parse one .xls report and optionally save it as .xlsx beside it. With spill
+    the frame is written to disk by the worker and its path returned instead of the frame.
+    """
+    df = _read_report(file_path)
+    if write_xlsx:
+        df.to_excel(file_path + "x", index=False)
+    return _spill_report(file_path, df) if spill else df
+
+
+def _pool_worth_it(file_list: list, workers: int) -> bool:
+    """Whether parsing file_list in a pool of workers processes beats parsing it serially."""
+    if workers < 2 or len(file_list) < MIN_POOL_FILES:
+        return False
+    return sum(os.path.getsize(file) for file in file_list) / (1 << 20) >= MIN_POOL_MB
+
+
+def parse_reports(path, gst_id, file_names=None, workers: int = 0, frames: dict = None, write_xlsx: bool = True) -> dict:
+    """
+    Parses the downloaded .xls reports in the specified path for a given GSTIN, and with
+    write_xlsx saves an .xlsx copy of each. With file_names (report names without extension)
+    only those reports are parsed.
+    The portal's reports (HTML tables or BIFF workbooks) are read with pandas in a pool of
+    `workers` processes (0 = one per CPU) from MIN_POOL_FILES files and MIN_POOL_MB MB on,
+    serially below that, so no Excel/Windows is needed. The parsed reports
+    are returned in frames (name -> spilled DataFrame) to feed xlsx_merge; reports already in frames
+    are not parsed again and with write_xlsx=False no .xlsx copy is written.
+    The frames are spilled to disk (see _spill_report) by the workers, frames only holds their
+    paths, so the parsed reports never pile up in memory or cross the process boundary.
+    """
+    frames = {} if frames is None else frames
+    log("***Starting .xls report parsing" + (" and .xlsx conversion***" if write_xlsx else "***"))
+    file_list1 = glob(os.path.join(path, f"In_{gst_id}*.xls"))
+    file_list2 = glob(os.path.join(path, f"Out_{gst_id}*.xls"))
+    file_list = file_list1 + file_list2
+    if file_names is not None:
+        file_list = [file for file in file_list if os.path.splitext(os.path.basename(file))[0] in file_names]
+    file_list.sort(key=os.path.getmtime)
+    file_list = [file for file in file_list if os.path.splitext(os.path.basename(file))[0] not in frames]
+
+    if not file_list:
+        log(f"No .xls files found for parsing in {path}.")
+        return frames
+
+    start_time = time.time()
+    workers = min(workers or os.cpu_count() or 1, len(file_list))
+    # Starting worker processes costs more than a handful of small files
+    # spawn, not fork: the browser driver and the memory watch run threads in this process
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) if _pool_worth_it(file_list, workers) else None
+    try:
+        jobs = [(file, executor.submit(_xls_report_job, file, write_xlsx, True) if executor is not None else None) for file in file_list]
+        failed = 0
+        for file, future in jobs:
+            log(f"Parsing file:{os.path.basename(file)}")
+            try:
+                spill_path = _xls_report_job(file, write_xlsx, True) if future is None else future.result()
+                frames[os.path.splitext(os.path.basename(file))[0]] = spill_path
+            except Exception as e:
+                failed += 1
+                log(f"❌ Error while parsing {os.path.basename(file)}: {e}")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    log(f"*** ✅ .xls report parsing{' and .xlsx conversion' if write_xlsx else ''} was successful*** ({len(file_list) - failed} of {len(file_list)} files "
+        f"in {time.time() - start_time:.1f} sec using {workers if executor is not None else 1} process(es))")
+    return frames
+
+
+def benchmark_xls_reader(corpus_dir: str, workers: int = 0):
+    """
+    Time the .xls report reader on a folder of sample portal exports (searched recursively):
+    serially and, for a corpus parse_reports would pool (see _pool_worth_it), in a process pool,
+    with the format of every file and the ones that fail.
+    """
+    file_list = sorted(glob(os.path.join(corpus_dir, "**", "*.xls"), recursive=True))
+    if not file_list:
+        log(f"No .xls files found in {corpus_dir}.")
+        return
+    formats = {}
+    for file in file_list:
+        with open(file, "rb") as f:
+            report_format = "biff" if f.read(4) == b"\xd0\xcf\x11\xe0" else "html"
+        formats[report_format] = formats.get(report_format, 0) + 1
+    size = sum(os.path.getsize(file) for file in file_list) / (1 << 20)
+    log(f"Benchmarking {len(file_list)} report(s), {size:.1f} MB ({', '.join(f'{k}: {v}' for k, v in formats.items())})")
+
+    start_time = time.time()
+    rows = 0
+    for file in file_list:
+        try:
+            rows += len(_xls_report_job(file, False))
+        except Exception as e:
+            log(f"❌ {file}: {e}")
+    serial = time.time() - start_time
+    log(f"Serial: {serial:.2f} sec, {len(file_list) / serial:.1f} files/s, {size / serial:.1f} MB/s, {rows} rows")
+
+    workers = workers or os.cpu_count() or 1
+    if not _pool_worth_it(file_list, workers):
+        log(f"{workers} processes: skipped, parse_reports reads fewer than {MIN_POOL_FILES} files or {MIN_POOL_MB} MB serially")
+        return
+    start_time = time.time()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(_xls_report_job, file, False) for file in file_list]
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                pass
+    pooled = time.time() - start_time
+    log(f"{workers} processes: {pooled:.2f} sec, {len(file_list) / pooled:.1f} files/s, {size / pooled:.1f} MB/s "
+        f"({serial / pooled:.2f}x)")
+
+
+def _iter_xlsx_chunks(file_path: str, watch):
+    """Read the first sheet of an .xlsx file in chunks of watch.chunk_rows rows, openpyxl read-only."""
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [f"Unnamed: {i}" if name is None else name for i, name in enumerate(header)]
+        batch = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            batch.append(row)
+            if len(batch) >= watch.chunk_rows:
+                yield pd.DataFrame(batch, columns=header)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=header)
+    finally:
+        wb.close()
+
+
+def _iter_report_chunks(file_path: str, watch, frames: dict = None, keep_frame: bool = False):
+    """
+    A report to merge in chunks: from frames (the spilled parsed reports) when it is there, .xlsx
+    files streamed from disk, .xls reports parsed whole (one portal report at a time). Without
+    keep_frame the spilled report is removed once read.
+    """
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    df = None
+    spill_path = None
+    if frames is not None:
+        spill_path = frames.get(name) if keep_frame else frames.pop(name, None)
+    if spill_path is not None:
+        df = pd.read_pickle(spill_path)
+        if not keep_frame:
+            os.remove(spill_path)
+    if df is None:
+        if file_path.endswith(".xlsx"):
+            yield from _iter_xlsx_chunks(file_path, watch)
+            return
+        df = _read_report(file_path)
+    for start in range(0, len(df), watch.chunk_rows):
+        yield df.iloc[start:start + watch.chunk_rows]
+
+
+class _XlsxAppender:
+    """
+    Writes DataFrame chunks row by row to the sheets of a new .xlsx in one pass: with xlsxwriter
+    in constant_memory mode (openpyxl write-only mode without it), rows go to disk as they are
+    appended. A sheet takes its header from its first chunk and is finished once the next sheet
+    is started. The workbook is saved next to file_path and moved into place by close(), so it
+    can replace one being read. With dedupe, rows already written (same values) are skipped,
+    they are recognised by a 128 bit digest of the row so only the digests stay in memory.
+    """
+
+    def __init__(self, file_path: str, dedupe: bool = False):
+        self.file_path = file_path
+        self.partial_path = os.path.splitext(file_path)[0] + ".partial.xlsx"
+        if xlsxwriter is not None:
+            self.wb = xlsxwriter.Workbook(self.partial_path, {"constant_memory": True, "strings_to_urls": False,
+                                                              "default_date_format": "yyyy-mm-dd hh:mm:ss"})
+        else:
+            self.wb = Workbook(write_only=True)
+        self.ws = None
+        self.sheet = None
+        self.columns = None  # of the current sheet
+        self.excel_row = 0
+        self.sheet_links = 0
+        self.seen = set() if dedupe else None
+        self.rows_in = 0
+        self.rows = 0
+
+    def append(self, df: pd.DataFrame, sheet: str = "Sheet1", links: dict = None, columns: list = None):
+        """
+        Append the rows of df to sheet. links maps a column to the internal link target of every
+        row ('TollData!A5', NaN for none), those cells are written as hyperlinks. columns is the
+        header of a sheet that starts with this chunk (default: the chunk's columns). The header
+        cannot grow once written, a chunk with a column outside it raises ValueError.
+        """
+        if sheet != self.sheet:
+            self.sheet, self.columns = sheet, None
+            self.ws = self.wb.add_worksheet(sheet) if xlsxwriter is not None else self.wb.create_sheet(sheet)
+            self.excel_row = self.sheet_links = 0
+        if self.columns is None:
+            self.columns = list(columns if columns is not None else df.columns)
+            self._write_row(self.columns)
+        if list(df.columns) != self.columns:
+            extra = [column for column in df.columns if column not in self.columns]
+            if extra:
+                raise ValueError(f"Columns {extra} are not in the header of sheet {sheet} of {os.path.basename(self.file_path)}")
+            df = df.reindex(columns=self.columns)
+        link_columns = [(self.columns.index(column), targets.tolist()) for column, targets in (links or {}).items()]
+        self.rows_in += len(df)
+        for i, row in enumerate(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)):
+            if self.seen is not None:
+                key = hashlib.blake2b(repr(row).encode(), digest_size=16).digest()
+                if key in self.seen:
+                    continue
+                self.seen.add(key)
+            row_links = [(column, targets[i]) for column, targets in link_columns if not pd.isna(targets[i])]
+            self._write_row(row, row_links)
+            self.rows += 1
+
+    def _write_row(self, row, row_links=()):
+        # Excel takes at most MAX_SHEET_LINKS hyperlinks per sheet, the cells after that are plain values
+        row_links = row_links[:max(MAX_SHEET_LINKS - self.sheet_links, 0)]
+        self.sheet_links += len(row_links)
+        if xlsxwriter is not None:
+            self.ws.write_row(self.excel_row, 0, row)
+            for column, target in row_links:
+                # The link keeps the cell's value (e.g. a number) when it is written over
+                self.ws.write_url(self.excel_row, column, f"internal:{target}")
+                self.ws.write(self.excel_row, column, row[column], self.wb.get_default_url_format())
+        else:
+            if row_links:
+                row = list(row)
+                for column, target in row_links:
+                    cell = WriteOnlyCell(self.ws, row[column])
+                    cell.hyperlink = Hyperlink(ref=f"{get_column_letter(column + 1)}{self.excel_row + 1}", location=target)
+                    cell.style = "Hyperlink"
+                    row[column] = cell
+            self.ws.append(row)
+        self.excel_row += 1
+
+    def close(self):
+        if xlsxwriter is not None:
+            self.wb.close()
+        else:
+            self.wb.save(self.partial_path)
+        os.replace(self.partial_path, self.file_path)
+
+    def discard(self):
+        self.wb.close()
+        if os.path.exists(self.partial_path):
+            os.remove(self.partial_path)
+
+
+def _scan_merge_sources(sources: list, watch, frames: dict = None) -> tuple:
+    """
+    First pass of a merge. Returns the EWB No. -> position (source index, row) of its last
+    occurrence over all sources, the rows drop_duplicates(keep='last') would keep, and the
+    union of the columns of all sources in order of appearance, the header of the merged file.
+    """
+    last_rows = {}
+    columns = {}
+    for index, file in enumerate(sources):
+        row = 0
+        try:
+            for chunk in _iter_report_chunks(file, watch, frames, keep_frame=True):
+                columns.update(dict.fromkeys(chunk.columns))
+                if 'EWB No.' in chunk.columns:
+                    positions = (index << 40) + np.arange(row, row + len(chunk))
+                    last_rows.update(zip(chunk['EWB No.'].fillna(-1).tolist(), positions.tolist()))
+                row += len(chunk)
+        except Exception:
+            pass  # reported by the merge pass
+    return last_rows, list(columns)
+
+
+def xlsx_merge(path, gst_id, file_names=None, incremental=False, frames=None, watch=None):
+    """
+    Merges all In_GSTIN_*.xlsx and Out_GSTIN_*.xlsx files into a single Merged_GSTIN.xlsx.
+    With file_names only those reports are merged. In incremental mode they are merged into
+    the existing Merged_GSTIN.xlsx. An EWB No. is kept once in every mode, the row of the most
+    recently downloaded report winning, as overlapping month and window reports can both hold it.
+    With frames (the parsed reports from parse_reports or the download) the .xls reports are
+    merged directly without .xlsx copies, the ones not in frames are parsed from disk.
+    The files are read and appended to the output in chunks (see _MemoryWatch), so only one
+    chunk is in memory at a time, plus the EWB No. index.
+    """
+    watch = watch if watch is not None else _MemoryWatch("merge", gst_id)
+    extension = ".xls" if frames is not None else ".xlsx"
+    file_list1 = glob(os.path.join(path, f"In_{gst_id}*{extension}"))
+    file_list2 = glob(os.path.join(path, f"Out_{gst_id}*{extension}"))
+    file_list = file_list1 + file_list2
+    if file_names is not None:
+        file_list = [file for file in file_list if os.path.splitext(os.path.basename(file))[0] in file_names]
+    file_list.sort(key=os.path.getmtime)
+
+    if not file_list:
+        log(f"No {extension} files found for merging in {path} for GSTIN: {gst_id}.")
+        return
+
+    output_file = os.path.join(path, f'Merged_{gst_id}.xlsx')
+    sources = list(file_list)
+    if incremental and os.path.exists(output_file):
+        log(f"Merging new rows into existing {os.path.basename(output_file)}")
+        sources.insert(0, output_file)
+    last_rows, columns = _scan_merge_sources(sources, watch, frames)
+
+    writer = _XlsxAppender(output_file)
+    try:
+        for index, file in enumerate(sources):
+            if file != output_file:
+                log(f"Merging file: {os.path.basename(file)}")
+            row = 0
+            try:
+                for chunk in _iter_report_chunks(file, watch, frames):
+                    rows = len(chunk)
+                    if 'EWB No.' in chunk.columns:
+                        positions = (index << 40) + np.arange(row, row + rows)
+                        chunk = chunk[chunk['EWB No.'].fillna(-1).map(last_rows).to_numpy() == positions]
+                    if not chunk.empty:
+                        writer.append(chunk, columns=columns)
+                    row += rows
+                    watch.checkpoint()
+            except Exception as e:
+                log(f"❌ Error reading {os.path.basename(file)}: {e}")
+                continue
+
+        if writer.columns is None:
+            log("No valid Excel files to merge.")
+            writer.discard()
+            return
+        writer.close()
+    except Exception:
+        writer.discard()
+        raise
+    log(f"✅ EWB In & Out files merge was successful and total number of rows are {writer.rows} for GSTIN: {gst_id}.")
+
+
+def _run_async_job(coro):
+    """
+    Run an async Playwright job to completion on its own thread and event loop. The sync
+    API already owns the main thread's loop, so the async pool cannot share it.
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # In the context of the caller, so the crawl logs under its browser context lane
+        return executor.submit(contextvars.copy_context().run, asyncio.run, coro).result()
+
+
+def _format_eta(seconds: float) -> str:
+    hours, rest = divmod(int(max(seconds, 0)), 3600)
+    return f"{hours:02d}:{rest // 60:02d}:{rest % 60:02d}"
+
+
+def _log_crawl_progress(label: str, stats: dict, total: int, start_time: float):
+    """Log the running counts of a crawl together with throughput and ETA."""
+    done = sum(stats.values())
+    elapsed = time.time() - start_time
+    eta = elapsed / done * (total - done) if done else 0
+    counts = ", ".join(f"{name}={count}" for name, count in stats.items())
+    log(f"{label} progress [{done}/{total}] {counts} | elapsed {_format_eta(elapsed)}, ETA {_format_eta(eta)}")
+
+
+# Turns a <table> element into {header: [...], rows: [[...]]}, the header being a leading all-<th> row.
+JS_READ_TABLE = """
+el => {
+    const header = [], rows = [];
+    for (const row of el.rows) {
+        const cells = Array.from(row.cells);
+        if (!cells.length) continue;
+        const values = cells.map(cell => cell.textContent);
+        if (!header.length && cells.every(cell => cell.tagName === 'TH')) header.push(...values);
+        else rows.push(values);
+    }
+    return {header, rows};
+}
+"""
+# Header labels of EwayBillPrint.aspx: extracted field -> element id (after ctl00_ContentPlaceHolder1_)
+EWB_PRINT_HEADER_LABELS = {"dist": "lblApxDistDetails", "trans": "lblTransType", "from": "txtGenBy", "to": "txtSypplyTo"}
+# Reads everything needed from EwayBillPrint.aspx in one round trip: the header labels,
+# which item table variant is shown and the rows of that table, and whether the page is the
+# login page instead (title and login form).
+EWB_PRINT_EXTRACT_JS = """
+() => {
+    const byId = id => document.getElementById('ctl00_ContentPlaceHolder1_' + id);
+    const text = id => { const el = byId(id); return el ? el.textContent : null; };
+    const visible = el => !!el && !!(el.offsetWidth || el.offsetHeight || el.getClientRects().length);
+    const table = """ + JS_READ_TABLE.strip() + """;
+    const result = {
+        ready: ['lblApxDistDetails', 'lblTransType', 'txtGenBy', 'txtSypplyTo'].every(id => text(id) !== null),
+        dist: text('lblApxDistDetails'), trans: text('lblTransType'),
+        from: text('txtGenBy'), to: text('txtSypplyTo'),
+        variant: 'none', items: null,
+        title: document.title, login_form: document.querySelector('""" + LOGIN_FORM_SELECTOR + """') !== null,
+    };
+    if (visible(byId('GVItemList'))) { result.variant = 'normal'; result.items = table(byId('GVItemList')); }
+    else if (visible(byId('grd_items'))) { result.variant = 'irn_table'; result.items = table(byId('grd_items')); }
+    else if (visible(byId('btn_irn'))) { result.variant = 'irn_button'; }
+    return result;
+}
+"""
+_HTML_WHITESPACE = re.compile(r"[\r\n]+|\s{2,}")
+
+
+def _table_to_frame(items: dict) -> pd.DataFrame:
+    """
+    Build a DataFrame from the header/rows returned by EWB_PRINT_EXTRACT_JS the way
+    pd.read_html would: whitespace collapsed, empty cells as NaN, numeric columns
+    (with ',' thousands separators) converted to numbers.
+    """
+    header = [_HTML_WHITESPACE.sub(" ", h).strip() for h in items["header"]]
+    width = len(header) or max((len(row) for row in items["rows"]), default=0)
+    rows = [[_HTML_WHITESPACE.sub(" ", cell).strip() for cell in row[:width]] + [""] * (width - len(row))
+            for row in items["rows"]]
+    df = pd.DataFrame(rows, columns=header or None, dtype=object).replace("", np.nan)
+    for col in df.columns:
+        try:
+            df[col] = pd.to_numeric(df[col].map(lambda v: v.replace(",", "") if isinstance(v, str) else v))
+        except (ValueError, TypeError):
+            pass
+    return df
+
+
+async def _fetch_ewb_print_async(page, ewb_no, timeout: int = DEFAULT_TIMEOUT) -> dict:
+    """
+    Open the EWB print page and read it with a single evaluate. The IRN button variant is
+    clicked, after which the page either shows an alert (variant 'irn_dialog') or the IRN
+    item table (variant 'irn_table').
+    Returns:
+        dict: ewb, variant ('normal', 'irn_table', 'irn_dialog' or 'none'), dist, trans,
+              from, to and items ({'header': [...], 'rows': [[...]]} or None)
+    """
+    url = f"https://mis.ewaybillgst.gov.in/Verify/EwayBillPrint.aspx?ewb_no={ewb_no}&cal=1"
+    await page.goto(url, wait_until="domcontentloaded", timeout=timeout)
+    data = await page.evaluate(EWB_PRINT_EXTRACT_JS)
+    if _is_login_page(page.url, data["title"], data["login_form"]):
+        raise _SessionExpired(f"redirected to {page.url}")
+    if not data["ready"]:
+        # Header labels not rendered yet, wait for the missing ones once and read again
+        for field, label_id in EWB_PRINT_HEADER_LABELS.items():
+            if data[field] is None:
+                await page.locator(f'#ctl00_ContentPlaceHolder1_{label_id}').wait_for(state="attached", timeout=timeout)
+        data = await page.evaluate(EWB_PRINT_EXTRACT_JS)
+
+    if data["variant"] == "irn_button":
+        dialog_seen = asyncio.get_running_loop().create_future()
+
+        async def accept_dialog(dialog):
+            await dialog.accept()
+            if not dialog_seen.done():
+                dialog_seen.set_result(dialog.message)
+
+        # Removed again below, a pooled page must not accept the dialogs of the next EWBs unseen
+        page.on("dialog", accept_dialog)
+        try:
+            await page.locator('#ctl00_ContentPlaceHolder1_btn_irn').click()
+            irn_table = asyncio.ensure_future(page.wait_for_selector('#ctl00_ContentPlaceHolder1_grd_items', timeout=timeout))
+            await asyncio.wait({dialog_seen, irn_table}, return_when=asyncio.FIRST_COMPLETED)
+            if dialog_seen.done():
+                irn_table.cancel()
+                data["variant"] = "irn_dialog"
+            else:
+                dialog_seen.cancel()
+                try:
+                    await irn_table
+                    irn_data = await page.evaluate(EWB_PRINT_EXTRACT_JS)
+                    data["variant"], data["items"] = irn_data["variant"], irn_data["items"]
+                except Exception:
+                    data["variant"] = "none"
+        finally:
+            page.remove_listener("dialog", accept_dialog)
+    if data["variant"] not in ("normal", "irn_table", "irn_dialog"):
+        data["variant"] = "none"
+    data["ewb"] = ewb_no
+    return data
+
+
+def _write_ewb_details(data: dict, sink) -> str:
+    """
+    Write the item list of one extracted EWB to the record sink as 'items', 'irn' or 'dist'
+    records (<ewb>.xlsx, <ewb>_irn.xlsx, <ewb>_dist.xlsx with the Excel sink), the records
+    xlsx_mergejoinsort_stock_stmt consumes.
+    Returns:
+        str: 'success', 'irn', 'dist' or 'failure'
+    """
+    ewb_no = data["ewb"]
+    header_fields = dict(ewb=ewb_no, Dist=data["dist"], Trans=data["trans"], From=data["from"], To=data["to"])
+    if data["variant"] == "normal":
+        sink.write("items", ewb_no, _table_to_frame(data["items"]).assign(**header_fields))
+        return "success"
+    if data["variant"] == "irn_table":
+        sink.write("irn", ewb_no, _table_to_frame(data["items"]).assign(**header_fields))
+        return "irn"
+    if data["variant"] == "irn_dialog":
+        # Create dummy data
+        df = pd.DataFrame([{**header_fields, 'HSN Code': '', 'Quantity': ''}])
+        sink.write("dist", ewb_no, df)
+        return "dist"
+    return "failure"
+
+
+async def _fetch_ewb_toll_async(page, ewb_no, timeout: int = DEFAULT_TIMEOUT) -> dict:
+    """
+    Open the RFID toll report of one EWB and read the toll table with a single evaluate
+    (the locator waits for the table to be attached first).
+    Returns:
+        dict: ewb and items ({'header': [...], 'rows': [[...]]})
+    """
+    toll_url = f"https://mis.ewaybillgst.gov.in/RFID_Reports/Ewb_rpt.aspx?id=1&ewayno={ewb_no}"
+    await page.goto(toll_url, wait_until='domcontentloaded', timeout=_5_MIN_TIMEOUT)
+    if _is_login_page(page.url):
+        raise _SessionExpired(f"redirected to {page.url}")
+    try:
+        items = await page.locator("#ctl00_ContentPlaceHolder1_grd_tolldtls").evaluate(JS_READ_TABLE, timeout=timeout)
+    except Exception:
+        await _check_session_async(page)  # no toll table: the login page, else the error stands
+        raise
+    return {"ewb": ewb_no, "items": items}
+
+
+def _write_ewb_toll(data: dict, sink) -> str:
+    """
+    Write the toll rows of one EWB to the record sink as 'toll' records (<ewb>_toll.xlsx with
+    the Excel sink) for xlsx_mergejoinsort_toll_details.
+    Returns:
+        str: 'toll' or 'no_toll'
+    """
+    df = _table_to_frame(data["items"])
+    df['ewb'] = data["ewb"]
+    if df.shape[1] <= 2:  # Typically means no detailed toll details
+        return "no_toll"
+    sink.write("toll", data["ewb"], df)
+    return "toll"
+
+
+# Record kinds written by the crawl: suffix of the per-EWB .xlsx files and the typed Parquet
+# schema (the columns the merges use; None keeps every column, as strings)
+RECORD_FILE_SUFFIX = {"items": "", "irn": "_irn", "dist": "_dist", "toll": "_toll"}
+RECORD_SCHEMAS = {
+    "items": {"ewb": "int64", "HSN Code": "string", "Quantity": "string", "Taxable Amount Rs.": "float64",
+              "Dist": "string", "Trans": "string", "From": "string", "To": "string"},
+    "irn": {"ewb": "int64", "HSN Code": "string", "Quantity": "float64", "Unit": "string", "Taxable Amount(Rs)": "float64",
+            "Dist": "string", "Trans": "string"},
+    "dist": {"ewb": "int64", "HSN Code": "string", "Quantity": "string", "Dist": "string", "Trans": "string",
+             "From": "string", "To": "string"},
+    "toll": None,
+}
+
+
+class _ExcelRecordSink:
+    """Writes the records of every EWB to its own small .xlsx file, as the merges always read them."""
+
+    def __init__(self, dpath: str):
+        self.dpath = dpath
+
+    def write(self, kind: str, ewb_no, df: pd.DataFrame):
+        df.to_excel(os.path.join(self.dpath, f"{ewb_no}{RECORD_FILE_SUFFIX[kind]}.xlsx"), index=False)
+
+    def on_stored(self, callback):
+        callback()
+
+    def close(self):
+        pass
+
+
+class _ParquetRecordSink:
+    """
+    Buffers the records of all EWBs and appends them in batches of batch_rows rows to Parquet
+    parts under <dpath>/records/<kind>/ (dpath is per GSTIN), cast to RECORD_SCHEMAS. Callbacks
+    given to on_stored (the manifest 'done' marks) only run once the records are on disk.
+    """
+
+    def __init__(self, dpath: str, batch_rows: int = 5000):
+        self.dpath = dpath
+        self.batch_rows = batch_rows
+        self.lock = threading.Lock()
+        self.buffers = {}  # kind -> list of DataFrames
+        self.rows = 0
+        self.callbacks = []
+        self.parts = 0
+
+    def write(self, kind: str, ewb_no, df: pd.DataFrame):
+        with self.lock:
+            self.buffers.setdefault(kind, []).append(df)
+            self.rows += len(df)
+            if self.rows >= self.batch_rows:
+                self._flush()
+
+    def on_stored(self, callback):
+        with self.lock:
+            if self.rows:
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        for kind, frames in self.buffers.items():
+            table = _records_to_arrow(kind, pd.concat(frames, ignore_index=True))
+            kind_dir = os.path.join(self.dpath, "records", kind)
+            os.makedirs(kind_dir, exist_ok=True)
+            self.parts += 1
+            pq.write_table(table, os.path.join(kind_dir, f"part-{time.time_ns()}-{self.parts:05d}.parquet"))
+        self.buffers, self.rows = {}, 0
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+def _records_to_arrow(kind: str, df: pd.DataFrame):
+    """Cast a batch of records to the typed schema of its kind, empty strings become nulls."""
+    schema = RECORD_SCHEMAS[kind] or {"ewb": "int64", **{column: "string" for column in df.columns if column != "ewb"}}
+    columns = {}
+    for column, dtype in schema.items():
+        values = df[column] if column in df.columns else pd.Series([None] * len(df), dtype=object)
+        if dtype == "string":
+            columns[column] = pa.array([None if pd.isna(v) or v == "" else str(v) for v in values], type=pa.string())
+        else:
+            columns[column] = pa.array(pd.to_numeric(values, errors="coerce"), type=pa.int64() if dtype == "int64" else pa.float64(),
+                                       from_pandas=True)
+    return pa.table(columns)
+
+
+def _open_record_sink(dpath: str, record_sink: str = "xlsx", batch_rows: int = 5000):
+    if record_sink == "parquet" and pq is not None:
+        return _ParquetRecordSink(dpath, batch_rows)
+    if record_sink == "parquet":
+        log("pyarrow is not installed, writing EWB records as .xlsx files instead of Parquet.")
+    return _ExcelRecordSink(dpath)
+
+
+def _record_files(dpath: str, kind: str) -> tuple:
+    """The Parquet parts and the per-EWB .xlsx files holding the records of a kind."""
+    return (sorted(glob(os.path.join(dpath, "records", kind, "*.parquet"))),
+            glob(os.path.join(dpath, "[0-9]"*12 + f"{RECORD_FILE_SUFFIX[kind]}.xlsx")))
+
+
+def _remove_record_files(files: list):
+    for file in files:
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
+
+
+def _iter_records(dpath: str, kind: str, label: str, consumed: list = None, chunk_rows: int = MERGE_CHUNK_ROWS):
+    """
+    The records of a kind in chunks: every Parquet part of the record sink as one chunk, then
+    the per-EWB .xlsx files gathered into chunks of about chunk_rows rows. The files are left in
+    place and added to consumed, the caller removes them once its output is saved.
+    """
+    part_files, file_list = _record_files(dpath, kind)
+    rows = 0
+    for file in part_files:
+        df = pd.read_parquet(file)
+        # Same dtypes as read back from Excel: text columns as objects with NaN for blanks
+        for column in df.columns:
+            if not pd.api.types.is_numeric_dtype(df[column]):
+                df[column] = df[column].astype(object)
+        if consumed is not None:
+            consumed.append(file)
+        rows += len(df)
+        yield df
+    if part_files:
+        log(f"Read {rows} {label} record(s) from {len(part_files)} Parquet part(s).")
+    batch, rows = [], 0
+    for file in file_list:
+        log(f"Merging {label} file: {os.path.basename(file)}")
+        try:
+            df = pd.read_excel(file)
+        except Exception as e:
+            log(f"❌ Error reading {label} file {os.path.basename(file)}: {e}")
+            continue
+        if consumed is not None:
+            consumed.append(file)
+        batch.append(df)
+        rows += len(df)
+        if rows >= chunk_rows:
+            yield pd.concat(batch, ignore_index=True)
+            batch, rows = [], 0
+    if batch:
+        yield pd.concat(batch, ignore_index=True)
+
+
+def _load_records(dpath: str, kind: str, label: str, consumed: list = None):
+    """
+    All records of a kind in one frame (see _iter_records). None when there are no records at
+    all, an empty frame when none of the files could be read.
+    """
+    part_files, file_list = _record_files(dpath, kind)
+    if not part_files and not file_list:
+        return None
+    chunks = list(_iter_records(dpath, kind, label, consumed))
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+
+def _mark_record_stored(sink, manifest, gstin: str, kind: str, ewb_no, status: str, failure_status: str):
+    """Record a crawled (EWB, kind) unit in the manifest, 'done' only once its records are stored."""
+    if status == failure_status:
+        _manifest_set(manifest, gstin, kind, ewb_no, "failed")
+    else:
+        sink.on_stored(lambda: _manifest_set(manifest, gstin, kind, ewb_no, "done"))
+
+
+# Per crawl kind: page fetcher, record writer and its statuses (the last one is counted when it raises)
+ewb_crawl_kinds = {
+    "details": (_fetch_ewb_print_async, _write_ewb_details, ("success", "irn", "dist", "failure")),
+    "toll": (_fetch_ewb_toll_async, _write_ewb_toll, ("toll", "no_toll", "toll_failure")),
+}
+# Record kinds each crawl kind writes, and the unit statuses whose records are still on disk
+# (done: written, consumed: read by a statement stage that has not saved its output yet)
+CRAWL_RECORD_KINDS = {"details": ("items", "irn", "dist"), "toll": ("toll",)}
+RECORDS_KEPT_STATUSES = ("done", "consumed")
+# Outcomes that are not cached: failed or empty pages are fetched again on the next run (the
+# toll rows of an EWB only appear as its vehicle passes the toll plazas)
+EWB_CACHE_SKIP_STATUSES = ("failure", "no_toll", "toll_failure")
+ewb_crawl_status_text = {
+    "success": "✅ Downloaded item list",
+    "irn": "✅ Downloaded IRN item list",
+    "dist": " Created dummy data",
+    "failure": " ❌ No item list extracted",
+    "toll": "✅ Downloaded ewb toll details",
+    "no_toll": " Toll details not found (or incomplete)",
+    "toll_failure": " ❌ Toll details not extracted",
+}
+
+
+_ewb_cache_lock = threading.Lock()
+
+
+def _open_ewb_cache(cache_path: str) -> sqlite3.Connection:
+    """
+    Open (and create if needed) the on-disk EWB cache shared by all GSTINs and runs. The crawl
+    writes it from worker threads (off the event loop), every use goes through _ewb_cache_lock.
+    """
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    conn = sqlite3.connect(cache_path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")  # a lost last write only means one more fetch
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ewb_cache (
+            ewb TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            data TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            ewb_date REAL,
+            PRIMARY KEY (ewb, kind)
+        )""")
+    return conn
+
+
+def _ewb_cache_get(conn: sqlite3.Connection, ewb_no, kind: str, immutable_days: int):
+    """
+    Return the cached parsed page of an EWB if it is still fresh, else None. An entry is
+    final once it was fetched `immutable_days` after the EWB was generated (the EWB is
+    closed by then and its print/toll pages no longer change). Younger entries, or ones
+    without a known EWB date, are only reused for EWB_CACHE_MUTABLE_TTL seconds.
+    """
+    with _ewb_cache_lock:
+        row = conn.execute("SELECT data, fetched_at, ewb_date FROM ewb_cache WHERE ewb = ? AND kind = ?",
+                           (str(ewb_no), kind)).fetchone()
+    if row is None:
+        return None
+    data, fetched_at, ewb_date = row
+    if ewb_date is not None and fetched_at - ewb_date >= immutable_days * 86400:
+        return json.loads(data)
+    if time.time() - fetched_at < EWB_CACHE_MUTABLE_TTL:
+        return json.loads(data)
+    return None
+
+
+def _ewb_cache_put(conn: sqlite3.Connection, ewb_no, kind: str, data: dict, ewb_date):
+    row = (str(ewb_no), kind, json.dumps(data), time.time(), ewb_date)
+    with _ewb_cache_lock:
+        conn.execute("INSERT OR REPLACE INTO ewb_cache (ewb, kind, data, fetched_at, ewb_date) VALUES (?, ?, ?, ?, ?)", row)
+        conn.commit()
+
+
+def _ewb_generated_dates(edfm: pd.DataFrame) -> dict:
+    """EWB number -> generation time (epoch seconds) from the DateTime column of _load_merged_ewbs."""
+    return {ewb_no: dt.timestamp() for ewb_no, dt in zip(edfm['EWB No.'].tolist(), edfm['DateTime']) if not pd.isna(dt)}
+
+
+async def _resume_crawl_session(context, session: dict) -> bool:
+    """
+    Wait while the session guard renews the login and load the new cookies into the crawl
+    context (once per renewal for all pages). False when the session is lost for this run.
+    """
+    guard = session["guard"]
+    if not guard.ready.is_set():
+        await asyncio.to_thread(guard.ready.wait)
+    if guard.lost:
+        return False
+    async with session["lock"]:
+        if session["generation"] < guard.generation:
+            await context.clear_cookies()
+            await context.add_cookies(guard.storage_state["cookies"])
+            session["generation"] = guard.generation
+    return True
+
+
+async def _ewb_crawl_worker(context, queue: asyncio.Queue, sink, stats: dict, total: int, start_time: float, cache, ewb_dates: dict, manifest, gstin: str,
+                            session: dict = None, timeout: int = DEFAULT_TIMEOUT):
+    """
+    One page of the pool: takes (EWB, kind) jobs off the shared queue until it is empty. With a
+    session guard an EWB that lands on the login page goes back to the queue, and the pages
+    pause until the login is renewed instead of timing out on every EWB. A page that cannot be
+    opened leaves its share of the queue to the other pages.
+    """
+    try:
+        page = await context.new_page()
+    except Exception as e:
+        log(f"⚠️ Could not open a crawl page, continuing with the other pages: {e}")
+        return
+    try:
+        while True:
+            if session is not None and not await _resume_crawl_session(context, session):
+                return
+            try:
+                idx, ewb_no, kind = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            fetch, write, statuses = ewb_crawl_kinds[kind]
+            started = time.time()
+            try:
+                data = await fetch(page, ewb_no, timeout)
+                _record_latency(f"ewb_{kind}", time.time() - started)
+                status = await asyncio.to_thread(write, data, sink)
+                if cache is not None and status not in EWB_CACHE_SKIP_STATUSES:
+                    await asyncio.to_thread(_ewb_cache_put, cache, ewb_no, kind, data, ewb_dates.get(ewb_no))
+            except _SessionExpired as e:
+                # Back on the queue either way: without a guard it is counted failed once every page stopped
+                queue.put_nowait((idx, ewb_no, kind))
+                if session is None:
+                    log(f"[{idx}/{total}] ❌ Error processing {kind} for EWB: {ewb_no}: session expired, {e}")
+                    return
+                log(f"[{idx}/{total}] ⚠️ Portal session expired at EWB: {ewb_no}, pausing the crawl for a new login...")
+                await asyncio.to_thread(session["guard"].renew, session["generation"])
+                continue
+            except Exception as e:
+                log(f"[{idx}/{total}] ❌ Error processing {kind} for EWB: {ewb_no}: {e}")
+                status = statuses[-1]
+            _mark_record_stored(sink, manifest, gstin, kind, ewb_no, status, statuses[-1])
+            stats[status] += 1
+            log(f"[{idx}/{total}]{ewb_crawl_status_text[status]} for EWB: {ewb_no} ({time.time() - started:.2f} sec)")
+            if sum(stats.values()) % 25 == 0:
+                _log_crawl_progress("EWB crawl", stats, total, start_time)
+    finally:
+        await page.close()
+
+
+def _fail_unfetched(queue: asyncio.Queue, sink, stats: dict, total: int, manifest, gstin: str):
+    """Counts the jobs no page got to (every page failed to open or died) as failures."""
+    while not queue.empty():
+        idx, ewb_no, kind = queue.get_nowait()
+        failure = ewb_crawl_kinds[kind][2][-1]
+        _mark_record_stored(sink, manifest, gstin, kind, ewb_no, failure, failure)
+        stats[failure] += 1
+        log(f"[{idx}/{total}]{ewb_crawl_status_text[failure]} for EWB: {ewb_no} (no crawl page)")
+
+
+async def _ewb_crawl_async(storage_state: dict, jobs: list, dpath: str, concurrency: int, cache_path: str, ewb_dates: dict, immutable_days: int, manifest, gstin: str,
+                           request_filter: dict = None, record_sink: str = "xlsx", record_batch_rows: int = 5000, headless: bool = False,
+                           session_guard=None, timeout: int = DEFAULT_TIMEOUT) -> dict:
+    total = len(jobs)
+    kinds = dict.fromkeys(kind for _, kind in jobs)
+    stats = {status: 0 for kind in kinds for status in ewb_crawl_kinds[kind][2]}
+    start_time = time.time()
+    cache = _open_ewb_cache(cache_path) if cache_path else None
+    sink = _open_record_sink(dpath, record_sink, record_batch_rows)
+    try:
+        # Serve what the cache already holds, only the misses go to the portal
+        queue = asyncio.Queue()
+        hits = 0
+        for idx, (ewb_no, kind) in enumerate(jobs, start=1):
+            data = _ewb_cache_get(cache, ewb_no, kind, immutable_days) if cache is not None else None
+            if data is None:
+                queue.put_nowait((idx, ewb_no, kind))
+                continue
+            status = ewb_crawl_kinds[kind][1](data, sink)
+            _mark_record_stored(sink, manifest, gstin, kind, ewb_no, status, ewb_crawl_kinds[kind][2][-1])
+            stats[status] += 1
+            hits += 1
+            log(f"[{idx}/{total}]{ewb_crawl_status_text[status]} for EWB: {ewb_no} (cache)")
+        if cache is not None:
+            log(f"EWB cache: {hits} hit(s), {queue.qsize()} miss(es) for {total} EWB page(s)")
+
+        if not queue.empty():
+            async with async_playwright() as p:
+                browser = await p.chromium.launch(headless=headless)
+                context = await browser.new_context(storage_state=storage_state)
+                if request_filter is not None:
+                    await _install_request_filter_async(context, request_filter)
+                # The crawl context starts with the cookies of the guard's current login
+                session = {"guard": session_guard, "generation": session_guard.generation, "lock": asyncio.Lock()} if session_guard is not None else None
+                try:
+                    workers = min(max(concurrency, 1), queue.qsize())
+                    results = await asyncio.gather(*(_ewb_crawl_worker(context, queue, sink, stats, total, start_time, cache, ewb_dates, manifest, gstin, session, timeout)
+                                                     for _ in range(workers)), return_exceptions=True)
+                    for result in results:
+                        if isinstance(result, Exception):
+                            log(f"❌ EWB crawl page failed: {result}")
+                    _fail_unfetched(queue, sink, stats, total, manifest, gstin)
+                finally:
+                    await context.close()
+                    await browser.close()
+    finally:
+        sink.close()
+        if cache is not None:
+            cache.close()
+    _log_crawl_progress("EWB crawl", stats, total, start_time)
+    return stats
+
+
+def ewb_crawl(context, ewbs, dpath, kinds=("details", "toll"), concurrency: int = 4, cache_path: str = None, ewb_dates: dict = None, immutable_days: int = 30,
+              manifest=None, gstin: str = None, request_filter: dict = None, record_sink: str = "xlsx", record_batch_rows: int = 5000,
+              headless: bool = False, session_guard=None, timeout: int = DEFAULT_TIMEOUT):
+    """
+    Visit every EWB once per run for all requested kinds: 'details' (EwayBillPrint.aspx, item
+    list files for the stock statement) and 'toll' (RFID_Reports/Ewb_rpt.aspx, toll files).
+    The EWB list is deduplicated and both page fetches of an EWB go to the same pool of
+    `concurrency` async pages, which runs in its own browser logged in with the storage
+    state (cookies) of the given sync context. With a cache_path, pages already in the
+    on-disk EWB cache are written from there instead of being fetched again.
+    Args:
+        context: The logged-in Playwright sync BrowserContext.
+        ewbs (list): EWB numbers to crawl.
+        dpath (str): The GSTIN-specific download directory.
+        kinds (tuple): Which pages to fetch per EWB.
+        concurrency (int): Number of pages fetching at the same time.
+        cache_path (str): SQLite EWB cache file, None to always fetch.
+        ewb_dates (dict): EWB number -> generation time, used for the cache freshness policy.
+        immutable_days (int): Age (in days) after which a fetched EWB page is cached for good.
+        manifest: Run manifest, (EWB, kind) units already done in it are skipped (optional).
+        gstin (str): GSTIN the units are recorded under in the run manifest.
+        request_filter (dict): Allow/deny policy for the crawl browser's requests (optional).
+        record_sink (str): 'xlsx' (a file per EWB) or 'parquet' (batched parts per kind).
+        record_batch_rows (int): Rows per Parquet part.
+        headless (bool): Run the crawl browser without a window.
+        session_guard (_SessionGuard): Renews an expired login while the crawl pauses (optional).
+        timeout (int): Milliseconds a page load or wait may take.
+    """
+    unique_ewbs = list(dict.fromkeys(ewbs))
+    statuses = {}
+    for kind in kinds:
+        _manifest_plan(manifest, gstin, kind, unique_ewbs)
+        statuses[kind] = _manifest_statuses(manifest, gstin, kind)
+        if not any(status in RECORDS_KEPT_STATUSES for status in statuses[kind].values()):
+            # Records left by an earlier run the manifest no longer knows would be merged twice
+            for record_kind in CRAWL_RECORD_KINDS[kind]:
+                _remove_record_files([file for files in _record_files(dpath, record_kind) for file in files])
+    jobs = [(ewb_no, kind) for ewb_no in unique_ewbs for kind in kinds if statuses[kind].get(str(ewb_no)) not in RECORDS_KEPT_STATUSES]
+    log(f"Starting EWB crawl ({', '.join(kinds)}) for {len(unique_ewbs)} unique EWBs using {concurrency} page(s)...")
+    if len(jobs) < len(unique_ewbs) * len(kinds):
+        log(f"Resuming EWB crawl: {len(unique_ewbs) * len(kinds) - len(jobs)} page(s) already done in an earlier run.")
+    if not jobs:
+        return
+    _run_async_job(_ewb_crawl_async(context.storage_state(), jobs, dpath, concurrency, cache_path, ewb_dates or {}, immutable_days, manifest, gstin,
+                                    request_filter, record_sink, record_batch_rows, headless, session_guard, timeout))
+
+
+def _stock_balances(final: pd.DataFrame) -> pd.DataFrame:
+    """
+    S.No, opening balance (0B), total stock and closing balance (CB) of every row in one grouped
+    pass over all HSNs. Returns the frame stably sorted on (HSN4, DateTime), so every HSN is a
+    contiguous block in date order (ties keep their order).
+    """
+    final = final.sort_values(by=['HSN4', 'DateTime'], kind='stable', ignore_index=True)
+    hsn = final['HSN4']
+    final['S.No'] = final.groupby(hsn, sort=False, observed=True).cumcount() + 1
+    final['CB'] = (final['Pur_Qty'] - final['Sale_Qty']).groupby(hsn, sort=False, observed=True).cumsum()
+    final['0B'] = final['CB'].groupby(hsn, sort=False, observed=True).shift(fill_value=0)
+    final['Total Stock'] = (final['0B'] + final['Pur_Qty']).round(2)
+    final['0B'] = final['0B'].round(2)
+    final['CB'] = final['CB'].round(2)
+    return final
+
+
+def _group_slices(df: pd.DataFrame, column: str) -> dict:
+    """Value -> (start, end) row positions of the blocks of a frame sorted on column."""
+    values = df[column].to_numpy()
+    starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+    ends = np.r_[starts[1:], len(values)]
+    return {values[start]: (start, end) for start, end in zip(starts, ends)}
+
+
+def benchmark_stock_statement(rows: int = 1000000, hsns: int = 200):
+    """
+    Time the stock statement balances on a synthetic frame of `rows` EWB items over `hsns` HSN
+    codes: the former filter-and-cumsum loop per HSN against _stock_balances, results compared.
+    """
+    rng = np.random.default_rng(0)
+    final = pd.DataFrame({
+        'HSN4': rng.integers(1000, 1000 + hsns, rows).astype(str),
+        'DateTime': pd.Timestamp("2023-04-01") + pd.to_timedelta(rng.integers(0, 365 * 86400, rows), unit="s"),
+        'Pur_Qty': np.where(rng.random(rows) < 0.5, rng.random(rows) * 50, 0.0),
+    })
+    final['Sale_Qty'] = np.where(final['Pur_Qty'] == 0, rng.random(rows) * 50, 0.0)
+    final.sort_values(by='DateTime', kind='stable', inplace=True)
+    log(f"Benchmarking stock statement balances on {rows} rows and {final['HSN4'].nunique()} HSNs")
+
+    start_time = time.time()
+    sheets = {}
+    for value in final['HSN4'].unique():
+        final_hsn = final[final['HSN4'] == value].copy()
+        final_hsn.loc[:, 'S.No'] = np.arange(1, len(final_hsn) + 1)
+        final_hsn['CB'] = (final_hsn['Pur_Qty'] - final_hsn['Sale_Qty']).cumsum()
+        final_hsn['0B'] = final_hsn['CB'].shift(fill_value=0)
+        final_hsn['Total Stock'] = final_hsn['0B'] + final_hsn['Pur_Qty']
+        final_hsn['0B'] = final_hsn['0B'].round(2)
+        final_hsn['CB'] = final_hsn['CB'].round(2)
+        final_hsn['Total Stock'] = final_hsn['Total Stock'].round(2)
+        sheets[value] = final_hsn
+    loop = time.time() - start_time
+    log(f"Per-HSN loop: {loop:.2f} sec")
+
+    start_time = time.time()
+    grouped = _stock_balances(final)
+    hsn_rows = _group_slices(grouped, 'HSN4')
+    single = time.time() - start_time
+    log(f"Grouped pass: {single:.2f} sec ({loop / single:.1f}x)")
+
+    columns = ['S.No', '0B', 'Total Stock', 'CB']
+    same = all(np.allclose(sheets[value][columns].to_numpy(float), grouped.iloc[start:end][columns].to_numpy(float))
+               for value, (start, end) in hsn_rows.items())
+    log(f"Results {'match' if same else 'DIFFER'}")
+
+
+# Compact schema of the merged EWB frame, parsed once by _load_merged_ewbs for every later stage.
+# Amounts stay float64, float32 cannot hold rupee amounts above ~1.6 lakh to the paisa.
+MERGED_EWB_SCHEMA = {
+    'EWB No.': 'int64',
+    'From GSTIN & Name': 'category',
+    'To GSTIN & Name': 'category',
+    'From Place & Pin': 'category',
+    'To Place & Pin': 'category',
+    'Latest Vehicle No.': 'category',
+    'HSN Desc.': 'category',
+    'HSN Code': 'Int64',
+    'Assess Val.': 'float64',
+    'Tax Val.': 'float64',
+}
+
+
+def _type_ewb_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Parse a chunk of Merged_GSTIN.xlsx into MERGED_EWB_SCHEMA. 'EWB No. & Dt.' becomes the
+    datetime64 'DateTime', HSN4 (category) is taken from the HSN code as written in the report.
+    Rows without an EWB No. are dropped.
+    """
+    ewb_no = pd.to_numeric(df['EWB No.'], errors='coerce')
+    if ewb_no.isna().any():
+        log(f"Skipping {int(ewb_no.isna().sum())} row(s) without an EWB No. in the merged EWB file.")
+        df, ewb_no = df[ewb_no.notna()], ewb_no[ewb_no.notna()]
+    df = df.assign(**{'EWB No.': ewb_no})
+    if 'EWB No. & Dt.' in df.columns:
+        df['DateTime'] = pd.to_datetime(df['EWB No. & Dt.'].astype(str).str.split('-', n=1).str[1].str.strip(),
+                                        format='%d/%m/%Y %H:%M:%S', errors='coerce')
+        df = df.drop(columns=['EWB No. & Dt.'])
+    if 'HSN Code' in df.columns:
+        df['HSN4'] = df['HSN Code'].astype(str).str[:4].astype('category')
+    for column, dtype in MERGED_EWB_SCHEMA.items():
+        if column not in df.columns:
+            continue
+        if dtype == 'category':
+            df[column] = df[column].astype('category')
+        elif dtype == 'Int64':
+            df[column] = pd.to_numeric(df[column], errors='coerce').round().astype('Int64')
+        else:
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype(dtype)
+    df['ewb'] = df['EWB No.']
+    return df
+
+
+def _concat_typed(chunks: list) -> pd.DataFrame:
+    """Concatenate typed chunks, the categoricals get the union of the chunks' categories (else they turn into objects)."""
+    if len(chunks) == 1:
+        return chunks[0].reset_index(drop=True)
+    for column in chunks[0].columns:
+        if isinstance(chunks[0][column].dtype, pd.CategoricalDtype):
+            categories = pd.api.types.union_categoricals([chunk[column] for chunk in chunks], ignore_order=True).categories
+            for chunk in chunks:
+                chunk[column] = chunk[column].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _load_merged_ewbs(file_path: str, watch=None) -> pd.DataFrame:
+    """
+    The ingest step of the stock statement and the crawl: reads Merged_GSTIN.xlsx in chunks and
+    parses each one into MERGED_EWB_SCHEMA, logging the frame's memory as read and as typed.
+    """
+    watch = watch if watch is not None else _MemoryWatch("EWB frame")
+    start_time = time.time()
+    read_mb = 0.0
+    chunks = []
+    for chunk in _iter_xlsx_chunks(file_path, watch):
+        read_mb += chunk.memory_usage(deep=True).sum() / (1 << 20)
+        chunks.append(_type_ewb_chunk(chunk))
+        watch.checkpoint()
+    edfm = _concat_typed(chunks) if chunks else None
+    if edfm is None or edfm.empty:
+        # Empty or header-only file: no rows, but every column the stock statement and the crawl use
+        return _type_ewb_chunk(pd.DataFrame(columns=['EWB No. & Dt.', 'Doc No. & Dt.', *MERGED_EWB_SCHEMA]))
+    typed_mb = edfm.memory_usage(deep=True).sum() / (1 << 20)
+    log(f"Merged EWB frame: {len(edfm)} rows, {read_mb:.1f} MB as read, {typed_mb:.1f} MB typed, "
+        f"parsed in {time.time() - start_time:.1f} sec")
+    return edfm
+
+
+def _contains(series: pd.Series, text: str) -> pd.Series:
+    """series.astype(str).str.contains(text) that only tests the categories of a categorical."""
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series.astype(str).str.contains(text, regex=False)
+    hits = np.append(series.cat.categories.astype(str).str.contains(text, regex=False), False)
+    return pd.Series(hits[series.cat.codes.to_numpy()], index=series.index)  # code -1 (NaN) -> False
+
+
+def _with_blank(series: pd.Series) -> pd.Series:
+    """A copy that can be set to '' (a categorical needs it among its categories)."""
+    if isinstance(series.dtype, pd.CategoricalDtype) and '' not in series.cat.categories:
+        return series.cat.add_categories([''])
+    return series.copy()
+
+
+# GST Unique Quantity Codes: UQC -> (base unit, factor to it). Units of one kind (weight, volume,
+# length, area, count) convert to one base unit; packages (BAG, BOX, ...) are their own base unit.
+UQC_UNITS = {
+    'MTS': ('MTS', 1), 'TON': ('MTS', 1), 'KGS': ('MTS', 0.001), 'QTL': ('MTS', 0.1), 'GMS': ('MTS', 0.000001),
+    'LTR': ('LTR', 1), 'KLR': ('LTR', 1000), 'MLT': ('LTR', 0.001), 'CBM': ('LTR', 1000), 'CCM': ('LTR', 0.001),
+    'UGS': ('LTR', 3.785411784),
+    'MTR': ('MTR', 1), 'CMS': ('MTR', 0.01), 'KME': ('MTR', 1000), 'YDS': ('MTR', 0.9144), 'GYD': ('MTR', 131.6736),
+    'SQM': ('SQM', 1), 'SQF': ('SQM', 0.09290304), 'SQY': ('SQM', 0.83612736),
+    'NOS': ('NOS', 1), 'PCS': ('NOS', 1), 'UNT': ('NOS', 1), 'DOZ': ('NOS', 12), 'GRS': ('NOS', 144),
+    'TGM': ('NOS', 1440), 'GGK': ('NOS', 1728), 'THD': ('NOS', 1000),
+    **{uqc: (uqc, 1) for uqc in ('BAG', 'BAL', 'BDL', 'BKL', 'BOU', 'BOX', 'BTL', 'BUN', 'CAN', 'CTN', 'DRM',
+                                 'PAC', 'PRS', 'ROL', 'SET', 'TBS', 'TUB', 'OTH')},
+}
+# Other spellings of the units seen on EWB prints (upper case, letters only)
+UQC_ALIASES = {
+    'MT': 'MTS', 'TONNE': 'TON', 'TONNES': 'TON', 'TONS': 'TON', 'KG': 'KGS', 'KILOGRAM': 'KGS', 'KILOGRAMS': 'KGS',
+    'QUINTAL': 'QTL', 'GRAM': 'GMS', 'GRAMS': 'GMS', 'LITRE': 'LTR', 'LITRES': 'LTR', 'LTRS': 'LTR', 'MTRS': 'MTR',
+    'METER': 'MTR', 'METERS': 'MTR', 'METRE': 'MTR', 'METRES': 'MTR', 'NO': 'NOS', 'NUMBER': 'NOS', 'NUMBERS': 'NOS',
+    'PC': 'PCS', 'PIECE': 'PCS', 'PIECES': 'PCS', 'UNITS': 'UNT', 'SETS': 'SET', 'BAGS': 'BAG', 'BOXES': 'BOX',
+}
+
+
+def _normalise_units(final: pd.DataFrame, by: str = 'HSN4') -> pd.DataFrame:
+    """
+    Convert Qty of every row to the base unit of its HSN (the base unit most of the HSN's rows
+    convert to) with UQC_UNITS, setting Unit to it. Rows with a unit that is not in the table, or
+    of another kind than their HSN's, keep Qty and Unit as they are and say why in 'Unit Flag'.
+    The units are looked up once per distinct unit, the rows are mapped by their category codes.
+    """
+    units = final['Unit'].astype(str).astype('category')
+    codes = units.cat.codes.to_numpy()
+    keys = units.cat.categories.str.upper().str.replace(r'[^A-Z]', '', regex=True)
+    keys = [UQC_ALIASES.get(key, key) for key in keys]
+    # Per distinct unit, plus a last entry for code -1 (no unit)
+    bases = np.array([UQC_UNITS.get(key, (None, np.nan))[0] for key in keys] + [None], dtype=object)
+    factors = np.array([UQC_UNITS.get(key, (None, np.nan))[1] for key in keys] + [np.nan])
+    base = pd.Series(bases[codes], index=final.index, dtype='category')
+    factor = factors[codes]
+
+    counts = pd.DataFrame({by: final[by], 'base': base}).groupby([by, 'base'], observed=True).size()
+    ranked = counts.sort_values(ascending=False, kind='stable').reset_index().drop_duplicates(by)
+    # A plain dict: mapping a categorical through a categorical Series goes by code position
+    hsn_base = dict(zip(ranked[by].astype(object), ranked['base'].astype(object)))
+    hsn_base = final[by].astype(object).map(hsn_base)
+
+    qty = final['Qty']
+    converted = (base.astype(object) == hsn_base).to_numpy()
+    unknown = base.isna().to_numpy() & qty.notna().to_numpy()
+    other_kind = ~converted & ~unknown & qty.notna().to_numpy()
+    final['Qty'] = np.where(converted, qty * factor, qty)
+    final['Unit'] = np.where(converted, hsn_base, units.astype(object))
+    final['Unit Flag'] = ''
+    unknown_units = units[unknown].astype(str)
+    final.loc[unknown, 'Unit Flag'] = np.where(unknown_units == '', 'No unit', 'Unknown unit ' + unknown_units)
+    final.loc[other_kind, 'Unit Flag'] = units[other_kind].astype(str) + ' not convertible to ' + hsn_base[other_kind].astype(str)
+    final['Unit'] = final['Unit'].astype('category')
+    if unknown.any() or other_kind.any():
+        log(f"⚠️ {int(unknown.sum())} item(s) with an unknown unit and {int(other_kind.sum())} with a unit not convertible "
+            f"to their HSN's unit, left unconverted (see 'Unit Flag').")
+    return final
+
+
+def _toll_links(toll_sheets) -> tuple:
+    """
+    From the (TollData, TollUniq) frames: EWB -> Excel row of its first TollData row, and
+    EWB -> the states its vehicle passed tolls in. Empty without toll data.
+    """
+    if toll_sheets is None:
+        return {}, {}
+    toll_data, toll_uniq = toll_sheets
+    if 'ewb' not in toll_data.columns:
+        return {}, {}
+    first_rows = toll_data['ewb'].drop_duplicates()
+    toll_rows = dict(zip(first_rows.tolist(), (first_rows.index + 2).tolist()))
+    toll_states = dict(zip(toll_uniq['ewb'].tolist(), toll_uniq['State'].tolist())) if toll_uniq is not None else {}
+    return toll_rows, toll_states
+
+
+# Row order of the stock statement: EWB date (undated EWBs last), then the order of the merged
+# EWB file, then the item's HSN code and the order of the item records
+STATEMENT_ORDER = ['_dt', '_pos', 'HSNCode', '_seq']
+
+
+def _statement_items(kind: str, df: pd.DataFrame) -> pd.DataFrame:
+    """The columns the stock statement takes from the records of an item kind, Quantity as '<qty> <unit>'."""
+    if kind == "items":
+        df = df[['HSN Code', 'Quantity', 'Taxable Amount Rs.', 'Dist', 'Trans', 'From', 'To', 'ewb']]
+        return df.rename(columns={'Taxable Amount Rs.': 'Taxable_Amt'})
+    if kind == "irn":
+        df = df.assign(Quantity=df['Quantity'].astype(str) + ' ' + df['Unit'])
+        df = df[['HSN Code', 'Quantity', 'Taxable Amount(Rs)', 'Dist', 'Trans', 'ewb']]
+        return df.rename(columns={'Taxable Amount(Rs)': 'Taxable_Amt'})
+    df = df.assign(Quantity=df['Quantity'].astype(str))
+    return df[['HSN Code', 'Quantity', 'Dist', 'Trans', 'From', 'To', 'ewb']]
+
+
+def _spill_frame(path: str, df: pd.DataFrame):
+    """Append a frame to a pickle stream on disk."""
+    with open(path, "ab") as f:
+        pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _read_spilled(path: str) -> pd.DataFrame:
+    """All frames of a pickle stream written by _spill_frame, in one frame."""
+    frames = []
+    with open(path, "rb") as f:
+        while True:
+            try:
+                frames.append(pickle.load(f))
+            except EOFError:
+                break
+    return pd.concat(frames, ignore_index=True)
+
+
+def _partition_statement_items(dpath: str, edfm_main: pd.DataFrame, spill_dir: str, consumed: list, watch) -> dict:
+    """
+    The streaming pass of the stock statement: the item records are read a chunk at a time,
+    joined with the merged EWBs (their position in edfm_main, not their columns) and spilled to
+    one file per HSN4 in spill_dir, so only one chunk and later one HSN are in memory.
+    Returns HSN4 -> (sort key of its first row, spill file), in the order of the first rows.
+    """
+    positions = pd.DataFrame({'ewb': edfm_main['ewb'].to_numpy(), '_pos': np.arange(len(edfm_main))})
+    hsn4 = edfm_main['HSN4'].astype('category')
+    hsn_codes = hsn4.cat.codes.to_numpy()
+    date_times = edfm_main['DateTime']
+    dt_keys = np.where(date_times.isna(), np.iinfo(np.int64).max, date_times.to_numpy(dtype='datetime64[ns]').view('int64'))
+    partitions = {}
+    seq = total = 0
+    for kind, label, done in (("items", "EWB", "EWB Merge successful"), ("irn", "IRN", "EWB IRN Merge successful"),
+                              ("dist", "Dist", "✅ EWB IRN Dist Merge successful")):
+        rows = None
+        for chunk in _iter_records(dpath, kind, label, consumed, watch.chunk_rows):
+            edf = _statement_items(kind, chunk)
+            rows = (rows or 0) + len(edf)
+            if edf.empty:
+                continue
+            # Quantity is "<qty> <unit>", split once (a chunk of missing quantities has no unit column)
+            quantity = (edf['Quantity'].astype(str).str.upper() + ' ').str.split(' ', n=2, expand=True).reindex(columns=[0, 1])
+            edf = edf.assign(Qty=pd.to_numeric(quantity[0].str.replace(',', '', regex=False), errors='coerce'),
+                             Unit=quantity[1], HSNCode=edf['HSN Code'].astype(str), _seq=np.arange(seq, seq + len(edf)))
+            edf = edf.drop(columns=['Quantity', 'HSN Code'])
+            seq += len(edf)
+            edf = edf.merge(positions, on='ewb', how='inner')
+            edf['_dt'] = dt_keys[edf['_pos'].to_numpy()]
+            for code, part in edf.groupby(hsn_codes[edf['_pos'].to_numpy()], sort=False):
+                first = tuple(part.sort_values(STATEMENT_ORDER).iloc[0][STATEMENT_ORDER])
+                value = hsn4.cat.categories[code]
+                if value not in partitions:
+                    partitions[value] = (first, os.path.join(spill_dir, f"{code}.pkl"))
+                partitions[value] = (min(partitions[value][0], first), partitions[value][1])
+                _spill_frame(partitions[value][1], part)
+            watch.checkpoint()
+        if rows is not None:
+            log(f"{done}. Rows: {rows}")
+            total += rows
+    log(f"All EWB HSN combinations: {total}")
+    if not total:
+        raise ValueError("no EWB item records to prepare the stock statement from")
+    return dict(sorted(partitions.items(), key=lambda item: item[1][0]))
+
+
+def _statement_rows(edfm_main: pd.DataFrame, part: pd.DataFrame, gstin: str) -> pd.DataFrame:
+    """The stock statement rows of one HSN: its spilled items joined back with their merged EWB rows."""
+    part = part.sort_values(STATEMENT_ORDER, kind='stable', ignore_index=True)
+    final = pd.concat([edfm_main.iloc[part['_pos'].to_numpy()].reset_index(drop=True),
+                       part.drop(columns=['ewb', *STATEMENT_ORDER])], axis=1)
+    final['Unit'] = final['Unit'].astype('category')
+
+    # Quantities in the base unit of their HSN (e.g. KGS -> MTS), unknown units flagged
+    final = _normalise_units(final)
+
+    # Define Purchase/Sale columns based on GSTIN
+    final['Purchase from'] = final['From GSTIN & Name']
+    final['Sale To'] = final['To GSTIN & Name']
+    final['Pur_Value'] = final['Sale_Value'] = final['Assess Val.']
+    final['Pur_TaxVal'] = final['Sale_TaxVal'] = final['Tax Val.']
+    final['Pur_Vehicle'] = _with_blank(final['Latest Vehicle No.'])
+    final['Sale_Vehicle'] = _with_blank(final['Latest Vehicle No.'])
+    final['Pur_Qty'] = final['Sale_Qty'] = final['Qty']
+
+    # Adjust values based on whether it's a purchase or sale for the current GSTIN
+    final.loc[_contains(final['Purchase from'], gstin), ['Pur_Value', 'Pur_TaxVal', 'Pur_Vehicle', 'Pur_Qty']] = [0, 0, '', 0]
+    final.loc[_contains(final['Sale To'], gstin), ['Sale_Value', 'Sale_TaxVal', 'Sale_Vehicle', 'Sale_Qty']] = [0, 0, '', 0]
+
+    final['Pur_Qty'] = final['Pur_Qty'].fillna(0)
+    final['Sale_Qty'] = final['Sale_Qty'].fillna(0)
+
+    final['0B'] = 0
+    final['Total Stock'] = 0
+    final['CB'] = 0
+    final[' '] = ''
+
+    final = final.drop(['From GSTIN & Name','To GSTIN & Name','Doc No. & Dt.','Assess Val.','Tax Val.','HSN Desc.','Latest Vehicle No.','Qty','From Place & Pin','To Place & Pin'], axis=1)
+    return _stock_balances(final)
+
+
+def xlsx_mergejoinsort_stock_stmt(dpath, mfile, edfm_main, toll_sheets=None, toll_formulas=False, consumed: list = None, watch=None) -> bool:
+    """
+    Merges, joins, sorts EWB data and prepares the stock statement.
+    The item records are streamed: partitioned per HSN on disk first, then every HSN sheet is
+    made from its own partition, so the statement never holds all items at once.
+    Args:
+        dpath (str): The GSTIN-specific download directory.
+        mfile (str): Merged file prefix (e.g., 'Merged_GSTIN').
+        edfm_main (pd.DataFrame): The main merged EWB DataFrame (from _load_merged_ewbs).
+        toll_sheets (tuple): (TollData, TollUniq) frames from _load_toll_sheets, for the toll columns.
+        toll_formulas (bool): Write the toll columns as HYPERLINK/VLOOKUP formulas instead of values.
+        consumed (list): Collects the record files read (see _iter_records).
+        watch (_MemoryWatch): Chunk size of the record reads and memory ceiling (optional).
+    Returns:
+        bool: True once the stock statement is saved
+    """
+    start_time = time.time()
+    watch = watch if watch is not None else _MemoryWatch("stock statement", mfile.replace('Merged_', ''))
+    spill_dir = None
+    try:
+        spill_dir = tempfile.mkdtemp(prefix=".stockstmnt_", dir=dpath)
+        # Sheets in order of the first EWB of every HSN, each one made from its own partition
+        partitions = _partition_statement_items(dpath, edfm_main, spill_dir, consumed, watch)
+
+        # Toll columns as values with a link to the EWB's first TollData row, or as Excel formulas
+        toll_rows, toll_states = _toll_links(toll_sheets)
+        excel_file_path = dpath + '/' + mfile + '_stockstmnt.xlsx'
+        # All sheets in one streaming pass: HSN sheets then TollData/TollUniq, and every HSN sheet
+        # also goes to the combined sheet of _stockstmntall.xlsx as it is written
+        book = _XlsxAppender(excel_file_path)
+        combined = _XlsxAppender(os.path.join(dpath, f'{mfile}_stockstmntall.xlsx'), dedupe=True)
+        try:
+            for value, (_, spill_path) in partitions.items():
+                try:
+                    final_hsn = _statement_rows(edfm_main, _read_spilled(spill_path), mfile.replace('Merged_', ''))
+                    os.remove(spill_path)
+                    start_excel_row = 2
+                    links = None
+                    if toll_formulas:
+                        final_hsn['EWB Toll'] = [f'=HYPERLINK("#"&CELL("address",INDEX(TollData!A:A,MATCH(D{excel_row},TollData!A:A,0))),D{excel_row})' for excel_row in range(start_excel_row, start_excel_row + len(final_hsn))]
+                        final_hsn['States in which vehicle movement exists'] = [f'=VLOOKUP(D{excel_row},TollUniq!A:B,{excel_row},FALSE)' for excel_row in range(start_excel_row, start_excel_row + len(final_hsn))]
+                    else:
+                        toll_row = final_hsn['EWB No.'].map(toll_rows)
+                        final_hsn['EWB Toll'] = final_hsn['EWB No.'].where(toll_row.notna())
+                        final_hsn['States in which vehicle movement exists'] = final_hsn['EWB No.'].map(toll_states)
+                        links = {'EWB Toll': ("TollData!A" + toll_row.astype("Int64").astype(str)).where(toll_row.notna())}
+                    final_hsn = final_hsn[['S.No','DateTime','0B','EWB No.','EWB Toll','HSN Code','Trans', 'Purchase from', 'From', 'Pur_Qty','Pur_Value','Pur_TaxVal','Pur_Vehicle','Total Stock',' ','Sale To', 'To', 'Sale_Qty','Sale_Value','Sale_TaxVal','Sale_Vehicle','CB','Dist','States in which vehicle movement exists','Unit','Unit Flag']]
+                    #final_hsn = final_hsn[['S.No','DateTime','0B','EWB No.','HSN Code', 'Purchase from', 'Pur_Qty','Pur_Value','Pur_TaxVal','Pur_Vehicle','Total Stock',' ','Sale To', 'Sale_Qty','Sale_Value','Sale_TaxVal','Sale_Vehicle','CB','Dist']]
+                    book.append(final_hsn, sheet=value, links=links)
+                    final_hsn['SheetName'] = value  # Add sheet name column
+                    if toll_formulas:
+                        # The formulas point into this workbook's rows and toll sheets, not the combined one
+                        final_hsn[['EWB Toll', 'States in which vehicle movement exists']] = None
+                    combined.append(final_hsn)
+                    print(f"*** Stock statement creation for HSN: {value} is complete ***")
+                except Exception as e:
+                    log(f"❌ Error creating stock statement for for HSN: {value} : {e}")
+            if toll_sheets is not None:
+                toll_data, toll_uniq = toll_sheets
+                book.append(toll_data, sheet='TollData')
+                if toll_uniq is not None:
+                    book.append(toll_uniq, sheet='TollUniq')
+                    log("TollData and TollUniq sheets added to the stock statement.")
+                else:
+                    log("Skipping TollUniq sheet creation: 'State' or 'ewb' column missing in toll data.")
+            book.close()
+            combined.close()
+        except Exception:
+            book.discard()
+            combined.discard()
+            raise
+        log(f"✅ Sheet merge successful. Rows before/after duplicates: {combined.rows_in} and {combined.rows}")
+        log(f"*** ✅ Stock statement creation for {mfile.replace('Merged_','')} is complete *** ({time.time() - start_time:.1f} sec)")
+        return True
+    except Exception as e:
+        log(f"❌ Error creating stock statement Excel file for {mfile}: {e}")
+        return False
+    finally:
+        if spill_dir is not None:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+def _load_toll_sheets(dpath, consumed: list = None):
+    """
+    Loads the toll records of a GSTIN as the TollData frame ('ewb' first) and the TollUniq frame
+    (distinct states per EWB, None without 'State'/'ewb' columns). None when there are no records.
+    """
+    excl_merged = _load_records(dpath, "toll", "toll", consumed)
+    if excl_merged is None:
+        log("No toll files found to merge.")
+        return None
+    log(f"✅ EWB toll merge successful. Rows: {len(excl_merged)}")
+
+    # Reorder columns to have 'ewb' first
+    if 'ewb' in excl_merged.columns:
+        cols = excl_merged.columns.tolist()
+        cols.insert(0, cols.pop(cols.index('ewb'))) # Move 'ewb' to front
+        excl_ewbs = excl_merged[cols]
+    else:
+        excl_ewbs = excl_merged # No 'ewb' column, proceed as is
+    log(f"Length of All EWB toll combinations: {len(excl_ewbs)}")
+
+    result_unique_states = None
+    if 'State' in excl_merged.columns and 'ewb' in excl_merged.columns:
+        excl_merged_unique_states = excl_merged[['ewb', 'State']].drop_duplicates()
+        excl_merged_unique_states = excl_merged_unique_states[excl_merged_unique_states['State'].notna() & (excl_merged_unique_states['State'] != '')]
+        result_unique_states = excl_merged_unique_states.groupby('ewb')['State'].agg(','.join).reset_index()
+    return excl_ewbs, result_unique_states
+
+
+def xlsx_mergejoinsort_toll_details(dpath, mfile, toll_sheets=None) -> bool:
+    """
+    Merges, sorts toll data and appends to the stock statement file. Only for a stock statement
+    made in an earlier run, xlsx_mergejoinsort_stock_stmt writes the toll sheets itself.
+    Args:
+        dpath (str): The GSTIN-specific download directory.
+        mfile (str): Merged file prefix (e.g., 'Merged_GSTIN').
+        toll_sheets (tuple): (TollData, TollUniq) frames already loaded with _load_toll_sheets.
+    Returns:
+        bool: True once the toll sheets are saved (or there were none to add)
+    """
+    try:
+        if toll_sheets is None:
+            toll_sheets = _load_toll_sheets(dpath)
+        if toll_sheets is None:
+            return True # Exit if no toll data was found
+        excl_ewbs, result_unique_states = toll_sheets
+
+        existing_excel_path = os.path.join(dpath, f'{mfile}_stockstmnt.xlsx')
+        
+        if not os.path.exists(existing_excel_path):
+            log(f"❌ Error: Stock statement file not found at {existing_excel_path}. Cannot append Toll Data.")
+            return False
+
+        try:
+            with pd.ExcelWriter(existing_excel_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
+                excl_ewbs.to_excel(writer, index=False, sheet_name='TollData')
+
+                # Prepare TollUniq sheet
+                if result_unique_states is not None:
+                    result_unique_states.to_excel(writer, index=False, sheet_name='TollUniq')
+                    log("TollData and TollUniq sheets appended to existing Excel file.")
+                else:
+                    log("Skipping TollUniq sheet creation: 'State' or 'ewb' column missing in toll data.")
         except Exception as e:
-            log(f"❌ Error extracting toll data for EWB {ewb}: {e}")
+            log(f"❌ Error appending toll sheets to Excel file for file: {mfile}: {e}")
+            return False
+        return True
+    except Exception as e:
+        log(f"❌ Error whiile function call xlsx_mergejoinsort_toll_details() for file: {mfile}: {e}")
+        return False
+
+
+def _merge_gstin_reports(downloads_dir: str, gstin: str, file_names, incremental: bool, convert_workers: int,
+                         report_frames, memory_limit_mb: int, chunk_rows: int):
+    """Merge stage of a GSTIN, parses its downloaded reports into Merged_<GSTIN>.xlsx. Returns the peak RSS."""
+    try:
+        with _MemoryWatch("merge", gstin, memory_limit_mb, chunk_rows) as watch:
+            # Parse the reports not yet in the merge buffer in parallel, no .xlsx copies needed
+            report_frames = parse_reports(downloads_dir, gstin, file_names, convert_workers, report_frames, write_xlsx=False)
+            xlsx_merge(downloads_dir, gstin, file_names, incremental, report_frames, watch)
+    finally:
+        # Also the reports spilled by a download cut short by an expired session
+        shutil.rmtree(os.path.join(downloads_dir, REPORT_SPILL_DIR), ignore_errors=True)
+    return watch.peak_mb
+
+
+def _build_gstin_statements(downloads_dir: str, gstin: str, kinds: tuple, edfm: pd.DataFrame, toll_formulas: bool,
+                            memory_limit_mb: int):
+    """
+    Statement stage of a GSTIN, the stock statement and/or toll sheets from the crawled EWB files.
+    The record files are removed once the statements are saved. When one fails they are kept for
+    the next run and the stage raises, so it is not booked as done. Returns the peak RSS.
+    """
+    mfile = 'Merged_' + gstin
+    consumed = []
+    with _MemoryWatch("stock statement", gstin, memory_limit_mb) as watch:
+        # Loaded first, the stock statement resolves its toll columns from them
+        toll_sheets = _load_toll_sheets(downloads_dir, consumed) if "toll" in kinds else None
+        saved = True
+        if "details" in kinds:
+            # Writes the HSN, toll and combined sheets in one pass
+            saved = xlsx_mergejoinsort_stock_stmt(downloads_dir, mfile, edfm, toll_sheets, toll_formulas, consumed, watch)
+            if saved:
+                log(f"✅ Stock Statement preparation complete for GSTIN: {gstin}.")
+        if "toll" in kinds:
+            # Toll sheets for a stock statement made in an earlier run
+            if toll_sheets is not None and "details" not in kinds:
+                saved = xlsx_mergejoinsort_toll_details(downloads_dir, mfile, toll_sheets)
+            if saved:
+                log(f"✅ Toll details creation complete for {gstin}.")
+    if not saved:
+        raise RuntimeError(f"statements not saved, {len(consumed)} record file(s) kept for the next run")
+    _remove_record_files(consumed)
+    return watch.peak_mb
+
+
+def _timed_stage(fn, *args, log_context=None):
+    """
+    Runs a stage function in a pool worker (or inline), returns its seconds and peak RSS.
+    log_context is the lane of the submitting thread: contextvars do not cross into the
+    spawned worker, so it is set there for the stage's log lines.
+    """
+    token = _log_context.set(log_context) if log_context is not None else None
+    try:
+        started = time.time()
+        peak_mb = fn(*args)
+        return time.time() - started, peak_mb
+    finally:
+        if token is not None:
+            _log_context.reset(token)
+
+
+class _PostProcessPool:
+    """
+    Runs the post-processing stages of finished GSTINs (merge, stock statement) in worker processes
+    while the browser goes on with the next GSTIN. At most max_pending jobs are queued or running,
+    submit() waits for the oldest one beyond that, so a slow pool holds the browser back instead of
+    piling up parsed frames. With workers=0 the stages run inline, one after the other.
+    on_done callbacks (manifest, sync state) run in this process once a stage succeeded.
+    The browser context lanes share one pool. Its queue is guarded by a lock that is never held
+    while waiting on a job, so one lane waiting for its merge does not block the others.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        # spawn, not fork: the browser driver and the memory watch run threads in this process
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) if workers > 0 else None
+        self.max_pending = max(max_pending, 1)
+        self.pending = deque()  # (stage, gstin, future, on_done, finished event), oldest first
+        self.claimed = set()  # jobs being finished by one of the lanes
+        self.stage_seconds = {}
+        self.stage_jobs = {}
+        self.waited = 0.0
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def submit(self, stage: str, gstin: str, on_done, fn, *args):
+        if self.executor is None:
+            self._finish(stage, gstin, on_done, lambda: _timed_stage(fn, *args))
+            return
+        self.poll()
+        if len(self.pending) >= self.max_pending:
+            log(f"⏳ Post-processing queue full ({len(self.pending)} job(s)), waiting before the next GSTIN...")
+        while True:
+            with self.lock:
+                if len(self.pending) < self.max_pending:
+                    self.pending.append((stage, gstin, self.executor.submit(_timed_stage, fn, *args, log_context=_log_context.get()), on_done, threading.Event()))
+                    queued = len(self.pending)
+                    break
+                oldest = self.pending[0]
+            self._collect(oldest)
+        log(f"Queued {stage} for GSTIN: {gstin}, {queued} post-processing job(s) pending.")
+
+    def poll(self):
+        """Finish the jobs that are already done, without waiting."""
+        with self.lock:
+            done = [job for job in self.pending if job[2].done()]
+        for job in done:
+            self._collect(job)
+
+    def wait_for(self, stage: str, gstin: str):
+        """Wait until the given stage of a GSTIN is done and its on_done callback has run."""
+        while True:
+            with self.lock:
+                jobs = [job for job in self.pending if job[0] == stage and job[1] == gstin]
+            if not jobs:
+                return
+            for job in jobs:
+                self._collect(job)
+
+    def close(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    break
+                oldest = self.pending[0]
+            self._collect(oldest)
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def _collect(self, job):
+        """
+        Wait for a job outside the lock, so the other lanes can queue and collect meanwhile. The
+        first caller to see it done finishes it, the others wait until its on_done has run.
+        """
+        stage, gstin, future, on_done, finished = job
+        started = time.time()
+        future.exception()  # blocks until done, result() below raises the error if any
+        with self.lock:
+            self.waited += time.time() - started
+            owner = job in self.pending and job not in self.claimed
+            if owner:
+                self.claimed.add(job)
+        if not owner:
+            finished.wait()
+            return
+        try:
+            self._finish(stage, gstin, on_done, future.result)
+        finally:
+            with self.lock:
+                self.pending.remove(job)
+                self.claimed.discard(job)
+            finished.set()
+
+    def _finish(self, stage: str, gstin: str, on_done, result):
+        try:
+            seconds, peak_mb = result()
+        except Exception as e:
+            log(f"❌ Error in {stage} for GSTIN: {gstin}: {e}")
+            return
+        with self.lock:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0) + seconds
+            self.stage_jobs[stage] = self.stage_jobs.get(stage, 0) + 1
+            if peak_mb is not None:
+                _stage_peak_rss[stage] = max(_stage_peak_rss.get(stage, 0), peak_mb)
+        if on_done is None:
+            return
+        try:
+            on_done()
+        except Exception as e:
+            log(f"❌ Error after {stage} for GSTIN: {gstin}: {e}")
+
+    def log_utilisation(self, browser_seconds: float, lanes: int = 1):
+        wall = max(time.time() - self.started, 1e-9)
+        slots = max(self.workers, 1)
+        log(f"📊 Pipeline: {wall:.0f} sec wall time, browser busy {browser_seconds:.0f} sec "
+            f"({100 * browser_seconds / (wall * lanes):.0f}% of {lanes} context(s)), waited {self.waited:.0f} sec on the post-processing queue")
+        for stage, seconds in self.stage_seconds.items():
+            log(f"📊 {stage}: {self.stage_jobs[stage]} job(s), {seconds:.0f} sec, "
+                f"{100 * seconds / (wall * slots):.0f}% of {slots} worker(s)" + (" (inline)" if self.executor is None else ""))
+
+
+def _stage_unit(stage: str, month_year_tuple_list: list) -> str:
+    """Run manifest key of a stage for the month range of the run, a run over other months does the stage again."""
+    if not month_year_tuple_list:
+        return stage
+    return f"{stage}|{_month_key(month_year_tuple_list[0])}..{_month_key(month_year_tuple_list[-1])}"
+
+
+def _record_gstin_sync(sync_state, manifest, gstin: str, merge_unit: str, work_items: list, skipped: list, full_sweep: bool,
+                       state_group_skip_flag: bool, grace_days: int):
+    """Book the merge of a GSTIN as done and record its synced months and state group hits."""
+    _manifest_set(manifest, gstin, "stage", merge_unit, "done")
+    _record_group_hits(sync_state, manifest, gstin, work_items)
+    if state_group_skip_flag and full_sweep:
+        _record_full_sweep(sync_state, gstin)
+    # Months with skipped state groups are not complete, a later probe or full sweep closes them
+    synced_count = _record_synced_months(sync_state, manifest, gstin, work_items + skipped, grace_days)
+    if synced_count:
+        log(f"Marked {synced_count} closed direction/month(s) as synced for GSTIN: {gstin}.")
+    log(f"✅ E-Way Bill extraction and merge complete for GSTIN: {gstin}.")
+
+
+def _record_gstin_statements(manifest, gstin: str, stages: list):
+    for stage in stages:
+        _manifest_set(manifest, gstin, "stage", stage, "done")
+
+
+def _open_session_browser(playwright, storage_state: dict, headless: bool = True):
+    """
+    Open a browser logged in with a storage state (cookies) instead of the manual login, on the
+    report page. Returns (context, report page), raises _SessionExpired when the portal sends it
+    to the login page.
+    """
+    browser = playwright.chromium.launch(headless=headless, args=[] if headless else ["--start-maximized"])
+    try:
+        context = browser.new_context(accept_downloads=True, storage_state=storage_state)
+        page = _open_report_page(context)
+    except Exception:
+        browser.close()
+        raise
+    return context, page
+
+
+def _headless_handoff(playwright, context):
+    """Hand the visible login context over to a headless browser. Returns (context, report page) of the headless browser."""
+    started = time.time()
+    headless_context, page = _open_session_browser(playwright, context.storage_state())
+    _record_latency("headless_handoff", time.time() - started)
+    return headless_context, page
+
+
+def _load_session_state(path: str, username: str):
+    """Storage state an earlier run saved for this username, None when there is none or it belongs to another account."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(saved, dict) or saved.get("username") != username:
+        return None
+    return saved.get("storage_state")
+
+
+def _save_session_state(path: str, username: str, storage_state: dict):
+    """
+    Save the login cookies with the username they belong to, readable by the user only (0600,
+    in a 0700 directory). They open the portal without a login for that username only.
+    """
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    partial_path = path + ".partial"
+    fd = os.open(partial_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.chmod(partial_path, 0o600)  # an older leftover keeps its mode otherwise
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"username": username, "storage_state": storage_state}, f)
+    os.replace(partial_path, path)
+
+
+def _manual_login(username: str, password: str) -> dict:
+    """
+    Log in again on a visible browser (CAPTCHA/OTP by hand) and return the new storage state.
+    Runs on a thread of its own: the caller may be a lane with its own Playwright or the
+    crawl's event loop, where the sync API cannot start.
+    """
+    result = {}
+
+    def run():
+        try:
+            with sync_playwright() as p:
+                browser = p.chromium.launch(headless=False, args=["--start-maximized"])
+                try:
+                    context = browser.new_context()
+                    login_and_open_ewb_mis(context.new_page(), context, username, password)
+                    result["storage_state"] = context.storage_state()
+                finally:
+                    browser.close()
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["storage_state"]
+
+
+class _SessionGuard:
+    """
+    The portal login shared by all lanes and crawls. The first worker that lands on the login
+    page calls renew(): ready is cleared, so the other workers pause before their next item,
+    the login is done once by hand on a visible browser and saved, and the workers load the
+    new cookies (generation tells them apart) and resume. When the login fails the session is
+    lost: the workers stop instead of timing out on every item, the manifest keeps the rest.
+    """
+
+    def __init__(self, storage_state: dict, login, state_path: str = None, username: str = None):
+        self.storage_state = storage_state
+        self.login = login  # () -> storage state of a new manual login
+        self.state_path = state_path
+        self.username = username
+        self.generation = 0
+        self.lost = False
+        self.ready = threading.Event()
+        self.ready.set()
+        self.lock = threading.Lock()
+
+    def renew(self, generation: int) -> bool:
+        """Renew the login whose cookies the caller got at `generation`. True once a newer login is there."""
+        with self.lock:
+            if self.lost:
+                return False
+            if self.generation > generation:
+                return True  # renewed by another worker meanwhile
+            self.ready.clear()
+            log("⚠️ Portal session expired, work paused. Please log in again (CAPTCHA/OTP) in the browser window...")
+            try:
+                self.storage_state = self.login()
+                self.generation += 1
+                if self.state_path:
+                    _save_session_state(self.state_path, self.username, self.storage_state)
+                log("✅ Logged in again, resuming the work.")
+            except Exception as e:
+                self.lost = True
+                log(f"❌ Login again failed, stopping the remaining work, it resumes on the next run: {e}")
+            finally:
+                self.ready.set()
+            return not self.lost
+
+
+def _lane_log_path(label: str) -> str:
+    """Log file of one browser context lane beside the main log, e.g. log_ctx2.txt."""
+    stem, extension = os.path.splitext(LOG_PATH)
+    return f"{stem}_{label}{extension}"
+
+
+def _new_lane(label: str, context, page: Page, http_engine: bool, pool_size: int, generation: int = 0) -> dict:
+    """A browser context lane: its logged-in context, report page and (HTTP engine) cookie session."""
+    http_session = None
+    if http_engine:
+        try:
+            http_session = _new_http_session(context, page, pool_size)
+            log("Using HTTP postback engine for EWB report downloads, browser is the fallback.")
+        except Exception as e:
+            log(f"❌ Could not set up HTTP postback engine, using the browser instead: {e}")
+    return {"label": label, "context": context, "page": page, "http_session": http_session, "generation": generation}
+
+
+def _refresh_lane_session(lane: dict, session_guard) -> bool:
+    """Load the cookies of the guard's newest login into a lane. False when the session is lost."""
+    if not session_guard.ready.is_set():
+        session_guard.ready.wait()
+    if session_guard.lost:
+        return False
+    if lane["generation"] < session_guard.generation:
+        cookies = session_guard.storage_state["cookies"]
+        lane["context"].clear_cookies()
+        lane["context"].add_cookies(cookies)
+        if lane["http_session"] is not None:
+            _set_http_cookies(lane["http_session"], cookies)
+        lane["page"].goto(GSTIN_BASED_RPT_URL, wait_until="domcontentloaded", timeout=_5_MIN_TIMEOUT)
+        lane["generation"] = session_guard.generation
+    return True
+
+
+def _work_lane(lane: dict, phases: list, session_guard=None):
+    """
+    Work through the phases on one lane: each phase is a (GSTIN queue, work function) pair
+    whose queue all lanes share, so a GSTIN is done by exactly one lane and a slow lane takes
+    fewer. A lane whose browser is gone stops and leaves the rest to the other lanes. With a
+    session guard a GSTIN whose work raised _SessionExpired (or left the page on the login) is
+    done once more after a new login.
+    """
+    token = _log_context.set((lane["label"], _lane_log_path(lane["label"]))) if lane["label"] else None
+    try:
+        for gstin_queue, work in phases:
+            while True:
+                try:
+                    gstin = gstin_queue.popleft()
+                except IndexError:
+                    break
+                for attempt in range(2):
+                    if session_guard is not None and not _refresh_lane_session(lane, session_guard):
+                        log(f"❌ Portal session lost, GSTIN: {gstin} and the rest of the queue are left for the next run.")
+                        return
+                    expired = False
+                    try:
+                        work(lane, gstin)
+                    except _SessionExpired as e:
+                        expired = True
+                        log(f"⚠️ Portal session expired for GSTIN: {gstin} in browser context {lane['label']}: {e}")
+                    except Exception as e:
+                        log(f"❌ Error for GSTIN: {gstin} in browser context {lane['label']}: {e}")
+                    if session_guard is None or attempt or not (expired or _on_login_page(lane["page"])):
+                        break
+                    log(f"⚠️ Portal session expired during GSTIN: {gstin}, it is done again after the new login.")
+                    session_guard.renew(lane["generation"])
+                if not lane["context"].browser.is_connected():
+                    log(f"❌ Browser of context {lane['label']} is gone, leaving the remaining GSTINs to the other contexts.")
+                    return
+    finally:
+        if token is not None:
+            _log_context.reset(token)
+
+
+def _context_lane_thread(label: str, session_guard, request_filter: dict, http_engine: bool, pool_size: int, phases: list,
+                         headless: bool = False):
+    """
+    One more browser context lane on its own thread: the sync API is bound to the thread that
+    started it, so the lane has its own Playwright and browser, logged in with the storage state
+    (cookies) of the guard's login instead of a second CAPTCHA/OTP.
+    """
+    _log_context.set((label, _lane_log_path(label)))
+    try:
+        with sync_playwright() as p:
+            browser = p.chromium.launch(headless=headless, args=[] if headless else ["--start-maximized"])
+            try:
+                generation = session_guard.generation
+                context = browser.new_context(accept_downloads=True, storage_state=session_guard.storage_state)
+                _install_request_filter(context, request_filter)
+                lane = _new_lane(label, context, _open_report_page(context), http_engine, pool_size, generation)
+                log(f"✅ Browser context {label} opened with the shared login.")
+            except Exception as e:
+                log(f"❌ Could not open browser context {label}, its GSTINs go to the other contexts: {e}")
+                browser.close()
+                return
+            _work_lane(lane, phases, session_guard)
+            browser.close()
+    except Exception as e:
+        log(f"❌ Browser context {label} stopped: {e}")
 
 
 def main():
@@ -716,92 +3375,266 @@ def main():
     extract_ewb_data_flag = config["extract_ewb_data_flag"]
     prepare_stock_statement_flag = config["prepare_stock_statement_flag"]
     check_toll_data_flag = config["check_toll_data_flag"]
+    download_concurrency = int(config.get("download_concurrency", 1))
+    report_engine = config.get("report_engine", "browser")
+    ewb_detail_concurrency = int(config.get("ewb_detail_concurrency", 4))
+    ewb_cache_flag = config.get("ewb_cache_flag", True)
+    ewb_cache_immutable_days = int(config.get("ewb_cache_immutable_days", 30))
+    resume_flag = config.get("resume_flag", True)
+    incremental_sync_flag = config.get("incremental_sync_flag", False)
+    incremental_grace_days = int(config.get("incremental_grace_days", 7))
+    state_group_skip_flag = config.get("state_group_skip_flag", False)
+    state_group_skip_after = int(config.get("state_group_skip_after", 3))
+    state_group_probe_days = int(config.get("state_group_probe_days", 14))
+    state_group_full_sweep_days = int(config.get("state_group_full_sweep_days", 30))
+    report_window_months = int(config.get("report_window_months", 1))
+    report_row_limit = int(config.get("report_row_limit", 0))
+    request_filter_flag = config.get("request_filter_flag", True)
+    block_resource_types = config.get("block_resource_types", ["image", "media", "font", "stylesheet"])
+    block_url_patterns = config.get("block_url_patterns", [r"google-analytics\.com", r"googletagmanager\.com", r"doubleclick\.net"])
+    allow_url_patterns = config.get("allow_url_patterns", [r"(?i)captcha"])
+    # Postback/download/page timeout, tune it from the latency histograms logged at the end of a run
+    step_timeout = int(config.get("step_timeout_sec", DEFAULT_TIMEOUT // 1000)) * 1000
+    direct_merge_flag = config.get("direct_merge_flag", False)
+    convert_workers = int(config.get("convert_workers", 0))
+    record_sink = config.get("record_sink", "parquet")
+    record_batch_rows = int(config.get("record_batch_rows", 5000))
+    memory_limit_mb = int(config.get("memory_limit_mb", 4096))
+    merge_chunk_rows = int(config.get("merge_chunk_rows", MERGE_CHUNK_ROWS))
+    toll_formula_flag = config.get("toll_formula_flag", False)
+    postprocess_workers = int(config.get("postprocess_workers", 1))
+    postprocess_queue_size = int(config.get("postprocess_queue_size", 2))
+    parallel_contexts = int(config.get("parallel_contexts", 1))
+    headless_flag = config.get("headless_flag", True)
+    session_reuse_flag = config.get("session_reuse_flag", True)
     if getattr(sys, 'frozen', False):
         os.environ['PLAYWRIGHT_BROWSERS_PATH'] = os.path.join(sys._MEIPASS, 'playwright', 'driver')
     
     try:
         with sync_playwright() as p:
-            browser = p.chromium.launch(headless=False, args=["--start-maximized"])
-            context = browser.new_context(accept_downloads=True)
-            # ewb_page = context.new_page()
-            page = context.new_page()
-            #Login and navigate to EWB MIS portal
-            try:
-                ewb_page = login_and_open_ewb_mis(page, context, username, password)
-            except Exception as e:
-                log(f"Login or EWB MIS navigation failed: {e}")
-                context.close()
-                return
+            context = None
+            session_state_path = os.path.abspath(SESSION_STATE_PATH) if session_reuse_flag else None
+            # The login of an earlier run is reused while the portal still accepts it
+            saved_state = _load_session_state(session_state_path, username) if session_state_path else None
+            if saved_state is not None:
+                try:
+                    context, ewb_page = _open_session_browser(p, saved_state, headless_flag)
+                    log("✅ Reusing the saved portal session, no CAPTCHA/OTP needed.")
+                except Exception as e:
+                    log(f"Saved portal session is not accepted any more, logging in: {e}")
+            if context is None:
+                browser = p.chromium.launch(headless=False, args=["--start-maximized"])
+                context = browser.new_context(accept_downloads=True)
+                # ewb_page = context.new_page()
+                page = context.new_page()
+                #Login and navigate to EWB MIS portal
+                try:
+                    ewb_page = login_and_open_ewb_mis(page, context, username, password)
+                except Exception as e:
+                    log(f"Login or EWB MIS navigation failed: {e}")
+                    context.close()
+                    return
+                # The window is only needed for the CAPTCHA/OTP, the scraping goes on without one
+                if headless_flag:
+                    try:
+                        context, ewb_page = _headless_handoff(p, context)
+                        browser.close()
+                        log("✅ Login handed over to a headless browser, the visible window is closed.")
+                    except Exception as e:
+                        log(f"❌ Headless handoff failed, continuing in the visible browser: {e}")
+                        headless_flag = False
+            session_guard = _SessionGuard(context.storage_state(), partial(_manual_login, username, password), session_state_path, username)
+            if session_state_path:
+                _save_session_state(session_state_path, username, session_guard.storage_state)
+            # Filter only after the login, the login page needs its CAPTCHA image and styling. With
+            # filtering off everything is let through but still counted, to compare the traffic
+            if request_filter_flag:
+                request_filter = _new_request_filter(block_resource_types, block_url_patterns, allow_url_patterns)
+            else:
+                request_filter = _new_request_filter([], [], [])
+            _install_request_filter(context, request_filter)
             month_year_tuple_list = get_month_year_range(start_month, start_year, end_month, end_year)
             log(month_year_tuple_list)
-            
-            # Loop over GSTINs and download E-Way Bill
-            if extract_ewb_data_flag:
-                for gstin in gstins:
+            # Incremental sync and the state group history are read from the download outcomes,
+            # so the manifest is kept even when the run is not resumed
+            manifest = _open_run_manifest(os.path.abspath(RUN_MANIFEST_PATH))
+            if not resume_flag:
+                _manifest_clear(manifest)
+            run_started = time.time()
+            # Stages are keyed by the month range, a resumed run over other months does them again
+            merge_unit = _stage_unit("merge", month_year_tuple_list)
+            sync_state = _open_sync_state(os.path.abspath(SYNC_STATE_PATH))
+            # Merges and stock statements run in worker processes while the browser moves on
+            postprocess = _PostProcessPool(postprocess_workers, postprocess_queue_size)
+
+            # GSTINs are shared out over the browser context lanes: the downloads first, then the crawls
+            lane_totals = {"browser_seconds": 0.0, "skipped": 0}
+            lane_totals_lock = threading.Lock()  # also guards expired_downloads, shared by the lane threads
+            downloaded = {gstin: threading.Event() for gstin in gstins}
+            expired_downloads = set()
+
+            def download_gstin(lane, gstin):
+                expired = False
+                try:
+                    log(f"Starting to extract EWB for GSTIN: {gstin}")
+                    downloads_dir = os.path.abspath(f"./output/{gstin}")
+                    os.makedirs(downloads_dir, exist_ok=True)
+                    work_items = _report_work_items([_IN_, _OUT_], month_year_tuple_list)
+                    if incremental_sync_flag:
+                        synced = _synced_months(sync_state, gstin)
+                        work_items = [item for item in work_items if (item[0], _month_key(item[1])) not in synced]
+                        open_months = {(item[0], _month_key(item[1])) for item in work_items}
+                        log(f"Incremental sync for GSTIN: {gstin}, {len(open_months)} direction/month(s) to query, "
+                            f"{2 * len(month_year_tuple_list) - len(open_months)} already synced.")
+                        if not work_items:
+                            log(f"✅ All months already synced for GSTIN: {gstin}, keeping the existing merged file.")
+                            return
+                    skipped = []
+                    full_sweep = not state_group_skip_flag or _full_sweep_due(sync_state, gstin, state_group_full_sweep_days)
+                    if not full_sweep:
+                        work_items, skipped = _schedule_state_groups(sync_state, gstin, work_items, state_group_skip_after, state_group_probe_days)
+                        with lane_totals_lock:
+                            lane_totals["skipped"] += len(skipped)
+                        for item in skipped:
+                            _manifest_set_download(manifest, gstin, item, "skipped")
+                        log(f"Skipping {len(skipped)} of {len(work_items) + len(skipped)} report combinations for GSTIN: {gstin} "
+                            f"in state groups with no EWBs lately, {len(skipped)} GO round trip(s) saved.")
+                    elif state_group_skip_flag:
+                        log(f"Full sweep of all state groups for GSTIN: {gstin}.")
+                    _manifest_plan(manifest, gstin, "download", [_download_unit_key(item) for item in work_items])
+                    _manifest_plan(manifest, gstin, "stage", [merge_unit])
+                    pending = _manifest_pending_downloads(manifest, gstin, work_items, downloads_dir,
+                                                          incremental_grace_days if incremental_sync_flag else None)
+                    if len(pending) < len(work_items):
+                        log(f"Resuming GSTIN: {gstin}, {len(work_items) - len(pending)} of {len(work_items)} report combinations already done.")
+                    downloaded_any = bool(pending)
+                    # Reports parsed as they arrive, so the merge does not wait for them
+                    report_frames = {} if direct_merge_flag else None
+                    started = time.time()
+                    pending = _plan_report_windows(pending, report_window_months)
+                    if pending and report_window_months > 1:
+                        log(f"Querying {len(pending)} date window(s) of up to {report_window_months} months for GSTIN: {gstin}")
+                    if pending and lane["http_session"] is not None:
+                        pending = download_EWB_for_gstin_http(lane["http_session"], gstin, [_IN_, _OUT_], downloads_dir, month_year_tuple_list, download_concurrency,
+                                                              work_items=pending, manifest=manifest, row_limit=report_row_limit, frames=report_frames, timeout=step_timeout)
                     try:
-                        log(f"Starting to extract EWB for GSTIN: {gstin}")
-                        downloads_dir = os.path.abspath(f"./output/{gstin}")
-                        os.makedirs(downloads_dir, exist_ok=True)
-                        download_EWB_for_gstin(ewb_page, gstin, _IN_, downloads_dir, month_year_tuple_list)
-                        download_EWB_for_gstin(ewb_page, gstin, _OUT_, downloads_dir, month_year_tuple_list)
-                        xls_to_xlsx(downloads_dir, gstin)
-                        xlsx_merge(downloads_dir, gstin)
-                        log(f"✅ E-Way Bill extraction and merge complete for GSTIN: {gstin}.")
-                    except Exception as e:
-                        log(f"❌ Error while E-Way Bill extraction and merge for {gstin}: {e}")
-            else: 
-                log(f"Skipping downloading E-Way bills from GST portal as extract_ewb_data_flag is False.")
+                        if pending:
+                            download_EWB_for_gstin(lane["page"], gstin, [_IN_, _OUT_], downloads_dir, month_year_tuple_list, download_concurrency,
+                                                   work_items=pending, manifest=manifest, row_limit=report_row_limit, frames=report_frames, timeout=step_timeout)
+                    finally:
+                        with lane_totals_lock:
+                            lane_totals["browser_seconds"] += time.time() - started
+                    # The merge and the sync state are only booked once the merge succeeded, a
+                    # failed merge leaves its months open for the next run
+                    record_sync = partial(_record_gstin_sync, sync_state, manifest, gstin, merge_unit, work_items, skipped, full_sweep,
+                                          state_group_skip_flag, incremental_grace_days)
+                    if downloaded_any or not _manifest_done(manifest, gstin, "stage", merge_unit):
+                        file_names = {name for item in work_items for name in _downloaded_reports(downloads_dir, gstin, item)} if incremental_sync_flag else None
+                        postprocess.submit("merge", gstin, record_sync, _merge_gstin_reports, downloads_dir, gstin, file_names,
+                                           incremental_sync_flag, convert_workers, report_frames, memory_limit_mb, merge_chunk_rows)
+                    else:
+                        record_sync()
+                except _SessionExpired:
+                    # Cut short by an expired session, nothing is merged or booked. The lane logs in
+                    # again and does it once more, a second expiry leaves the reports to the next run
+                    with lane_totals_lock:
+                        expired = gstin not in expired_downloads
+                        expired_downloads.add(gstin)
+                    if expired:
+                        raise
+                    log(f"❌ Portal session expired again for GSTIN: {gstin}, its remaining reports are left for the next run.")
+                except Exception as e:
+                    log(f"❌ Error while E-Way Bill extraction and merge for {gstin}: {e}")
+                finally:
+                    if not expired:
+                        downloaded[gstin].set()
 
-            # Loop over GSTINs and prepare stock statement
-            if prepare_stock_statement_flag:
-                for gstin in gstins:
-                    try:
-                        log(f"Preparing Stock Statement for GSTIN: {gstin}")
-                        downloads_dir = os.path.abspath(f"./output/{gstin}")
-                        os.makedirs(downloads_dir, exist_ok=True)
-                        mfile = 'Merged_' + gstin
-                        merged_ewb_path = os.path.join(downloads_dir, mfile + '.xlsx')
-                        
-                        if not os.path.exists(merged_ewb_path):
-                            log(f"❌ Error: Merged EWB file not found for {gstin} at {merged_ewb_path}. Skipping Stock Statement.")
-                        else:
-                            edfm = pd.read_excel(merged_ewb_path)
-                            edfm['ewb'] = edfm['EWB No.']
-                            ewbs = edfm['ewb'].tolist()
-                            
-                            ewbextract_stock_stmt(ewb_page, ewbs, downloads_dir)
-                            xlsx_mergejoinsort_stock_stmt(downloads_dir, mfile, edfm)
-                            xlsxsheetmerge(gstin, downloads_dir)
-                            log(f"✅ Stock Statement preparation complete for GSTIN: {gstin}.")
-                    except Exception as e:
-                        log(f"❌ Error while stock statement preparation for {gstin}: {e}")
-            else: 
-                log(f"Skipping preparing stock statement from GST portal as prepare_stock_statement_flag is False.")
+            # Crawl EWB details and toll data in one pass, then prepare the stock statement and toll sheets
+            crawl_stages = {"details": _stage_unit("stock_statement", month_year_tuple_list), "toll": _stage_unit("toll_sheets", month_year_tuple_list)}
+            crawl_kinds = (("details",) if prepare_stock_statement_flag else ()) + (("toll",) if check_toll_data_flag else ())
 
-            if check_toll_data_flag:
-                for gstin in gstins:
-                    try:
-                        log(f"Checking Toll data for GSTIN: {gstin}...")
-                        downloads_dir = os.path.abspath(f"./output/{gstin}")
-                        os.makedirs(downloads_dir, exist_ok=True)
-                        mfile = 'Merged_' + gstin
-                        merged_ewb_path = os.path.join(downloads_dir, mfile + '.xlsx')
-                    
-                        if not os.path.exists(merged_ewb_path):
-                            log(f"❌ Error: Merged EWB file not found for {gstin} at {merged_ewb_path}. Skipping Toll Check.")
-                        else:
-                            edfm = pd.read_excel(merged_ewb_path)
-                            edfm['ewbno'] = edfm['EWB No.']
-                            ewbs = edfm['ewbno'].tolist()
-                            
-                            ewb_extract_toll_details(ewb_page, ewbs, downloads_dir)
-                            xlsx_mergejoinsort_toll_details(downloads_dir, mfile)
-                            log(f"✅ Toll details creation complete for {gstin}.")
-                    except Exception as e:
-                        log(f"❌ Error while Toll details creation for {gstin}: {e}")
-            else: 
+            def crawl_gstin(lane, gstin):
+                try:
+                    _manifest_plan(manifest, gstin, "stage", [crawl_stages[kind] for kind in crawl_kinds])
+                    kinds = tuple(kind for kind in crawl_kinds if not _manifest_done(manifest, gstin, "stage", crawl_stages[kind]))
+                    if not kinds:
+                        log(f"Stock statement/toll details already complete for GSTIN: {gstin} in the resumed run.")
+                        return
+                    log(f"Crawling EWB {' and '.join(kinds)} for GSTIN: {gstin}")
+                    downloads_dir = os.path.abspath(f"./output/{gstin}")
+                    os.makedirs(downloads_dir, exist_ok=True)
+                    merged_ewb_path = os.path.join(downloads_dir, 'Merged_' + gstin + '.xlsx')
+                    # Downloaded and merged by whichever lane had it
+                    while not downloaded[gstin].wait(5):
+                        if session_guard.lost:
+                            return
+                    postprocess.wait_for("merge", gstin)
+
+                    if not os.path.exists(merged_ewb_path):
+                        log(f"❌ Error: Merged EWB file not found for {gstin} at {merged_ewb_path}. Skipping Stock Statement and Toll Check.")
+                        return
+                    with _MemoryWatch("EWB frame", gstin, memory_limit_mb, merge_chunk_rows) as watch:
+                        edfm = _load_merged_ewbs(merged_ewb_path, watch)
+                    ewbs = edfm['ewb'].tolist()
+
+                    started = time.time()
+                    with _MemoryWatch("EWB crawl", gstin, memory_limit_mb):
+                        ewb_crawl(lane["context"], ewbs, downloads_dir, kinds, ewb_detail_concurrency,
+                                  os.path.abspath(EWB_CACHE_PATH) if ewb_cache_flag else None,
+                                  _ewb_generated_dates(edfm), ewb_cache_immutable_days, manifest, gstin, request_filter,
+                                  record_sink, record_batch_rows, headless_flag, session_guard, step_timeout)
+                    with lane_totals_lock:
+                        lane_totals["browser_seconds"] += time.time() - started
+                    if session_guard.lost:
+                        log(f"❌ EWB crawl for GSTIN: {gstin} stopped with the portal session, the statements wait for the next run.")
+                        return
+                    # The statements consume the per-EWB records, their units are finished for the run.
+                    # The records are only removed once the statements are saved
+                    for kind in kinds:
+                        _manifest_consume(manifest, gstin, kind)
+                    postprocess.submit("stock statement", gstin,
+                                       partial(_record_gstin_statements, manifest, gstin, [crawl_stages[kind] for kind in kinds]),
+                                       _build_gstin_statements, downloads_dir, gstin, kinds, edfm, toll_formula_flag, memory_limit_mb)
+                    del edfm
+                except Exception as e:
+                    log(f"❌ Error while stock statement/toll details creation for {gstin}: {e}")
+
+            phases = []
+            if extract_ewb_data_flag:
+                phases.append((deque(dict.fromkeys(gstins)), download_gstin))
+            else:
+                log(f"Skipping downloading E-Way bills from GST portal as extract_ewb_data_flag is False.")
+                for event in downloaded.values():
+                    event.set()
+            if crawl_kinds:
+                phases.append((deque(dict.fromkeys(gstins)), crawl_gstin))
+            http_engine = extract_ewb_data_flag and report_engine == "http"
+            lanes = max(min(parallel_contexts, len(gstins)), 1)
+            threads = []
+            if lanes > 1 and phases:
+                # The extra contexts get the cookies of this login, no second CAPTCHA/OTP
+                log(f"Sharing the login with {lanes - 1} more browser context(s), {len(gstins)} GSTIN(s) over {lanes} contexts.")
+                for lane_id in range(2, lanes + 1):
+                    thread = threading.Thread(target=_context_lane_thread, args=(f"ctx{lane_id}", session_guard, request_filter, http_engine,
+                                                                                 max(download_concurrency, 1), phases, headless_flag), daemon=True)
+                    thread.start()
+                    threads.append(thread)
+            _work_lane(_new_lane("ctx1" if lanes > 1 else None, context, ewb_page, http_engine, max(download_concurrency, 1)), phases, session_guard)
+            for thread in threads:
+                thread.join()
+            if extract_ewb_data_flag and state_group_skip_flag:
+                log(f"State group skip-list saved {lane_totals['skipped']} GO round trip(s) in this run.")
+            if not prepare_stock_statement_flag:
+                log(f"Skipping preparing stock statement from GST portal as prepare_stock_statement_flag is False.")
+            if not check_toll_data_flag:
                 log(f"Skipping toll data from GST portal as check_toll_data_flag is False.")
 
+            postprocess.close()
+            postprocess.log_utilisation(lane_totals["browser_seconds"], lanes)
+            _manifest_finish_run(manifest, gstins, run_started)
+            _log_request_filter(request_filter)
+            _log_latency_histograms()
+            _log_stage_memory()
             log("~*~ ✅All GSTINs processed successfully✅ ~*~")
             time.sleep(_5_MIN_TIMEOUT)
             context.close()
@@ -810,5 +3643,11 @@ def main():
         
 
 if __name__ == "__main__":
-    main()
+    multiprocessing.freeze_support()  # the converter's process pool in the PyInstaller exe
+    if CONFIG_PATH == "--bench-xls":
+        benchmark_xls_reader(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 0)
+    elif CONFIG_PATH == "--bench-stock":
+        benchmark_stock_statement(*(int(arg) for arg in sys.argv[2:4]))
+    else:
+        main()
 
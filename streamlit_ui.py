@@ -5,6 +5,7 @@ import os
 import sys
 import time
 import json
+import re
 import subprocess
 from datetime import date, datetime
 import streamlit as st
@@ -262,13 +263,57 @@ def load_config(path):
                 "end_year": config.get("end_year", today.year),
                 "extract_ewb_data_flag": config.get("extract_ewb_data_flag", True),
                 "prepare_stock_statement_flag": config.get("prepare_stock_statement_flag", True),
-                "check_toll_data_flag": config.get("check_toll_data_flag", True)
+                "check_toll_data_flag": config.get("check_toll_data_flag", True),
+                "download_concurrency": config.get("download_concurrency", 1),
+                "report_engine": config.get("report_engine", "browser"),
+                "ewb_detail_concurrency": config.get("ewb_detail_concurrency", 4),
+                "ewb_cache_flag": config.get("ewb_cache_flag", True),
+                "ewb_cache_immutable_days": config.get("ewb_cache_immutable_days", 30),
+                "resume_flag": config.get("resume_flag", True),
+                "incremental_sync_flag": config.get("incremental_sync_flag", False),
+                "incremental_grace_days": config.get("incremental_grace_days", 7),
+                "state_group_skip_flag": config.get("state_group_skip_flag", False),
+                "state_group_skip_after": config.get("state_group_skip_after", 3),
+                "state_group_probe_days": config.get("state_group_probe_days", 14),
+                "state_group_full_sweep_days": config.get("state_group_full_sweep_days", 30),
+                "report_window_months": config.get("report_window_months", 1),
+                "report_row_limit": config.get("report_row_limit", 0),
+                "request_filter_flag": config.get("request_filter_flag", True),
+                "block_resource_types": config.get("block_resource_types", ["image", "media", "font", "stylesheet"]),
+                "block_url_patterns": config.get("block_url_patterns", [r"google-analytics\.com", r"googletagmanager\.com", r"doubleclick\.net"]),
+                "allow_url_patterns": config.get("allow_url_patterns", [r"(?i)captcha"]),
+                "step_timeout_sec": config.get("step_timeout_sec", 180),
+                "direct_merge_flag": config.get("direct_merge_flag", False),
+                "convert_workers": config.get("convert_workers", 0),
+                "record_sink": config.get("record_sink", "parquet"),
+                "record_batch_rows": config.get("record_batch_rows", 5000),
+                "memory_limit_mb": config.get("memory_limit_mb", 4096),
+                "merge_chunk_rows": config.get("merge_chunk_rows", 20000),
+                "toll_formula_flag": config.get("toll_formula_flag", False),
+                "postprocess_workers": config.get("postprocess_workers", 1),
+                "postprocess_queue_size": config.get("postprocess_queue_size", 2),
+                "parallel_contexts": config.get("parallel_contexts", 1),
+                "headless_flag": config.get("headless_flag", True),
+                "session_reuse_flag": config.get("session_reuse_flag", True)
             }
     except (FileNotFoundError, json.JSONDecodeError):
         return {"url": "https://gstsso.nic.in/", "username": "", "password": "", "gstins": [],
                 "start_month": calendar.month_name[today.month], "end_month": calendar.month_name[today.month],
                 "start_year": today.year-1, "end_year": today.year, 
-                "extract_ewb_data_flag": True, "prepare_stock_statement_flag": True, "check_toll_data_flag": True}
+                "extract_ewb_data_flag": True, "prepare_stock_statement_flag": True, "check_toll_data_flag": True,
+                "download_concurrency": 1, "report_engine": "browser", "ewb_detail_concurrency": 4,
+                "ewb_cache_flag": True, "ewb_cache_immutable_days": 30, "resume_flag": True,
+                "incremental_sync_flag": False, "incremental_grace_days": 7,
+                "state_group_skip_flag": False, "state_group_skip_after": 3, "state_group_probe_days": 14,
+                "state_group_full_sweep_days": 30, "report_window_months": 1, "report_row_limit": 0,
+                "request_filter_flag": True, "block_resource_types": ["image", "media", "font", "stylesheet"],
+                "block_url_patterns": [r"google-analytics\.com", r"googletagmanager\.com", r"doubleclick\.net"],
+                "allow_url_patterns": [r"(?i)captcha"], "step_timeout_sec": 180,
+                "direct_merge_flag": False, "convert_workers": 0, "record_sink": "parquet", "record_batch_rows": 5000,
+                "memory_limit_mb": 4096, "merge_chunk_rows": 20000, "toll_formula_flag": False,
+                "postprocess_workers": 1, "postprocess_queue_size": 2,
+                "parallel_contexts": 1, "headless_flag": True,
+                "session_reuse_flag": True}
 
 
 def run_worker(config_path, log_path):
@@ -364,6 +409,136 @@ with tab1:
             check_toll_data_flag = st.checkbox("Check Toll Data", value=config["check_toll_data_flag"])
             st.markdown("</div>", unsafe_allow_html=True)
     
+    # Performance settings below both columns
+    with st.expander("⚡ Performance Settings"):
+        download_concurrency = st.number_input(
+            "Parallel report tabs (EWB download)", min_value=1, max_value=8,
+            value=int(config["download_concurrency"]),
+            help="Number of browser tabs that download the month/state group reports at the same time."
+        )
+        report_engines = ["browser", "http"]
+        report_engine = st.selectbox(
+            "Report download engine", report_engines,
+            index=report_engines.index(config["report_engine"]) if config["report_engine"] in report_engines else 0,
+            help="'http' replays the report postbacks without rendering pages, using the browser login. The browser is used for anything it cannot download."
+        )
+        ewb_detail_concurrency = st.number_input(
+            "Parallel pages (EWB details & toll)", min_value=1, max_value=16,
+            value=int(config["ewb_detail_concurrency"]),
+            help="Number of pages that open EWB print and toll pages at the same time for the stock statement and toll check."
+        )
+        ewb_cache_flag = st.checkbox(
+            "Reuse cached EWB details & toll data", value=config["ewb_cache_flag"],
+            help="Keeps fetched EWB print and toll pages in ./output/ewb_cache.sqlite, shared by all GSTINs and runs."
+        )
+        ewb_cache_immutable_days = st.number_input(
+            "Cache EWBs for good after (days)", min_value=1, max_value=365,
+            value=int(config["ewb_cache_immutable_days"]),
+            help="An EWB fetched this many days after it was generated is closed and never fetched again."
+        )
+        resume_flag = st.checkbox(
+            "Resume interrupted run", value=config["resume_flag"],
+            help="Skips the downloads, EWB pages and stages an interrupted run already finished (tracked in ./output/run_manifest.sqlite)."
+        )
+        incremental_sync_flag = st.checkbox(
+            "Incremental month sync", value=config["incremental_sync_flag"],
+            help="Only queries months not yet synced and merges the new EWBs into the existing Merged file (tracked in ./output/sync_state.sqlite)."
+        )
+        incremental_grace_days = st.number_input(
+            "Month is synced for good after (days)", min_value=0, max_value=90, value=int(config["incremental_grace_days"]),
+            help="A month fully downloaded this many days after it ended is not queried again in incremental runs."
+        )
+        state_group_skip_flag = st.checkbox(
+            "Skip state groups without EWBs", value=config["state_group_skip_flag"],
+            help="Queries the state groups that had EWBs before first and probes the ones that were always empty less often."
+        )
+        state_group_skip_after = st.number_input(
+            "Skip a state group after empty months", min_value=1, max_value=24, value=int(config["state_group_skip_after"]),
+            help="A state group empty in this many of its last checked months is skipped until its next probe."
+        )
+        state_group_probe_days = st.number_input(
+            "Probe skipped state groups every (days)", min_value=1, max_value=365, value=int(config["state_group_probe_days"])
+        )
+        state_group_full_sweep_days = st.number_input(
+            "Full sweep of all state groups every (days)", min_value=1, max_value=365, value=int(config["state_group_full_sweep_days"])
+        )
+        report_window_months = st.number_input(
+            "Months per report query", min_value=1, max_value=24, value=int(config["report_window_months"]),
+            help="Queries consecutive months in one date window, a window that fails or hits the row limit is split in halves."
+        )
+        report_row_limit = st.number_input(
+            "Report row limit of the portal (0 = unknown)", min_value=0, max_value=1000000, value=int(config["report_row_limit"]),
+            help="A report window with this many rows is treated as truncated and fetched again in smaller windows. A single month that still has this many rows is kept but recorded as failed."
+        )
+        request_filter_flag = st.checkbox(
+            "Block images, fonts, CSS & analytics", value=config["request_filter_flag"],
+            help="Only documents, scripts and XHR of the portal are loaded after login. Requests and bytes are reported at the end of the run."
+        )
+        block_resource_types_str = st.text_input(
+            "Blocked resource types", value=", ".join(config["block_resource_types"])
+        )
+        block_url_patterns_str = st.text_area(
+            "Blocked URL patterns (regex, one per line)", value="\n".join(config["block_url_patterns"])
+        )
+        allow_url_patterns_str = st.text_area(
+            "Always allowed URL patterns (regex, one per line)", value="\n".join(config["allow_url_patterns"])
+        )
+        block_resource_types = [t.strip() for t in block_resource_types_str.split(",") if t.strip()]
+        block_url_patterns = [pattern.strip() for pattern in block_url_patterns_str.split("\n") if pattern.strip()]
+        allow_url_patterns = [pattern.strip() for pattern in allow_url_patterns_str.split("\n") if pattern.strip()]
+        step_timeout_sec = st.number_input(
+            "Page/postback timeout (seconds)", min_value=10, max_value=1800, value=int(config["step_timeout_sec"]),
+            help="Tune it from the per-step latency percentiles (⏱) logged at the end of every run."
+        )
+        direct_merge_flag = st.checkbox(
+            "Parse reports as they download", value=config["direct_merge_flag"],
+            help="Parses every downloaded .xls report into memory right away, so the merge does not wait for the parsing."
+        )
+        convert_workers = st.number_input(
+            "Report parsing processes (0 = one per CPU)", min_value=0, max_value=64, value=int(config["convert_workers"])
+        )
+        record_sinks = ["parquet", "xlsx"]
+        record_sink = st.selectbox(
+            "EWB item & toll records store", record_sinks,
+            index=record_sinks.index(config["record_sink"]) if config["record_sink"] in record_sinks else 0,
+            help="parquet: batched files per GSTIN and kind under ./output/<GSTIN>/records, xlsx: one small workbook per EWB."
+        )
+        record_batch_rows = st.number_input(
+            "Records per Parquet file", min_value=100, max_value=1000000, value=int(config["record_batch_rows"])
+        )
+        memory_limit_mb = st.number_input(
+            "Memory ceiling for merges (MB, 0 = none)", min_value=0, max_value=262144, value=int(config["memory_limit_mb"]),
+            help="Above it the merges work in smaller chunks. Peak memory per stage (📈) is logged for every GSTIN."
+        )
+        merge_chunk_rows = st.number_input(
+            "Rows per merge chunk", min_value=1000, max_value=1000000, value=int(config["merge_chunk_rows"])
+        )
+        toll_formula_flag = st.checkbox(
+            "Toll columns as Excel formulas", value=config["toll_formula_flag"],
+            help="Off: toll states and links are filled in when the stock statement is written, the workbook opens without recalculating."
+        )
+        postprocess_workers = st.number_input(
+            "Post-processing worker processes (0 = inline)", min_value=0, max_value=16, value=int(config["postprocess_workers"]),
+            help="Merges and stock statements run in these processes while the browser goes on with the next GSTIN."
+        )
+        postprocess_queue_size = st.number_input(
+            "Post-processing jobs queued at most", min_value=1, max_value=64, value=int(config["postprocess_queue_size"]),
+            help="The browser waits when this many merges/stock statements are pending. Utilisation (📊) is logged at the end."
+        )
+        parallel_contexts = st.number_input(
+            "Browser contexts working on GSTINs in parallel", min_value=1, max_value=16, value=int(config["parallel_contexts"]),
+            help="The extra contexts reuse the login (one CAPTCHA/OTP). Each logs to its own file beside the main log, e.g. log_ctx2.txt."
+        )
+        headless_flag = st.checkbox(
+            "Headless scraping after login", value=config["headless_flag"],
+            help="The browser window is only shown for the CAPTCHA/OTP login and closes once the session is handed over."
+        )
+        session_reuse_flag = st.checkbox(
+            "Reuse the saved portal login", value=config["session_reuse_flag"],
+            help="The login cookies are kept in ~/.eway_bill_processing/session_state.json (readable by you only) and reused for the same username while the portal accepts them. "
+                 "When the session expires mid-run the work pauses and the login window opens once."
+        )
+
     # Start button centered below both columns
     st.markdown("<div style='text-align: center; margin: 2rem 0;'>", unsafe_allow_html=True)
     run = st.button("🚀 Start Scraping", use_container_width=True, type="primary")
@@ -376,6 +551,12 @@ with tab1:
         if end_dt < start_dt:
             st.error("❌ End date must be the same or after start date.")
             st.stop()
+        for pattern in block_url_patterns + allow_url_patterns:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                st.error(f"❌ Invalid URL pattern {pattern!r}: {e}")
+                st.stop()
         st.success("✅ Scraping started! Switch to the 'Live Logs' tab to monitor progress.")
 
         config_data = {
@@ -391,7 +572,38 @@ with tab1:
             "end_date": end_dt.isoformat(),
             "extract_ewb_data_flag": extract_ewb_data_flag,
             "prepare_stock_statement_flag": prepare_stock_statement_flag,
-            "check_toll_data_flag": check_toll_data_flag
+            "check_toll_data_flag": check_toll_data_flag,
+            "download_concurrency": int(download_concurrency),
+            "report_engine": report_engine,
+            "ewb_detail_concurrency": int(ewb_detail_concurrency),
+            "ewb_cache_flag": ewb_cache_flag,
+            "ewb_cache_immutable_days": int(ewb_cache_immutable_days),
+            "resume_flag": resume_flag,
+            "incremental_sync_flag": incremental_sync_flag,
+            "incremental_grace_days": int(incremental_grace_days),
+            "state_group_skip_flag": state_group_skip_flag,
+            "state_group_skip_after": int(state_group_skip_after),
+            "state_group_probe_days": int(state_group_probe_days),
+            "state_group_full_sweep_days": int(state_group_full_sweep_days),
+            "report_window_months": int(report_window_months),
+            "report_row_limit": int(report_row_limit),
+            "request_filter_flag": request_filter_flag,
+            "block_resource_types": block_resource_types,
+            "block_url_patterns": block_url_patterns,
+            "allow_url_patterns": allow_url_patterns,
+            "step_timeout_sec": int(step_timeout_sec),
+            "direct_merge_flag": direct_merge_flag,
+            "convert_workers": int(convert_workers),
+            "record_sink": record_sink,
+            "record_batch_rows": int(record_batch_rows),
+            "memory_limit_mb": int(memory_limit_mb),
+            "merge_chunk_rows": int(merge_chunk_rows),
+            "toll_formula_flag": toll_formula_flag,
+            "postprocess_workers": int(postprocess_workers),
+            "postprocess_queue_size": int(postprocess_queue_size),
+            "parallel_contexts": int(parallel_contexts),
+            "headless_flag": headless_flag,
+            "session_reuse_flag": session_reuse_flag
         }
         with open(CONFIG_PATH, "w", encoding="utf-8") as f:
             json.dump(config_data, f, indent=2)
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# scraper_worker reads its config and log path from the command line when it is imported
+sys.argv = [sys.argv[0], "config.json", os.devnull]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
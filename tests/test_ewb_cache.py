@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+import scraper_worker as sw
+
+TOLL_PAGES = {
+    101: {"header": ["Toll Plaza", "State", "Date"], "rows": [["Khed Shivapur", "Maharashtra", "01/01/2024 10:00"]]},
+    102: {"header": ["Message"], "rows": []},
+}
+
+
+class _Page:
+    async def close(self):
+        pass
+
+
+class _Context:
+    async def new_page(self):
+        return _Page()
+
+
+class _Sink:
+    def __init__(self):
+        self.records = []
+
+    def write(self, kind, ewb_no, df):
+        self.records.append((kind, ewb_no))
+
+    def on_stored(self, callback):
+        callback()
+
+
+async def _fetch_toll(page, ewb_no, timeout):
+    return {"ewb": ewb_no, "items": TOLL_PAGES[ewb_no]}
+
+
+def test_crawl_caches_toll_pages_with_rows_only(tmp_path, monkeypatch):
+    monkeypatch.setitem(sw.ewb_crawl_kinds, "toll", (_fetch_toll,) + sw.ewb_crawl_kinds["toll"][1:])
+    cache = sw._open_ewb_cache(str(tmp_path / "ewb_cache.sqlite"))
+    queue = asyncio.Queue()
+    for idx, ewb_no in enumerate(TOLL_PAGES, start=1):
+        queue.put_nowait((idx, ewb_no, "toll"))
+    stats = {"toll": 0, "no_toll": 0, "toll_failure": 0}
+
+    asyncio.run(sw._ewb_crawl_worker(_Context(), queue, _Sink(), stats, 2, time.time(), cache, {}, None, "GSTIN"))
+
+    assert stats == {"toll": 1, "no_toll": 1, "toll_failure": 0}
+    assert sw._ewb_cache_get(cache, 101, "toll", 30)["items"] == TOLL_PAGES[101]
+    assert sw._ewb_cache_get(cache, 102, "toll", 30) is None
+
+
+class _FlakyContext(_Context):
+    def __init__(self, failures):
+        self.failures = failures
+
+    async def new_page(self):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("Target page, context or browser has been closed")
+        return _Page()
+
+
+def _crawl(context, workers):
+    queue = asyncio.Queue()
+    for idx, ewb_no in enumerate(TOLL_PAGES, start=1):
+        queue.put_nowait((idx, ewb_no, "toll"))
+    stats = {"toll": 0, "no_toll": 0, "toll_failure": 0}
+    sink = _Sink()
+
+    async def run():
+        await asyncio.gather(*(sw._ewb_crawl_worker(context, queue, sink, stats, 2, time.time(), None, {}, None, "GSTIN")
+                               for _ in range(workers)), return_exceptions=True)
+        sw._fail_unfetched(queue, sink, stats, 2, None, "GSTIN")
+
+    asyncio.run(run())
+    return stats
+
+
+def test_crawl_continues_when_a_page_fails_to_open(monkeypatch):
+    monkeypatch.setitem(sw.ewb_crawl_kinds, "toll", (_fetch_toll,) + sw.ewb_crawl_kinds["toll"][1:])
+
+    assert _crawl(_FlakyContext(failures=1), workers=2) == {"toll": 1, "no_toll": 1, "toll_failure": 0}
+
+
+def test_crawl_counts_unfetched_jobs_as_failures_when_no_page_opens(monkeypatch):
+    monkeypatch.setitem(sw.ewb_crawl_kinds, "toll", (_fetch_toll,) + sw.ewb_crawl_kinds["toll"][1:])
+
+    assert _crawl(_FlakyContext(failures=2), workers=2) == {"toll": 0, "no_toll": 0, "toll_failure": 2}
+
+
+async def _fetch_expired(page, ewb_no, timeout):
+    raise sw._SessionExpired("redirected to https://gstsso.nic.in/")
+
+
+def test_crawl_without_a_session_guard_counts_the_expired_ewbs_as_failures(monkeypatch):
+    monkeypatch.setitem(sw.ewb_crawl_kinds, "toll", (_fetch_expired,) + sw.ewb_crawl_kinds["toll"][1:])
+
+    assert _crawl(_Context(), workers=2) == {"toll": 0, "no_toll": 0, "toll_failure": 2}
@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+
+import scraper_worker as sw
+
+LABELS = """
+<span id="ctl00_ContentPlaceHolder1_lblApxDistDetails">120</span>
+<span id="ctl00_ContentPlaceHolder1_lblTransType">Regular</span>
+<span id="ctl00_ContentPlaceHolder1_txtGenBy">27AAAAA0000A1Z5 Supplier</span>
+<span id="ctl00_ContentPlaceHolder1_txtSypplyTo">29BBBBB0000B1Z5 Buyer</span>
+"""
+ITEM_TABLE = """
+<table id="ctl00_ContentPlaceHolder1_{id}" {style}>
+<tr><th>HSN Code</th><th>Product Name &amp;
+Desc.</th><th>Quantity</th><th>Taxable Amount Rs.</th></tr>
+<tr><td>10019910</td><td>Wheat</td><td>5000 KGS</td><td>1,25,000.50</td></tr>
+<tr><td>10019920</td><td></td><td>20 BAG</td><td>900</td></tr>
+</table>
+"""
+LAYOUTS = {
+    # Items in GVItemList (most EWBs)
+    "normal": LABELS + ITEM_TABLE.format(id="GVItemList", style=""),
+    # E-invoice EWB whose items are already shown in grd_items, GVItemList is in the markup but hidden
+    "irn_table": LABELS + ITEM_TABLE.format(id="GVItemList", style='style="display:none"') + ITEM_TABLE.format(id="grd_items", style=""),
+    # E-invoice EWB showing only the button that loads the IRN items
+    "irn_button": LABELS + '<input type="submit" id="ctl00_ContentPlaceHolder1_btn_irn" value="IRN Details" />',
+}
+
+
+@pytest.fixture(scope="module")
+def page():
+    sync_api = pytest.importorskip("playwright.sync_api")
+    with sync_api.sync_playwright() as p:
+        try:
+            browser = p.chromium.launch()
+        except Exception as e:
+            pytest.skip(f"no Chromium for Playwright: {e}")
+        yield browser.new_page()
+        browser.close()
+
+
+@pytest.mark.parametrize("variant", LAYOUTS)
+def test_print_page_layouts_are_told_apart(page, variant):
+    page.set_content(f"<html><head><title>E-Way Bill</title></head><body>{LAYOUTS[variant]}</body></html>")
+
+    data = page.evaluate(sw.EWB_PRINT_EXTRACT_JS)
+
+    assert data["variant"] == variant and data["ready"] and not data["login_form"]
+    assert (data["dist"], data["trans"], data["from"], data["to"]) == ("120", "Regular", "27AAAAA0000A1Z5 Supplier", "29BBBBB0000B1Z5 Buyer")
+    if variant == "irn_button":
+        assert data["items"] is None
+    else:
+        assert data["items"]["header"][0] == "HSN Code" and len(data["items"]["rows"]) == 2
+
+
+def test_print_page_with_missing_labels_is_not_ready(page):
+    body = LABELS.replace('<span id="ctl00_ContentPlaceHolder1_txtSypplyTo">29BBBBB0000B1Z5 Buyer</span>', "")
+    page.set_content(f"<html><body>{body}</body></html>")
+
+    data = page.evaluate(sw.EWB_PRINT_EXTRACT_JS)
+
+    assert not data["ready"] and data["to"] is None and data["dist"] == "120"
+    assert data["variant"] == "none" and data["items"] is None
+
+
+def test_login_page_is_reported_by_the_print_extract(page):
+    page.set_content('<html><head><title>Login</title></head><body><input id="txt_username" /></body></html>')
+
+    data = page.evaluate(sw.EWB_PRINT_EXTRACT_JS)
+
+    assert data["login_form"] and not data["ready"]
+
+
+ITEMS = {"header": ["HSN Code", "Product Name &\r\nDesc.", "Quantity", "Taxable Amount Rs."],
+         "rows": [["10019910", "Wheat", "5000 KGS", "1,25,000.50"], ["10019920", "", "20 BAG", "900"]]}
+
+
+def test_table_is_read_like_read_html():
+    df = sw._table_to_frame(ITEMS)
+
+    assert list(df.columns) == ["HSN Code", "Product Name & Desc.", "Quantity", "Taxable Amount Rs."]
+    assert df["HSN Code"].tolist() == [10019910, 10019920]
+    assert df["Taxable Amount Rs."].tolist() == [125000.5, 900]
+    assert df["Quantity"].tolist() == ["5000 KGS", "20 BAG"]
+    assert df["Product Name & Desc."].iloc[1] is np.nan
+
+
+def test_table_rows_are_padded_or_cut_to_the_header():
+    df = sw._table_to_frame({"header": ["HSN Code", "Quantity"], "rows": [["1001"], ["1002", "5", "extra"]]})
+
+    assert df.shape == (2, 2)
+    assert df["Quantity"].isna().tolist() == [True, False]
+    assert sw._table_to_frame({"header": [], "rows": [["a", "b"]]}).shape == (1, 2)
+
+
+class _Sink:
+    def __init__(self):
+        self.records = []
+
+    def write(self, kind, ewb_no, df):
+        self.records.append((kind, ewb_no, df))
+
+
+@pytest.mark.parametrize("variant, kind, status", [("normal", "items", "success"), ("irn_table", "irn", "irn"), ("irn_dialog", "dist", "dist")])
+def test_each_layout_is_written_as_its_record_kind(variant, kind, status):
+    sink = _Sink()
+    data = {"ewb": 101, "variant": variant, "items": ITEMS if variant != "irn_dialog" else None,
+            "dist": "120", "trans": "Regular", "from": "A", "to": None}  # a label the page did not have
+
+    assert sw._write_ewb_details(data, sink) == status
+    (written_kind, ewb_no, df), = sink.records
+    assert (written_kind, ewb_no) == (kind, 101)
+    assert df["ewb"].tolist() == [101] * len(df) and df["To"].isna().all()
+
+
+def test_page_without_an_item_table_is_a_failure():
+    sink = _Sink()
+
+    assert sw._write_ewb_details({"ewb": 101, "variant": "none", "items": None, "dist": None, "trans": None, "from": None, "to": None}, sink) == "failure"
+    assert sink.records == []
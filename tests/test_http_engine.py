@@ -0,0 +1,131 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+import requests
+
+import scraper_worker as sw
+
+GSTIN = "27AAAAA0000A1Z5"
+WORK_ITEM = (sw._IN_, ("January", 2024), "1", "Group")
+
+FORM_PAGE = """<html><body><form method="post" action="./GSTINBasedRpt.aspx">
+<input type="hidden" name="__VIEWSTATE" value="{viewstate}" />
+<input type="hidden" name="__EVENTVALIDATION" value="{validation}" />
+<input type="radio" id="ctl00_ContentPlaceHolder1_RBL_OutInward_0" name="ctl00$ContentPlaceHolder1$RBL_OutInward" value="O" checked="checked" />
+<input type="radio" id="ctl00_ContentPlaceHolder1_RBL_OutInward_1" name="ctl00$ContentPlaceHolder1$RBL_OutInward" value="I" />
+<input type="text" name="ctl00$ContentPlaceHolder1$txt_gstin" value="" />
+<input type="text" name="ctl00$ContentPlaceHolder1$txtDateFrom" value="" />
+<input type="text" name="ctl00$ContentPlaceHolder1$txtDateTo" value="" />
+<select name="ctl00$ContentPlaceHolder1$ddl_gstinstcode"><option value="0" selected="selected">Select State</option><option value="1">Group</option></select>
+<input type="submit" name="ctl00$ContentPlaceHolder1$btnsbmt" value="GO" />
+{export}
+</form></body></html>"""
+EXPORT_BUTTON = '<input type="submit" name="ctl00$ContentPlaceHolder1$btn_export_excel" value="Export to Excel" />'
+REPORT = b"<table><tr><th>EWB No.</th><th>Status</th></tr><tr><td>101</td><td>ACT</td></tr></table>"
+
+
+class _ReportForm(BaseHTTPRequestHandler):
+    """Stand-in for GSTINBasedRpt.aspx: the form, the GO result page and the Excel export."""
+
+    def log_message(self, *args):
+        pass
+
+    def _page(self, viewstate, validation, export=""):
+        body = FORM_PAGE.format(viewstate=viewstate, validation=validation, export=export).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/SessionExpired.aspx":
+            body = b'<form><input id="txt_username" /></form>'
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.server.gets += 1
+        if self.server.expired:
+            self.send_response(302)
+            self.send_header("Location", "/SessionExpired.aspx")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self._page("vs-form", "ev-form")
+
+    def do_POST(self):
+        fields = {k: v[0] for k, v in parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode()).items()}
+        self.server.posts.append(fields)
+        if sw.go_button_name in fields and fields["__VIEWSTATE"] == "vs-form" and fields["__EVENTVALIDATION"] == "ev-form":
+            self._page("vs-result", "ev-result", EXPORT_BUTTON if self.server.has_rows else "")
+        elif sw.export_excel_button_name in fields and fields["__VIEWSTATE"] == "vs-result" and fields["__EVENTVALIDATION"] == "ev-result":
+            self.send_response(200)
+            self.send_header("Content-Type", "application/vnd.ms-excel")
+            self.send_header("Content-Disposition", "attachment; filename=report.xls")
+            self.send_header("Content-Length", str(len(REPORT)))
+            self.end_headers()
+            self.wfile.write(REPORT)
+        else:
+            self._page("vs-form", "ev-form")  # a stale view state lands back on the empty form
+
+
+@pytest.fixture
+def report_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ReportForm)
+    server.posts, server.has_rows, server.gets, server.expired = [], True, 0, False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(sw, "GSTIN_BASED_RPT_URL", f"http://127.0.0.1:{server.server_port}/Verification/GSTINBasedRpt.aspx")
+    yield server
+    server.shutdown()
+
+
+def test_http_engine_carries_the_view_state_to_the_export(report_server, tmp_path):
+    left = sw.download_EWB_for_gstin_http(requests.Session(), GSTIN, [sw._IN_], str(tmp_path), [("January", 2024)], work_items=[WORK_ITEM])
+
+    assert left == []
+    go, export = report_server.posts
+    assert go["ctl00$ContentPlaceHolder1$txt_gstin"] == GSTIN
+    assert go["ctl00$ContentPlaceHolder1$RBL_OutInward"] == "I"
+    assert go["ctl00$ContentPlaceHolder1$ddl_gstinstcode"] == "1"
+    assert (go["ctl00$ContentPlaceHolder1$txtDateFrom"], go["ctl00$ContentPlaceHolder1$txtDateTo"]) == sw._period_dates(("January", 2024))
+    assert export["__VIEWSTATE"] == "vs-result" and sw.export_excel_button_name in export
+    with open(os.path.join(tmp_path, sw._report_file_name(GSTIN, WORK_ITEM) + ".xls"), "rb") as f:
+        assert f.read() == REPORT
+
+
+def test_http_engine_records_a_report_without_rows_as_empty(report_server, tmp_path):
+    report_server.has_rows = False
+    manifest = sw._open_run_manifest(str(tmp_path / "run_manifest.sqlite"))
+
+    left = sw.download_EWB_for_gstin_http(requests.Session(), GSTIN, [sw._IN_], str(tmp_path), [("January", 2024)], work_items=[WORK_ITEM], manifest=manifest)
+
+    assert left == []
+    assert len(report_server.posts) == 1
+    assert sw._manifest_statuses(manifest, GSTIN, "download") == {sw._download_unit_key(WORK_ITEM): "empty"}
+
+
+def test_http_engine_stops_the_queue_at_the_first_login_redirect(report_server, tmp_path):
+    report_server.expired = True
+    work_items = [(sw._IN_, ("January", 2024), state, f"Group {state}") for state in "1234"]
+
+    left = sw.download_EWB_for_gstin_http(requests.Session(), GSTIN, [sw._IN_], str(tmp_path), None, work_items=work_items)
+
+    assert sorted(left) == sorted(work_items)
+    assert report_server.gets == 1 and report_server.posts == []
+
+
+def test_every_http_worker_gets_its_own_session_with_the_lane_cookies():
+    session = requests.Session()
+    session.headers["User-Agent"] = "Chromium"
+    session.cookies.set("ASP.NET_SessionId", "abc", domain="mis.ewaybillgst.gov.in", path="/")
+
+    fork = sw._fork_http_session(session)
+
+    assert fork is not session and fork.cookies is not session.cookies
+    assert fork.headers["User-Agent"] == "Chromium"
+    assert fork.cookies.get("ASP.NET_SessionId", domain="mis.ewaybillgst.gov.in") == "abc"
@@ -0,0 +1,85 @@
+import os
+
+import pandas as pd
+
+import scraper_worker as sw
+
+GSTIN = "27AAAAA0000A1Z5"
+
+
+def test_merge_keeps_each_ewb_once_across_overlapping_reports(tmp_path):
+    window = tmp_path / f"In_{GSTIN}_2024_January-2024_June_Group.xlsx"
+    month = tmp_path / f"In_{GSTIN}_2024_March_Group.xlsx"
+    pd.DataFrame({"EWB No.": [1, 2, 3], "Status": ["old", "old", "old"]}).to_excel(window, index=False)
+    pd.DataFrame({"EWB No.": [2], "Status": ["new"]}).to_excel(month, index=False)
+    os.utime(window, (1, 1))
+
+    sw.xlsx_merge(str(tmp_path), GSTIN)
+
+    merged = pd.read_excel(tmp_path / f"Merged_{GSTIN}.xlsx")
+    assert sorted(merged["EWB No."]) == [1, 2, 3]
+    assert merged.set_index("EWB No.").loc[2, "Status"] == "new"
+
+
+def test_merge_keeps_the_columns_of_every_report(tmp_path):
+    pd.DataFrame({"EWB No.": [1], "Status": ["ACT"]}).to_excel(tmp_path / f"In_{GSTIN}_2024_January_Group.xlsx", index=False)
+    pd.DataFrame({"EWB No.": [2], "Status": ["ACT"], "Remarks": ["late"]}).to_excel(tmp_path / f"Out_{GSTIN}_2024_January_Group.xlsx", index=False)
+
+    sw.xlsx_merge(str(tmp_path), GSTIN)
+
+    merged = pd.read_excel(tmp_path / f"Merged_{GSTIN}.xlsx").set_index("EWB No.")
+    assert list(merged.columns) == ["Status", "Remarks"]
+    assert merged.loc[2, "Remarks"] == "late"
+
+
+def test_dedupe_tells_rows_apart_whose_hashes_collide(tmp_path):
+    # hash(-1) == hash(-2) in CPython, so the two rows share a hash()
+    writer = sw._XlsxAppender(str(tmp_path / "combined.xlsx"), dedupe=True)
+    writer.append(pd.DataFrame({"Qty": [-1, -2, -1]}))
+    writer.close()
+
+    assert (writer.rows_in, writer.rows) == (3, 2)
+    assert pd.read_excel(tmp_path / "combined.xlsx")["Qty"].tolist() == [-1, -2]
+
+
+def test_parse_reports_reads_the_reports_in_spawned_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(sw, "MIN_POOL_MB", 0)
+    for month in ("January", "February", "March", "April"):
+        with open(tmp_path / f"In_{GSTIN}_2024_{month}_Group.xls", "w") as f:
+            f.write(f"<table><tr><th>EWB No.</th><th>Month</th></tr><tr><td>1</td><td>{month}</td></tr></table>")
+
+    frames = sw.parse_reports(str(tmp_path), GSTIN, workers=2, write_xlsx=False)
+
+    assert sorted(frames) == sorted(f"In_{GSTIN}_2024_{month}_Group" for month in ("January", "February", "March", "April"))
+    assert pd.read_pickle(frames[f"In_{GSTIN}_2024_March_Group"])["Month"].tolist() == ["March"]
+    assert not list(tmp_path.glob("*.xlsx"))
+
+
+def test_merge_reads_the_spilled_reports_and_removes_them(tmp_path):
+    for month, ewb_no in (("January", 1), ("February", 2)):
+        with open(tmp_path / f"In_{GSTIN}_2024_{month}_Group.xls", "w") as f:
+            f.write(f"<table><tr><th>EWB No.</th><th>Month</th></tr><tr><td>{ewb_no}</td><td>{month}</td></tr></table>")
+    frames = sw.parse_reports(str(tmp_path), GSTIN, workers=1, write_xlsx=False)
+    # The merge takes the spilled frame, not the report on disk
+    pd.DataFrame({"EWB No.": [1], "Month": ["spilled"]}).to_pickle(frames[f"In_{GSTIN}_2024_January_Group"])
+
+    sw._merge_gstin_reports(str(tmp_path), GSTIN, None, False, 1, frames, 0, sw.MERGE_CHUNK_ROWS)
+
+    merged = pd.read_excel(tmp_path / f"Merged_{GSTIN}.xlsx")
+    assert sorted(merged["Month"]) == ["February", "spilled"]
+    assert frames == {}
+    assert not (tmp_path / sw.REPORT_SPILL_DIR).exists()
+
+
+def test_small_batches_of_reports_are_parsed_without_a_pool(tmp_path, monkeypatch, capsys):
+    for month in ("January", "February", "March", "April"):
+        with open(tmp_path / f"In_{GSTIN}_2024_{month}_Group.xls", "w") as f:
+            f.write(f"<table><tr><th>EWB No.</th><th>Month</th></tr><tr><td>1</td><td>{month}</td></tr></table>")
+
+    def no_pool(*args, **kwargs):
+        raise AssertionError("a process pool was started")
+    monkeypatch.setattr(sw, "ProcessPoolExecutor", no_pool)
+
+    assert len(sw.parse_reports(str(tmp_path), GSTIN, workers=2, write_xlsx=False)) == 4
+    sw.benchmark_xls_reader(str(tmp_path), workers=2)
+    assert "2 processes: skipped" in capsys.readouterr().out
@@ -0,0 +1,68 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import scraper_worker as sw
+
+
+def _stage(gate):
+    gate.wait(5)
+    return None
+
+
+def _pool():
+    pool = sw._PostProcessPool(0, 4)
+    # Threads instead of worker processes, the locking is the same
+    pool.executor = ThreadPoolExecutor(max_workers=2)
+    return pool
+
+
+def test_waiting_for_one_stage_does_not_block_the_other_lanes():
+    pool = _pool()
+    slow_gate, fast_gate = threading.Event(), threading.Event()
+    fast_gate.set()
+    booked = []
+    pool.submit("merge", "A", lambda: booked.append("A"), _stage, slow_gate)
+    waiter = threading.Thread(target=pool.wait_for, args=("merge", "A"))
+    waiter.start()
+
+    lane = threading.Thread(target=lambda: (pool.submit("merge", "B", lambda: booked.append("B"), _stage, fast_gate),
+                                            pool.wait_for("merge", "B")))
+    lane.start()
+    lane.join(2)
+
+    assert not lane.is_alive()
+    assert booked == ["B"]
+    slow_gate.set()
+    waiter.join(2)
+    pool.close()
+    assert sorted(booked) == ["A", "B"]
+
+
+def test_a_stage_is_booked_once_when_several_lanes_wait_for_it():
+    pool = _pool()
+    gate = threading.Event()
+    booked = []
+    pool.submit("merge", "A", lambda: booked.append("A"), _stage, gate)
+    waiters = [threading.Thread(target=pool.wait_for, args=("merge", "A")) for _ in range(3)]
+    for waiter in waiters:
+        waiter.start()
+    gate.set()
+    for waiter in waiters:
+        waiter.join(2)
+
+    assert booked == ["A"]
+    assert not pool.pending
+    pool.close()
+
+
+def test_stages_in_worker_processes_log_under_the_lane_of_the_submitter(tmp_path):
+    pool = sw._PostProcessPool(1, 4)
+    lane_log = tmp_path / "log_ctx2.txt"
+    token = sw._log_context.set(("ctx2", str(lane_log)))
+    try:
+        pool.submit("merge", "A", None, sw.log, "merged in the worker")
+    finally:
+        sw._log_context.reset(token)
+    pool.close()
+
+    assert "[ctx2] merged in the worker" in lane_log.read_text(encoding="utf-8")
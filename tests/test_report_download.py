@@ -0,0 +1,248 @@
+import itertools
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import scraper_worker as sw
+
+
+class _Page:
+    def __init__(self, visible=False):
+        self.visible, self.handlers, self.probed = visible, {}, []
+
+    def on(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+
+    def remove_listener(self, event, handler):
+        self.handlers[event].remove(handler)
+
+    def emit(self, event, value):
+        for handler in list(self.handlers.get(event, [])):
+            handler(value)
+
+    def is_visible(self, selector):
+        self.probed.append(selector)
+        return self.visible
+
+
+def _response(text):
+    return SimpleNamespace(text=lambda: text)
+
+
+def test_report_without_the_export_button_is_empty_without_asking_the_page():
+    page = _Page(visible=True)
+
+    assert not sw._report_has_data(page, _response("<form>No records</form>"))
+    assert page.probed == []
+
+
+def test_hidden_export_button_means_no_data():
+    markup = f'<input name="{sw.export_excel_button_name}" style="display:none" />'
+
+    assert not sw._report_has_data(_Page(visible=False), _response(markup))
+    assert sw._report_has_data(_Page(visible=True), _response(markup))
+
+
+def test_armed_event_keeps_the_value_and_time_it_fired():
+    page = _Page()
+    fired = sw._arm_event(page, "domcontentloaded")
+    page.emit("domcontentloaded", "first")
+    at = fired["at"]
+    time.sleep(0.01)
+    page.emit("domcontentloaded", "second")
+
+    assert fired["value"] == "first" and fired["at"] == at <= time.time() - 0.01
+    assert page.handlers["domcontentloaded"] == []
+    fired["disarm"]()  # nothing left to drop
+
+
+def test_armed_event_skips_the_values_it_does_not_accept():
+    page = _Page()
+    fired = sw._arm_event(page, "response", lambda value: value == "document")
+    page.emit("response", "image")
+    assert "at" not in fired
+    page.emit("response", "document")
+
+    assert fired["value"] == "document"
+
+
+def _group_history(tmp_path, history):
+    sync_state = sw._open_sync_state(str(tmp_path / "sync_state.sqlite"))
+    sync_state.executemany("INSERT INTO group_history (gstin, direction, state_value, month, hit, checked_at) VALUES ('GSTIN', ?, ?, ?, ?, ?)",
+                           history)
+    sync_state.commit()
+    return sync_state
+
+
+def test_state_groups_are_ordered_by_hits_and_cold_groups_skipped(tmp_path):
+    now = time.time()
+    sync_state = _group_history(tmp_path, [
+        (sw._IN_, "1", "2024-01", 1, now), (sw._IN_, "1", "2024-02", 0, now),
+        (sw._IN_, "2", "2024-01", 1, now), (sw._IN_, "2", "2024-02", 1, now),
+        (sw._IN_, "3", "2024-01", 0, now), (sw._IN_, "3", "2024-02", 0, now),  # cold: empty in its last 2 months
+        (sw._OUT_, "3", "2024-01", 0, now - 10 * 86400), (sw._OUT_, "3", "2024-02", 0, now - 10 * 86400),  # cold but due a probe
+    ])
+    work_items = [(direction, month_year, state_value, f"Group {state_value}")
+                  for direction in (sw._IN_, sw._OUT_) for month_year in (("March", 2024), ("April", 2024)) for state_value in ("1", "2", "3", "4")]
+
+    scheduled, skipped = sw._schedule_state_groups(sync_state, "GSTIN", work_items, skip_after=2, probe_days=7)
+
+    assert [(item[0], item[2]) for item in scheduled[:4]] == [(sw._IN_, "2")] * 2 + [(sw._IN_, "1")] * 2
+    assert skipped == [item for item in work_items if (item[0], item[2]) == (sw._IN_, "3")]
+    # Within a group (and among groups with equal hits) the input order is kept
+    assert scheduled[4:] == [item for item in work_items if item[0] == sw._OUT_ or item[2] == "4"]
+    assert [item[1] for item in scheduled[:2]] == [("March", 2024), ("April", 2024)]
+
+
+class _Tab(_Page):
+    """A GSTINBasedRpt.aspx tab: GO postbacks and downloads come back after the delay of their state group."""
+
+    def __init__(self, portal):
+        super().__init__(visible=True)
+        self.portal, self.id = portal, len(portal.tabs) + 1
+        self.url, self.context, self.main_frame = sw.GSTIN_BASED_RPT_URL, portal, object()
+        self.state = None
+
+    def goto(self, url, **kwargs):
+        pass
+
+    def wait_for_selector(self, selector, **kwargs):
+        pass
+
+    def evaluate(self, script, *args):
+        if script == sw.JS_LOGIN_CHECK:
+            return ["GSTIN Based Report", False]
+        self.portal.form_writes.append((self.id, "date"))
+
+    def fill(self, selector, value):
+        self.portal.form_writes.append((self.id, "gstin"))
+
+    def select_option(self, selector, value):
+        self.state = value
+
+    def click(self, selector, no_wait_after=False):
+        state = self.state
+        if selector == sw.go_button:
+            self.portal.submitted.append((self.id, state))
+            markup = "" if state in self.portal.empty else f'<input name="{sw.export_excel_button_name}" />'
+            response = SimpleNamespace(frame=self.main_frame, request=SimpleNamespace(is_navigation_request=lambda: True), text=lambda: markup)
+            self.portal.schedule(self, self.portal.delays.get(state, 0.01), ("response", response), ("domcontentloaded", self))
+        elif selector == sw.export_excel_button:
+            path = self.portal.tmp_path / f"download_{next(self.portal.counter)}"
+            path.write_text("<table><tr><th>EWB No.</th></tr><tr><td>1</td></tr></table>")
+            self.portal.schedule(self, 0.01, ("download", SimpleNamespace(path=lambda: str(path))))
+        else:
+            self.portal.form_writes.append((self.id, "radio"))
+
+    def wait_for_timeout(self, ms):
+        time.sleep(ms / 1000)
+        self.portal.dispatch()
+
+    def close(self):
+        pass
+
+
+class _Portal:
+    def __init__(self, tmp_path, delays=None, empty=()):
+        self.tmp_path, self.delays, self.empty = tmp_path, delays or {}, empty
+        self.tabs, self.scheduled, self.submitted, self.form_writes = [], [], [], []
+        self.counter = itertools.count()
+
+    def new_page(self):
+        self.tabs.append(_Tab(self))
+        return self.tabs[-1]
+
+    def schedule(self, tab, delay, *events):
+        self.scheduled.append((time.time() + delay, tab, events))
+
+    def dispatch(self):
+        due = [entry for entry in self.scheduled if entry[0] <= time.time()]
+        self.scheduled = [entry for entry in self.scheduled if entry[0] > time.time()]
+        for _, tab, events in sorted(due, key=lambda entry: entry[0]):
+            for event, value in events:
+                tab.emit(event, value)
+
+
+def _download(tmp_path, portal, states, concurrency, timeout=sw.DEFAULT_TIMEOUT):
+    manifest = sw._open_run_manifest(str(tmp_path / "run_manifest.sqlite"))
+    work_items = [(sw._IN_, ("January", 2024), state, f"Group {state}") for state in states]
+    downloads_dir = tmp_path / "reports"
+    downloads_dir.mkdir()
+    sw.download_EWB_for_gstin(portal.new_page(), "GSTIN", [sw._IN_], str(downloads_dir), None, concurrency,
+                              work_items=work_items, manifest=manifest, timeout=timeout)
+    return {unit.split("|")[-1]: status for unit, status in sw._manifest_statuses(manifest, "GSTIN", "download").items()}
+
+
+def test_tab_takes_the_next_item_as_soon_as_its_own_is_done(tmp_path):
+    portal = _Portal(tmp_path, delays={"1": 0.5}, empty={"3"})
+
+    statuses = _download(tmp_path, portal, ["1", "2", "3", "4", "5"], concurrency=2)
+
+    assert statuses == {"1": "done", "2": "done", "3": "empty", "4": "done", "5": "done"}
+    # The second tab works through the fast groups while the first one waits for its slow postback
+    assert portal.submitted == [(1, "1"), (2, "2"), (2, "3"), (2, "4"), (2, "5")]
+    assert sorted(path.name for path in (tmp_path / "reports").iterdir()) == [f"In_GSTIN_2024_January_Group {state}.xls" for state in "1245"]
+
+
+def test_tabs_fill_the_radio_gstin_and_dates_only_once(tmp_path):
+    portal = _Portal(tmp_path)
+
+    _download(tmp_path, portal, ["1", "2", "3", "4"], concurrency=2)
+
+    # One radio click, one GSTIN fill and the two date fields per tab, only the state group changes
+    assert sorted(portal.form_writes) == [(1, "date"), (1, "date"), (1, "gstin"), (1, "radio"),
+                                          (2, "date"), (2, "date"), (2, "gstin"), (2, "radio")]
+
+
+def test_postback_past_the_timeout_is_recorded_failed(tmp_path):
+    portal = _Portal(tmp_path, delays={"1": 5})
+
+    assert _download(tmp_path, portal, ["1", "2"], concurrency=1, timeout=200) == {"1": "failed", "2": "done"}
+
+
+class _Download:
+    def __init__(self, temp_path, fail=False):
+        self.temp_path, self.fail, self.saved_to = temp_path, fail, None
+
+    def path(self):
+        return self.temp_path
+
+    def save_as(self, path):
+        self.saved_to = path
+        with open(path, "w") as f:
+            f.write("<table><tr><th>EWB No.</th></tr>")
+            if self.fail:
+                raise OSError("connection reset while saving")
+            f.write("<tr><td>1</td></tr></table>")
+
+
+def test_download_is_renamed_into_place(tmp_path):
+    temp_path = tmp_path / "playwright-tmp"
+    temp_path.write_text("report")
+    file_path = tmp_path / "In_GSTIN_2024_January_Group 1.xls"
+
+    sw._save_download(_Download(str(temp_path)), str(file_path))
+
+    assert file_path.read_text() == "report" and not temp_path.exists()
+
+
+def test_download_from_another_filesystem_is_copied_through_a_partial_file(tmp_path):
+    file_path = tmp_path / "In_GSTIN_2024_January_Group 1.xls"
+    download = _Download(str(tmp_path / "gone" / "playwright-tmp"))  # os.replace fails as across filesystems
+
+    sw._save_download(download, str(file_path))
+
+    assert download.saved_to == str(file_path) + ".partial"
+    assert file_path.read_text().endswith("</table>")
+    assert os.listdir(tmp_path) == [file_path.name]
+
+
+def test_failed_copy_leaves_no_report_behind(tmp_path):
+    file_path = tmp_path / "In_GSTIN_2024_January_Group 1.xls"
+
+    with pytest.raises(OSError, match="connection reset"):
+        sw._save_download(_Download(str(tmp_path / "gone" / "playwright-tmp"), fail=True), str(file_path))
+
+    assert os.listdir(tmp_path) == []
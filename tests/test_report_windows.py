@@ -0,0 +1,75 @@
+from collections import deque
+
+import scraper_worker as sw
+
+MONTHS = [("January", 2024), ("February", 2024), ("March", 2024), ("May", 2024), ("June", 2024)]
+
+
+def _items(months, groups=(("1", "Group 1"),)):
+    return [(sw._IN_, month_year, state_value, state_name) for state_value, state_name in groups for month_year in months]
+
+
+def test_consecutive_months_of_a_state_group_are_planned_as_windows():
+    windows = sw._plan_report_windows(_items(MONTHS, (("2", "Group 2"), ("1", "Group 1"))), 2)
+
+    assert windows == [
+        (sw._IN_, (("January", 2024), ("February", 2024)), "2", "Group 2"),
+        (sw._IN_, ("March", 2024), "2", "Group 2"),  # April is not in the list, the run breaks there
+        (sw._IN_, (("May", 2024), ("June", 2024)), "2", "Group 2"),
+        (sw._IN_, (("January", 2024), ("February", 2024)), "1", "Group 1"),
+        (sw._IN_, ("March", 2024), "1", "Group 1"),
+        (sw._IN_, (("May", 2024), ("June", 2024)), "1", "Group 1"),
+    ]
+
+
+def test_one_month_windows_keep_the_work_items():
+    items = _items(MONTHS)
+
+    assert sw._plan_report_windows(items, 1) == items
+
+
+def test_window_is_split_in_halves_at_the_front_of_the_queue():
+    window = (sw._IN_, tuple(MONTHS[:3]), "1", "Group 1")
+    queue = deque([(sw._OUT_, ("January", 2024), "1", "Group 1")])
+
+    assert sw._split_report_window(queue, window, "timeout")
+    assert list(queue)[:2] == [(sw._IN_, ("January", 2024), "1", "Group 1"),
+                               (sw._IN_, (("February", 2024), ("March", 2024)), "1", "Group 1")]
+    assert not sw._split_report_window(queue, (sw._IN_, ("January", 2024), "1", "Group 1"), "timeout")
+    assert len(queue) == 3
+
+
+def _report(path, rows):
+    path.write_text("<table><tr><th>EWB No.</th></tr>" + "<tr><td>1</td></tr>" * rows + "</table>")
+    return str(path)
+
+
+def test_window_at_the_row_limit_is_split_and_its_file_removed(tmp_path):
+    window = (sw._IN_, tuple(MONTHS[:2]), "1", "Group 1")
+    queue = deque()
+    file_path = _report(tmp_path / "window.xls", 5)
+
+    assert sw._settle_over_limit(queue, "GSTIN", window, file_path, 5) == "split"
+    assert len(queue) == 2
+    assert not (tmp_path / "window.xls").exists()
+
+
+def test_single_month_at_the_row_limit_is_kept_but_failed(tmp_path):
+    month = (sw._IN_, ("January", 2024), "1", "Group 1")
+    queue = deque()
+    file_path = _report(tmp_path / "month.xls", 5)
+
+    error = sw._settle_over_limit(queue, "GSTIN", month, file_path, 5)
+    assert "row limit" in error
+    assert not queue and (tmp_path / "month.xls").exists()
+    assert sw._settle_over_limit(queue, "GSTIN", month, file_path, 6) is None
+    assert sw._settle_over_limit(queue, "GSTIN", month, file_path, 0) is None
+
+
+def test_reports_are_spanned_by_their_file_names(tmp_path):
+    for name in ("In_GSTIN_2024_January_Group 1", "In_GSTIN_2024_February-2024_March_Group 1", "Out_GSTIN_2024_January_Group 1"):
+        (tmp_path / f"{name}.xls").write_text("")
+
+    spans = sw._report_spans(str(tmp_path), "GSTIN", sw._IN_, "Group 1")
+
+    assert spans == {"In_GSTIN_2024_January_Group 1": (24288, 24288), "In_GSTIN_2024_February-2024_March_Group 1": (24289, 24290)}
@@ -0,0 +1,72 @@
+import asyncio
+from types import SimpleNamespace
+
+import scraper_worker as sw
+
+
+class _Context:
+    def __init__(self):
+        self.routes, self.handlers = [], {}
+
+    def route(self, pattern, handler):
+        self.routes.append(pattern)
+
+    def on(self, event, handler):
+        self.handlers[event] = handler
+
+
+def test_without_block_rules_requests_are_counted_but_not_routed():
+    request_filter = sw._new_request_filter([], [], [])
+    context = _Context()
+    sw._install_request_filter(context, request_filter)
+
+    context.handlers["request"](SimpleNamespace(resource_type="image", url="https://mis.ewaybillgst.gov.in/logo.png"))
+
+    assert context.routes == []
+    assert request_filter["allowed"] == {"image": 1}
+
+
+def test_block_rules_route_every_request():
+    context = _Context()
+    sw._install_request_filter(context, sw._new_request_filter(["image"], [], []))
+
+    assert context.routes == ["**/*"]
+    assert "request" not in context.handlers
+
+
+def test_invalid_patterns_are_left_out():
+    request_filter = sw._new_request_filter([], [r"doubleclick\.net", "("], ["[captcha"])
+
+    assert [pattern.pattern for pattern in request_filter["block_url_patterns"]] == [r"doubleclick\.net"]
+    assert request_filter["allow_url_patterns"] == []
+
+
+class _Request:
+    def __init__(self, body_size):
+        self.body_size, self.asked = body_size, 0
+
+    def sizes(self):
+        self.asked += 1
+        return {"responseBodySize": self.body_size}
+
+
+def test_response_bytes_fall_back_to_the_measured_size_without_content_length():
+    request_filter = sw._new_request_filter([], [], [])
+    announced, chunked = _Request(999), _Request(4096)
+
+    sw._count_response_bytes(request_filter, SimpleNamespace(headers={"content-length": "100"}, request=announced))
+    sw._count_response_bytes(request_filter, SimpleNamespace(headers={"transfer-encoding": "chunked"}, request=chunked))
+
+    assert request_filter["bytes"] == 100 + 4096
+    assert announced.asked == 0 and chunked.asked == 1
+
+
+def test_async_response_bytes_fall_back_to_the_measured_size():
+    class _AsyncRequest(_Request):
+        async def sizes(self):
+            return super().sizes()
+
+    request_filter = sw._new_request_filter([], [], [])
+    asyncio.run(sw._count_response_bytes_async(request_filter, SimpleNamespace(headers={}, request=_AsyncRequest(2048))))
+
+    assert request_filter["bytes"] == 2048
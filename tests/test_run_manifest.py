@@ -0,0 +1,104 @@
+import calendar
+import time
+from datetime import datetime
+
+import scraper_worker as sw
+
+GSTIN = "27AAAAA0000A1Z5"
+
+
+def _manifest(tmp_path):
+    return sw._open_run_manifest(str(tmp_path / "run_manifest.sqlite"))
+
+
+def _units(manifest):
+    return manifest.execute("SELECT kind, unit, status FROM units ORDER BY kind, unit").fetchall()
+
+
+def test_finished_run_clears_the_manifest(tmp_path):
+    manifest = _manifest(tmp_path)
+    run_started = time.time()
+    months = [("January", 2024), ("February", 2024)]
+    stage = sw._stage_unit("stock_statement", months)
+    sw._manifest_plan(manifest, GSTIN, "stage", [stage])
+    sw._manifest_plan(manifest, GSTIN, "details", ["101", "102"])
+    for ewb_no in ("101", "102"):
+        sw._manifest_set(manifest, GSTIN, "details", ewb_no, "done")
+    sw._manifest_consume(manifest, GSTIN, "details")
+    assert ("details", "101", "consumed") in _units(manifest)
+    sw._manifest_set(manifest, GSTIN, "stage", stage, "done")
+
+    sw._manifest_finish_run(manifest, [GSTIN], run_started)
+
+    assert _units(manifest) == []
+
+
+def test_consumed_units_are_not_fetched_again_while_their_records_are_kept(tmp_path):
+    manifest = _manifest(tmp_path)
+    sw._manifest_plan(manifest, GSTIN, "details", ["101"])
+    sw._manifest_set(manifest, GSTIN, "details", "101", "done")
+    sw._manifest_consume(manifest, GSTIN, "details")
+    record = tmp_path / "101000000001.xlsx"
+    record.write_bytes(b"")
+
+    # No crawl job is left, so the browser context is never touched
+    sw.ewb_crawl(None, ["101"], str(tmp_path), ("details",), manifest=manifest, gstin=GSTIN)
+
+    assert sw._manifest_statuses(manifest, GSTIN, "details") == {"101": "consumed"}
+    assert record.exists()
+
+
+def test_records_the_manifest_does_not_know_are_dropped_before_a_crawl(tmp_path):
+    manifest = _manifest(tmp_path)
+    record = tmp_path / "101000000001.xlsx"
+    record.write_bytes(b"")
+    sw._manifest_plan(manifest, GSTIN, "details", ["101000000001"])
+    sw._manifest_set(manifest, GSTIN, "details", "101000000001", "done")
+    sw._manifest_clear(manifest)
+
+    sw.ewb_crawl(None, [], str(tmp_path), ("details",), manifest=manifest, gstin=GSTIN)
+
+    assert not record.exists()
+
+
+def test_units_of_an_earlier_run_do_not_keep_the_manifest(tmp_path):
+    manifest = _manifest(tmp_path)
+    sw._manifest_plan(manifest, GSTIN, "stage", [sw._stage_unit("merge", [("January", 2024)])])
+    time.sleep(0.01)
+    run_started = time.time()
+    merge = sw._stage_unit("merge", [("March", 2024)])
+    sw._manifest_plan(manifest, GSTIN, "stage", [merge])
+    sw._manifest_set(manifest, GSTIN, "stage", merge, "done")
+
+    sw._manifest_finish_run(manifest, [GSTIN], run_started)
+
+    assert _units(manifest) == []
+
+
+def test_pending_units_of_this_run_keep_the_manifest(tmp_path):
+    manifest = _manifest(tmp_path)
+    run_started = time.time()
+    sw._manifest_plan(manifest, GSTIN, "details", ["101", "102"])
+    sw._manifest_set(manifest, GSTIN, "details", "101", "done")
+
+    sw._manifest_finish_run(manifest, [GSTIN], run_started)
+
+    assert ("details", "102", "pending") in _units(manifest)
+
+
+def test_stage_units_are_keyed_by_month_range():
+    assert sw._stage_unit("merge", [("January", 2024), ("March", 2024)]) == "merge|2024-01..2024-03"
+    assert sw._stage_unit("merge", [("January", 2024)]) != sw._stage_unit("merge", [("February", 2024)])
+
+
+def test_incremental_resume_queries_open_months_again(tmp_path):
+    manifest = _manifest(tmp_path)
+    today = datetime.today()
+    open_month = (calendar.month_name[today.month], today.year)
+    closed_month = ("January", 2020)
+    work_items = [("In", month_year, "1", "Group") for month_year in (closed_month, open_month)]
+    for item in work_items:
+        sw._manifest_set(manifest, GSTIN, "download", sw._download_unit_key(item), "empty")
+
+    assert sw._manifest_pending_downloads(manifest, GSTIN, work_items, str(tmp_path)) == []
+    assert sw._manifest_pending_downloads(manifest, GSTIN, work_items, str(tmp_path), grace_days=7) == [work_items[1]]
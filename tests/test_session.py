@@ -0,0 +1,68 @@
+import asyncio
+import json
+import os
+import stat
+
+import pytest
+
+import scraper_worker as sw
+
+
+def test_login_page_is_told_by_the_login_url_or_form_only():
+    assert sw._is_login_page("https://gstsso.nic.in/")
+    assert sw._is_login_page("https://mis.ewaybillgst.gov.in/Default.aspx", "E-Way Bill", has_login_form=True)
+    assert not sw._is_login_page("https://mis.ewaybillgst.gov.in/Verification/GSTINBasedRpt.aspx", "Login History Report")
+    assert not sw._is_login_page("https://mis.ewaybillgst.gov.in/Verify/EwayBillPrint.aspx?ewb_no=1", "Logout")
+
+
+def test_session_state_is_readable_by_the_user_only(tmp_path):
+    path = tmp_path / "state" / "session_state.json"
+    sw._save_session_state(str(path), "user1", {"cookies": [], "origins": []})
+
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(path.parent).st_mode) == 0o700
+    assert sw._load_session_state(str(path), "user1") == {"cookies": [], "origins": []}
+    assert not os.path.exists(str(path) + ".partial")
+
+
+def test_session_state_of_another_username_is_not_reused(tmp_path):
+    path = tmp_path / "session_state.json"
+    sw._save_session_state(str(path), "user1", {"cookies": [{"name": "ASP.NET_SessionId"}], "origins": []})
+
+    assert sw._load_session_state(str(path), "user2") is None
+    path.write_text(json.dumps({"cookies": [], "origins": []}))  # saved before the username was stored
+    assert sw._load_session_state(str(path), "user1") is None
+
+
+class _PrintPage:
+    """EwayBillPrint.aspx stand-in answering the single extract evaluate."""
+
+    def __init__(self, url, data):
+        self.url, self.data, self.evaluates = url, data, 0
+
+    async def goto(self, url, **kwargs):
+        pass
+
+    async def evaluate(self, script, *args):
+        self.evaluates += 1
+        return dict(self.data)
+
+
+PRINT_DATA = {"ready": True, "dist": "10", "trans": "Regular", "from": "A", "to": "B", "variant": "normal",
+              "items": {"header": ["HSN Code"], "rows": [["1001"]]}, "title": "E-Way Bill System", "login_form": False}
+
+
+def test_ewb_print_page_is_read_and_checked_for_the_login_in_one_round_trip():
+    page = _PrintPage("https://mis.ewaybillgst.gov.in/Verify/EwayBillPrint.aspx?ewb_no=1", PRINT_DATA)
+
+    data = asyncio.run(sw._fetch_ewb_print_async(page, 1))
+
+    assert data["variant"] == "normal" and page.evaluates == 1
+
+
+def test_ewb_print_page_on_the_login_form_raises_session_expired():
+    page = _PrintPage("https://mis.ewaybillgst.gov.in/Default.aspx", {**PRINT_DATA, "ready": False, "variant": "none", "login_form": True})
+
+    with pytest.raises(sw._SessionExpired):
+        asyncio.run(sw._fetch_ewb_print_async(page, 1))
+    assert page.evaluates == 1
@@ -0,0 +1,159 @@
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+
+import scraper_worker as sw
+
+GSTIN = "27AAAAA0000A1Z5"
+
+
+def test_normalise_units_uses_the_base_unit_of_each_hsn():
+    final = pd.DataFrame({
+        'HSN4': pd.Categorical(['1001', '1001', '1001', '2523', '2523']),
+        'Qty': [5000.0, 2.0, 1500.0, 100.0, 3.0],
+        'Unit': pd.Categorical(['KGS', 'MTS', 'KGS', 'BAGS', 'BAG']),
+    })
+    result = sw._normalise_units(final)
+    assert result['Unit'].astype(str).tolist() == ['MTS', 'MTS', 'MTS', 'BAG', 'BAG']
+    assert result['Qty'].tolist() == pytest.approx([5.0, 2.0, 1.5, 100.0, 3.0])
+    assert (result['Unit Flag'] == '').all()
+
+
+def test_normalise_units_flags_units_it_cannot_convert():
+    final = pd.DataFrame({
+        'HSN4': ['7208', '7208', '7208', '7208'],
+        'Qty': [2500.0, 3.0, 7.0, 4.0],
+        'Unit': ['KGS', 'MTS', 'BOX', 'XYZ'],
+    })
+    result = sw._normalise_units(final)
+    assert result['Qty'].tolist() == pytest.approx([2.5, 3.0, 7.0, 4.0])
+    assert result['Unit Flag'].tolist() == ['', '', 'BOX not convertible to MTS', 'Unknown unit XYZ']
+
+
+def _merged_report(path, rows):
+    pd.DataFrame([{
+        'EWB No.': ewb_no, 'EWB No. & Dt.': f"{ewb_no} - {day:02d}/01/2024 10:00:00", 'Doc No. & Dt.': 'd',
+        'From GSTIN & Name': f"{GSTIN} Self" if outward else 'OTHER Supplier',
+        'To GSTIN & Name': 'OTHER Buyer' if outward else f"{GSTIN} Self",
+        'Assess Val.': 100.0, 'Tax Val.': 18.0, 'HSN Code': hsn, 'HSN Desc.': 'desc',
+        'Latest Vehicle No.': 'MH01', 'From Place & Pin': 'A', 'To Place & Pin': 'B',
+    } for ewb_no, day, outward, hsn in rows]).to_excel(path, index=False)
+
+
+# (EWB, day, outward, HSN, quantity as printed on the EWB)
+EWBS = [
+    (100000000001, 1, False, 10019910, "5000 KGS"),
+    (100000000002, 2, False, 10019910, "2 MTS"),
+    (100000000003, 3, True, 10019910, "1500 KGS"),
+    (100000000004, 1, False, 25232930, "100 BAGS"),
+    (100000000005, 2, True, 25232930, "40 BAG"),
+]
+
+
+def _crawled_gstin(tmp_path):
+    """Merged report and crawled item records of EWBS, returns the merged EWB frame."""
+    merged_path = tmp_path / f"Merged_{GSTIN}.xlsx"
+    _merged_report(merged_path, [row[:4] for row in EWBS])
+    sink = sw._open_record_sink(str(tmp_path), "xlsx")
+    for ewb_no, _, _, hsn, quantity in EWBS:
+        sw._write_ewb_details({"ewb": ewb_no, "dist": "10", "trans": "Reg", "from": "A", "to": "B", "variant": "normal",
+                               "items": {"header": ["HSN Code", "Quantity", "Taxable Amount Rs."], "rows": [[str(hsn), quantity, "5"]]}}, sink)
+    sink.close()
+    return sw._load_merged_ewbs(str(merged_path))
+
+
+def test_stock_statement_balances_in_the_base_unit(tmp_path):
+    edfm = _crawled_gstin(tmp_path)
+
+    assert sw.xlsx_mergejoinsort_stock_stmt(str(tmp_path), f"Merged_{GSTIN}", edfm)
+
+    sheets = pd.read_excel(tmp_path / f"Merged_{GSTIN}_stockstmnt.xlsx", sheet_name=None)
+    wheat, cement = sheets['1001'], sheets['2523']
+    assert set(wheat['Unit']) == {'MTS'} and set(cement['Unit']) == {'BAG'}
+    assert wheat['Unit Flag'].isna().all() and cement['Unit Flag'].isna().all()
+    assert wheat['CB'].iloc[-1] == pytest.approx(5.5)
+    assert cement['CB'].iloc[-1] == pytest.approx(60)
+
+
+def test_stock_statement_streamed_one_record_at_a_time_is_the_same(tmp_path):
+    whole, streamed = tmp_path / "whole", tmp_path / "streamed"
+    whole.mkdir(), streamed.mkdir()
+    edfm = _crawled_gstin(whole)
+    _crawled_gstin(streamed)
+
+    assert sw.xlsx_mergejoinsort_stock_stmt(str(whole), f"Merged_{GSTIN}", edfm)
+    watch = sw._MemoryWatch("stock statement", GSTIN, chunk_rows=1)
+    assert sw.xlsx_mergejoinsort_stock_stmt(str(streamed), f"Merged_{GSTIN}", edfm, watch=watch)
+
+    expected = pd.read_excel(whole / f"Merged_{GSTIN}_stockstmnt.xlsx", sheet_name=None)
+    sheets = pd.read_excel(streamed / f"Merged_{GSTIN}_stockstmnt.xlsx", sheet_name=None)
+    assert list(sheets) == list(expected) == ['1001', '2523']
+    for name, frame in expected.items():
+        pd.testing.assert_frame_equal(sheets[name], frame)
+    # The per-HSN partitions are spilled next to the records and removed with the statement
+    assert not list(streamed.glob(".stockstmnt_*"))
+
+
+def test_statement_stage_removes_the_records_once_saved(tmp_path):
+    edfm = _crawled_gstin(tmp_path)
+
+    sw._build_gstin_statements(str(tmp_path), GSTIN, ("details",), edfm, False, 0)
+
+    assert (tmp_path / f"Merged_{GSTIN}_stockstmnt.xlsx").exists()
+    assert not list(tmp_path.glob("1000000000*.xlsx"))
+
+
+def test_statement_stage_keeps_the_records_when_it_fails(tmp_path):
+    _crawled_gstin(tmp_path)
+
+    with pytest.raises(RuntimeError):
+        sw._build_gstin_statements(str(tmp_path), GSTIN, ("details",), pd.DataFrame(), False, 0)
+
+    assert len(list(tmp_path.glob("1000000000*.xlsx"))) == len(EWBS)
+
+
+@pytest.mark.parametrize("header_only", [False, True])
+def test_empty_merged_file_loads_with_the_full_schema(tmp_path, header_only):
+    merged_path = tmp_path / f"Merged_{GSTIN}.xlsx"
+    if header_only:
+        pd.DataFrame(columns=['EWB No.', 'EWB No. & Dt.', 'HSN Code']).to_excel(merged_path, index=False)
+    else:
+        pd.DataFrame().to_excel(merged_path, index=False)
+
+    edfm = sw._load_merged_ewbs(str(merged_path))
+
+    assert edfm.empty
+    for column in [*sw.MERGED_EWB_SCHEMA, 'DateTime', 'HSN4', 'ewb', 'Doc No. & Dt.']:
+        assert column in edfm.columns
+    assert edfm['DateTime'].dtype.kind == 'M'
+    assert edfm['EWB No.'].dtype == 'int64'
+
+
+def test_toll_links_point_at_the_first_toll_data_row_of_every_ewb():
+    toll_data = pd.DataFrame({'ewb': [101, 101, 102, 103], 'Toll Plaza': ['A', 'B', 'C', 'D']})
+    toll_uniq = pd.DataFrame({'ewb': [101, 102], 'State': ['Maharashtra, Karnataka', 'Gujarat']})
+
+    toll_rows, toll_states = sw._toll_links((toll_data, toll_uniq))
+
+    # Excel rows: the header is row 1, so the first data row is row 2
+    assert toll_rows == {101: 2, 102: 4, 103: 5}
+    assert toll_states == {101: 'Maharashtra, Karnataka', 102: 'Gujarat'}
+    assert sw._toll_links(None) == ({}, {})
+    assert sw._toll_links((pd.DataFrame({'Message': ['No toll data']}), None)) == ({}, {})
+
+
+def test_hyperlinks_stop_at_the_sheet_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(sw, "MAX_SHEET_LINKS", 2)
+    path = tmp_path / "links.xlsx"
+    rows = pd.DataFrame({'EWB Toll': [101, 102, 103]})
+    links = {'EWB Toll': pd.Series(['TollData!A2', 'TollData!A4', 'TollData!A5'])}
+    book = sw._XlsxAppender(str(path))
+    book.append(rows, sheet='1001', links=links)
+    book.append(rows, sheet='2523', links=links)
+    book.close()
+
+    wb = load_workbook(path)
+    for sheet in ('1001', '2523'):  # the limit is per sheet
+        cells = [row[0] for row in wb[sheet].iter_rows(min_row=2)]
+        assert [cell.value for cell in cells] == [101, 102, 103]
+        assert [cell.hyperlink.location if cell.hyperlink else None for cell in cells] == ['TollData!A2', 'TollData!A4', None]